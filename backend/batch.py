@@ -0,0 +1,345 @@
+import asyncio
+import csv
+import io
+import json
+from typing import AsyncIterator, Awaitable, Callable, List, Optional
+
+from sqlalchemy import select, update, func
+from sqlalchemy.orm import undefer
+
+from config import settings
+from database import AsyncSessionLocal
+from models import Generation, BatchRun, BatchUnit
+from chapter_store import save_content, load_content, prepare_chapters, chapter_writer
+from outline_schema import dump_outline
+from question_store import replace_questions
+from search_index import index_outline, index_unit_questions
+from lease_worker import LeaseWorker
+
+# 單元依序完成的階段；stage 為 None 表示尚未完成任何階段
+STAGES = ("outline", "content", "questions")
+
+# 批次中仍需處理的單元狀態
+ACTIVE_UNIT_STATUSES = ("pending", "running")
+
+# CSV 欄位名稱（英文或中文標題皆可）
+_FIELD_ALIASES = {
+    "subject": ("subject", "科目"),
+    "grade": ("grade", "年級"),
+    "unit": ("unit", "單元"),
+}
+
+
+def unit_key(subject: str, grade: str, unit: str) -> str:
+    """
+    正規化的單元鍵：去除前後空白、合併連續空白並忽略大小寫，用於合併重複單元
+    """
+    return "|".join(" ".join(value.split()).casefold() for value in (subject, grade, unit))
+
+
+def _pick(row: dict, field: str) -> str:
+    for name in _FIELD_ALIASES[field]:
+        value = row.get(name)
+        if value is not None and str(value).strip():
+            return str(value).strip()
+    return ""
+
+
+def _validate(rows: List[dict], start_line: int = 1) -> List[dict]:
+    units = []
+    for line, row in enumerate(rows, start=start_line):
+        unit = {field: _pick(row, field) for field in _FIELD_ALIASES}
+        missing = [field for field, value in unit.items() if not value]
+        if missing:
+            raise ValueError(f"第 {line} 行缺少欄位: {', '.join(missing)}")
+        units.append(unit)
+    return units
+
+
+def parse_units(text: str, filename: str = None) -> List[dict]:
+    """
+    解析單元清單：支援 CSV（標題列為 subject,grade,unit 或 科目,年級,單元）與 JSONL（每行一個物件）
+    依副檔名判斷格式，沒有副檔名時以第一個非空白行是否以 { 開頭判斷
+    """
+    text = text.lstrip("\ufeff")
+    name = (filename or "").lower()
+    if name.endswith((".jsonl", ".ndjson")):
+        is_jsonl = True
+    elif name.endswith(".csv"):
+        is_jsonl = False
+    else:
+        first = next((line for line in text.splitlines() if line.strip()), "")
+        is_jsonl = first.lstrip().startswith("{")
+
+    if not is_jsonl:
+        reader = csv.DictReader(io.StringIO(text))
+        # 標題列為第 1 行，資料從第 2 行開始
+        return _validate(list(reader), start_line=2)
+
+    units = []
+    for line, raw in enumerate(text.splitlines(), start=1):
+        if not raw.strip():
+            continue
+        try:
+            row = json.loads(raw)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"第 {line} 行不是有效的 JSON: {e}")
+        if not isinstance(row, dict):
+            raise ValueError(f"第 {line} 行必須是 JSON 物件")
+        units.extend(_validate([row], start_line=line))
+    return units
+
+
+async def submit_batch(db, units: List[dict], name: str = None, use_cache: bool = True,
+                       chapter_mode: str = "separate") -> BatchRun:
+    """
+    建立批次並為每個不重複的單元建立待處理記錄
+    - 同一批次中正規化後相同的單元只生成一次
+    - 使用快取時，先前批次已完成的相同單元直接標記為 skipped 並沿用其生成記錄
+    """
+    unique = {}
+    for unit in units:
+        unique.setdefault(unit_key(unit["subject"], unit["grade"], unit["unit"]), unit)
+
+    completed = {}
+    if use_cache and unique:
+        rows = (await db.execute(
+            select(BatchUnit.unit_key, BatchUnit.generation_id)
+            .where(
+                BatchUnit.unit_key.in_(list(unique)),
+                BatchUnit.status.in_(("completed", "skipped")),
+                BatchUnit.generation_id.is_not(None),
+            )
+            .order_by(BatchUnit.id)
+        )).all()
+        # 同一單元有多筆時沿用最新的生成記錄
+        completed = {key: generation_id for key, generation_id in rows}
+
+    batch = BatchRun(
+        name=name,
+        use_cache=use_cache,
+        chapter_mode=chapter_mode,
+        status="running",
+        total=len(unique),
+        duplicates=len(units) - len(unique),
+    )
+    db.add(batch)
+    await db.flush()
+
+    for key, unit in unique.items():
+        generation_id = completed.get(key)
+        db.add(BatchUnit(
+            batch_id=batch.id,
+            subject=unit["subject"],
+            grade=unit["grade"],
+            unit=unit["unit"],
+            unit_key=key,
+            status="skipped" if generation_id else "pending",
+            stage=STAGES[-1] if generation_id else None,
+            generation_id=generation_id,
+        ))
+    await db.flush()
+    await refresh_batch_status(db, batch.id)
+    await db.commit()
+    return batch
+
+
+async def batch_counts(db, batch_id: int) -> dict:
+    rows = (await db.execute(
+        select(BatchUnit.status, func.count())
+        .where(BatchUnit.batch_id == batch_id)
+        .group_by(BatchUnit.status)
+    )).all()
+    counts = {status: 0 for status in ("pending", "running", "completed", "failed", "skipped")}
+    counts.update({status: count for status, count in rows})
+    return counts
+
+
+async def refresh_batch_status(db, batch_id: int) -> str:
+    """
+    依單元狀態更新批次狀態：仍有待處理或執行中的單元時為 running，否則依是否有失敗單元決定；呼叫端負責 commit
+    """
+    counts = await batch_counts(db, batch_id)
+    if any(counts[status] for status in ACTIVE_UNIT_STATUSES):
+        status = "running"
+    else:
+        status = "failed" if counts["failed"] else "completed"
+    await db.execute(update(BatchRun).where(BatchRun.id == batch_id).values(status=status))
+    return status
+
+
+async def resume_batch(db, batch: BatchRun) -> int:
+    """
+    重新執行批次中失敗的單元：從最後完成的階段繼續；返回重新排入的單元數
+    """
+    result = await db.execute(
+        update(BatchUnit)
+        .where(BatchUnit.batch_id == batch.id, BatchUnit.status == "failed")
+        .values(status="pending", error=None)
+    )
+    await refresh_batch_status(db, batch.id)
+    await db.commit()
+    return result.rowcount
+
+
+def unit_to_dict(unit: BatchUnit) -> dict:
+    return {
+        "id": unit.id,
+        "subject": unit.subject,
+        "grade": unit.grade,
+        "unit": unit.unit,
+        "status": unit.status,
+        "stage": unit.stage,
+        "generation_id": unit.generation_id,
+        "error": unit.error,
+        "attempts": unit.attempts,
+    }
+
+
+async def iter_batch_report(batch_id: int, poll_interval: float = None) -> AsyncIterator[dict]:
+    """
+    批次進度報告：先送出所有單元目前的狀態，之後每次輪詢只送出狀態或階段有變化的單元，
+    批次結束後送出總結（type 為 summary）
+    """
+    poll_interval = poll_interval or settings.JOB_POLL_INTERVAL
+    seen = {}
+    while True:
+        async with AsyncSessionLocal() as db:
+            batch = await db.get(BatchRun, batch_id)
+            if batch is None:
+                return
+            units = (await db.execute(
+                select(BatchUnit).where(BatchUnit.batch_id == batch_id).order_by(BatchUnit.id)
+            )).scalars().all()
+            counts = await batch_counts(db, batch_id)
+
+        for unit in units:
+            state = (unit.status, unit.stage, unit.attempts)
+            if seen.get(unit.id) != state:
+                seen[unit.id] = state
+                yield {"type": "unit", "batch_id": batch_id, **unit_to_dict(unit)}
+
+        if batch.status != "running":
+            yield {
+                "type": "summary",
+                "batch_id": batch_id,
+                "status": batch.status,
+                "total": batch.total,
+                "duplicates": batch.duplicates,
+                "counts": counts,
+            }
+            return
+        await asyncio.sleep(poll_interval)
+
+
+class BatchRunner(LeaseWorker):
+    """
+    批次生成執行器：與 JobRunner 相同以 LeaseWorker 的租約領取單元
+    - 每個 worker 一次處理一個單元，num_workers 即為全域同時處理的單元數；
+      LLM 呼叫另受共用速率限制器（LLM_RPM_LIMIT / LLM_TPM_LIMIT）限制
+    - 每完成一個階段（教材階段為每個章節）即寫入資料庫，中斷或失敗後重新執行時從未完成的部分繼續
+    """
+
+    model = BatchUnit
+    pending_status = "pending"
+    order_by = "id"
+    label = "批次單元"
+
+    def __init__(self, service, on_progress: Optional[Callable[..., Awaitable]] = None,
+                 num_workers: int = None, poll_interval: float = None,
+                 lease_seconds: int = None):
+        super().__init__(service, on_progress, num_workers or settings.BATCH_WORKERS,
+                         poll_interval, lease_seconds)
+
+    async def _run(self, unit_id: int):
+        async with AsyncSessionLocal() as db:
+            unit = await db.get(BatchUnit, unit_id)
+            batch = await db.get(BatchRun, unit.batch_id)
+        subject, grade, name = unit.subject, unit.grade, unit.unit
+        stage, generation_id = unit.stage, unit.generation_id
+        if generation_id is None:
+            # 生成記錄已被刪除：從大綱重新開始
+            stage = None
+
+        if stage is None:
+            outline_model = await self.service.generate_outline(
+                subject, grade, name, use_cache=batch.use_cache
+            )
+            outline = dump_outline(outline_model)
+            async with AsyncSessionLocal() as db:
+                generation = Generation(subject=subject, grade=grade, unit=name, outline=outline,
+                                        outline_data=outline_model.model_dump())
+                db.add(generation)
+                await db.flush()
+                generation_id = generation.id
+                await index_outline(db, generation_id, name, outline)
+                await self._checkpoint(db, unit_id, "outline", generation_id=generation_id)
+            stage = "outline"
+
+        if stage == "outline":
+            # 結構化大綱先建立章節骨架，每完成一章即寫入，重新執行時只生成未完成的章節
+            async with AsyncSessionLocal() as db:
+                generation = await db.get(
+                    Generation, generation_id, options=[undefer(Generation.outline_data)]
+                )
+                outline = generation.outline
+                outline_data = generation.outline_data
+                unfinished = None
+                if outline_data is not None:
+                    unfinished = await prepare_chapters(db, generation, outline_data)
+                    await db.commit()
+
+            progress = {"current": 0, "total": 0}
+
+            async def progress_callback(current, total):
+                progress.update(current=current, total=total)
+                await self._report(generation_id, current, total, "processing")
+
+            content = await self.service.generate_content(
+                subject, grade, name, outline_data or outline,
+                progress_callback=progress_callback,
+                use_cache=batch.use_cache,
+                chapter_mode=batch.chapter_mode,
+                chapter_numbers=unfinished,
+                chapter_callback=chapter_writer(generation_id) if outline_data else None,
+            )
+            async with AsyncSessionLocal() as db:
+                if outline_data is None:
+                    # 備用方法生成的 Markdown 沒有章節，整份寫入
+                    await save_content(db, await db.get(Generation, generation_id), content)
+                await self._checkpoint(db, unit_id, "content")
+            await self._report(generation_id, progress["current"], progress["total"], "completed")
+            stage = "content"
+
+        if stage == "content":
+            async with AsyncSessionLocal() as db:
+                content = await load_content(db, await db.get(Generation, generation_id))
+            questions = await self.service.generate_questions(
+                subject, grade, name, content, use_cache=batch.use_cache
+            )
+            async with AsyncSessionLocal() as db:
+                await db.execute(
+                    update(Generation)
+                    .where(Generation.id == generation_id)
+                    .values(questions=questions, version=Generation.version + 1)
+                )
+                await replace_questions(db, generation_id, None, questions)
+                await index_unit_questions(db, generation_id, questions)
+                await self._checkpoint(db, unit_id, "questions")
+
+        await self._finish(unit_id, "completed")
+
+    async def _checkpoint(self, db, unit_id: int, stage: str, **values):
+        """
+        與該階段的生成結果在同一個交易中記錄完成的階段
+        """
+        await db.execute(
+            update(BatchUnit).where(BatchUnit.id == unit_id).values(stage=stage, **values)
+        )
+        await db.commit()
+
+    async def _after_finish(self, db, unit_id: int):
+        batch_id = (await db.execute(
+            select(BatchUnit.batch_id).where(BatchUnit.id == unit_id)
+        )).scalar()
+        await refresh_batch_status(db, batch_id)
@@ -0,0 +1,82 @@
+"""
+批次生成命令列工具：不需啟動 API 服務，直接在本程序內執行批次並以 NDJSON 輸出各單元狀態
+
+在 backend 目錄下執行：
+    python batch_cli.py units.csv --workers 4 --chapter-mode combined
+    python batch_cli.py units.jsonl --name 113上學期 > report.ndjson
+    python batch_cli.py --resume 3
+
+單元清單為 CSV（標題列 subject,grade,unit 或 科目,年級,單元）或 JSONL（每行一個單元）。
+進度逐單元寫入資料庫：中斷後以 --resume 繼續同一批次，或重新提交同一份清單（已完成的單元會被略過）。
+所有單元皆成功時結束代碼為 0，有失敗的單元時為 1。
+"""
+import argparse
+import asyncio
+import json
+import sys
+from contextlib import redirect_stdout
+
+from database import engine, AsyncSessionLocal
+from migrations import run_migrations
+from models import BatchRun
+from batch import BatchRunner, submit_batch, resume_batch, iter_batch_report, parse_units
+from groq_service import AsyncGroqService
+
+
+async def run(args, out) -> int:
+    async with AsyncSessionLocal() as db:
+        if args.resume:
+            batch = await db.get(BatchRun, args.resume)
+            if batch is None:
+                print(f"找不到批次 {args.resume}", file=sys.stderr)
+                return 2
+            await resume_batch(db, batch)
+        else:
+            with open(args.file, encoding="utf-8") as f:
+                units = parse_units(f.read(), args.file)
+            batch = await submit_batch(
+                db, units, name=args.name or args.file,
+                use_cache=not args.fresh, chapter_mode=args.chapter_mode
+            )
+        batch_id = batch.id
+
+    runner = BatchRunner(AsyncGroqService(), num_workers=args.workers)
+    runner.start()
+    status = "failed"
+    try:
+        async for item in iter_batch_report(batch_id, poll_interval=args.poll_interval):
+            print(json.dumps(item, ensure_ascii=False), file=out, flush=True)
+            if item["type"] == "summary":
+                status = item["status"]
+    finally:
+        await runner.stop()
+    return 0 if status == "completed" else 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description="批次生成多個單元的大綱、教材與練習題")
+    parser.add_argument("file", nargs="?", help="單元清單（CSV 或 JSONL）")
+    parser.add_argument("--resume", type=int, help="重新執行指定批次中失敗或未完成的單元")
+    parser.add_argument("--name", help="批次名稱（預設為檔名）")
+    parser.add_argument("--fresh", action="store_true", help="略過 LLM 快取並重新生成先前已完成的單元")
+    parser.add_argument("--chapter-mode", choices=["separate", "combined"], default="separate")
+    parser.add_argument("--workers", type=int, default=None, help="同時處理的單元數（預設 BATCH_WORKERS）")
+    parser.add_argument("--poll-interval", type=float, default=1.0, help="檢查進度的間隔（秒）")
+    args = parser.parse_args()
+    if not args.file and not args.resume:
+        parser.error("需要指定單元清單檔案或 --resume")
+
+    # 標準輸出只保留 NDJSON 報告，生成過程的訊息改輸出到標準錯誤
+    out = sys.stdout
+    with redirect_stdout(sys.stderr):
+        run_migrations(engine)
+        try:
+            code = asyncio.run(run(args, out))
+        except ValueError as e:
+            print(f"無法解析單元清單: {e}", file=sys.stderr)
+            code = 2
+    sys.exit(code)
+
+
+if __name__ == "__main__":
+    main()
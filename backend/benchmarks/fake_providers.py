@@ -0,0 +1,97 @@
+"""
+本機假的 LLM 供應商與多供應商路由示範
+
+FakeProvider 依設定的延遲、抖動與錯誤率回應，不需網路或 API 金鑰，可用來驗證 ProviderRouter：
+    python -m benchmarks.fake_providers --calls 200 --concurrency 10
+
+示範情境：fast 供應商在一半的呼叫後變慢（或開始出錯），路由應自動將流量轉往 steady 供應商。
+"""
+import argparse
+import asyncio
+import random
+from collections import Counter
+
+from llm_providers import ChatResult, ChatUsage, LLMProvider, ProviderRouter
+
+
+class FakeProvider(LLMProvider):
+    def __init__(self, name: str, latency: float, jitter: float = 0.2, error_rate: float = 0.0,
+                 text: str = "## 模擬內容\n這是假的供應商產生的內容。"):
+        self.name = name
+        self.model = f"fake-{name}"
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.text = text
+        self.calls = 0
+
+    async def _wait(self):
+        self.calls += 1
+        await asyncio.sleep(max(0.0, self.latency * (1 + random.uniform(-self.jitter, self.jitter))))
+        if random.random() < self.error_rate:
+            raise RuntimeError(f"{self.name} 模擬錯誤")
+
+    def _usage(self, messages: list) -> ChatUsage:
+        prompt_tokens = sum(len(m.get("content") or "") for m in messages)
+        return ChatUsage(prompt_tokens, len(self.text), prompt_tokens + len(self.text))
+
+    async def complete(self, messages: list, max_tokens: int, temperature: float = 0.7,
+                       json_mode: bool = False) -> ChatResult:
+        await self._wait()
+        return ChatResult(self.text, self._usage(messages))
+
+    async def stream(self, messages: list, max_tokens: int, temperature: float = 0.7,
+                     json_mode: bool = False):
+        await self._wait()
+        for i in range(0, len(self.text), 4):
+            yield self.text[i:i + 4], None
+        yield "", self._usage(messages)
+
+    def stats(self) -> dict:
+        return {"calls": self.calls}
+
+
+async def run_demo(args):
+    fast = FakeProvider("fast", latency=args.fast_latency)
+    steady = FakeProvider("steady", latency=args.steady_latency)
+    router = ProviderRouter([fast, steady], window_seconds=3600,
+                            attempt_timeout=args.attempt_timeout)
+    semaphore = asyncio.Semaphore(args.concurrency)
+    messages = [{"role": "user", "content": "測試"}]
+    failures = Counter()
+
+    async def call(phase: str):
+        async with semaphore:
+            try:
+                await router.complete(messages, max_tokens=64)
+            except Exception:
+                failures[phase] += 1
+
+    half = args.calls // 2
+    await asyncio.gather(*(call("前半") for _ in range(half)))
+    first_half = {"fast": fast.calls, "steady": steady.calls}
+    # 模擬 fast 供應商變慢並開始出錯
+    fast.latency = args.degraded_latency
+    fast.error_rate = args.degraded_error_rate
+    await asyncio.gather(*(call("後半") for _ in range(args.calls - half)))
+    second_half = {"fast": fast.calls - first_half["fast"], "steady": steady.calls - first_half["steady"]}
+
+    print(f"前半（fast 正常）：各供應商嘗試次數 {first_half}，失敗 {failures['前半']}")
+    print(f"後半（fast 變慢且出錯）：各供應商嘗試次數 {second_half}，失敗 {failures['後半']}")
+    print(router.stats())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="以假的供應商示範多供應商路由")
+    parser.add_argument("--calls", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--fast-latency", type=float, default=0.02)
+    parser.add_argument("--steady-latency", type=float, default=0.05)
+    parser.add_argument("--degraded-latency", type=float, default=0.3)
+    parser.add_argument("--degraded-error-rate", type=float, default=0.3)
+    parser.add_argument("--attempt-timeout", type=float, default=0.2)
+    asyncio.run(run_demo(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""
+LaTeX 格式修正的微基準測試與最壞情況耗時檢查
+
+在 backend 目錄下執行：
+    python -m benchmarks.latex_benchmark            # 比較舊版三次 re.sub 與 latex_normalizer 的耗時
+    python -m benchmarks.latex_benchmark --check    # 只驗證最壞情況輸入的耗時
+
+--check 失敗時結束代碼為 1。預期輸出的回歸語料與串流版一致性由 tests/test_latex_normalizer.py 驗證。
+"""
+import argparse
+import re
+import sys
+import time
+
+from latex_normalizer import normalize_latex
+
+# 最壞情況輸入在 --check 中允許的最長耗時（秒）；舊版實作需要數秒
+WORST_CASE_LIMIT_SECONDS = 0.2
+
+
+def legacy_fix_latex_brackets(text: str) -> str:
+    """
+    舊版 GroqService._fix_latex_brackets（每次呼叫重新編譯，第一個樣式在未閉合的方括號上會大量回溯）
+    """
+    text = re.sub(r'\[\s*([^\[\]]*?(?:\\[a-zA-Z]+|\\frac|\\text|\\times|\\div)[^\[\]]*?)\s*\]', r'$\1$', text)
+    text = re.sub(r'\\\[\s*(.+?)\s*\\\]', r'$$\1$$', text, flags=re.DOTALL)
+    text = re.sub(r'\\\(\s*(.+?)\s*\\\)', r'$\1$', text)
+    return text
+
+
+def worst_cases(size: int) -> dict:
+    """
+    舊版實作會大量回溯的輸入；新版應維持線性時間且不修改內容
+    """
+    return {
+        "未閉合的方括號": "[" + "\\alpha x " * size,
+        "大量未閉合的方括號": "[\\a " * size,
+        "大量未閉合的行內公式": "\\( x " * size,
+        "大量未閉合的展示公式": "\\[ x " * size,
+        "連結與陣列": "請見 [說明](https://example.com) 與 [1, 2, 3]。\n" * size,
+    }
+
+
+def typical_chapter(formulas: int = 40) -> str:
+    parts = ["## 第1章 分數的運算\n\n### 重點整理\n"]
+    for i in range(formulas):
+        parts.append(
+            f"- 例題 {i}：計算 [ \\frac{{{i}}}{{2}} \\times 3 ]，"
+            f"並以 \\( x_{{{i}}} \\) 表示結果，參考 [圖 {i}](fig{i}.png)。\n"
+        )
+    parts.append("\\[\n \\sum_{k=1}^{n} k = \\frac{n(n+1)}{2} \n\\]\n")
+    return "".join(parts)
+
+
+def _time(func, text: str, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(text)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def check(size: int) -> bool:
+    ok = True
+    for name, text in worst_cases(size).items():
+        elapsed = _time(normalize_latex, text, repeat=3)
+        if elapsed > WORST_CASE_LIMIT_SECONDS:
+            ok = False
+            print(f"[失敗] {name}：{elapsed * 1000:.1f} ms（上限 {WORST_CASE_LIMIT_SECONDS * 1000:.0f} ms）")
+
+    print("全部通過" if ok else "有項目失敗")
+    return ok
+
+
+def benchmark(size: int, repeat: int):
+    inputs = {"一般章節": typical_chapter(), "無公式": "一般的教材內容。" * 500, **worst_cases(size)}
+    print(f"{'輸入':<16}{'字元數':>10}{'舊版 ms':>12}{'新版 ms':>12}{'加速':>10}")
+    for name, text in inputs.items():
+        legacy = _time(legacy_fix_latex_brackets, text, repeat)
+        current = _time(normalize_latex, text, repeat)
+        speedup = legacy / current if current else float("inf")
+        print(f"{name:<16}{len(text):>10}{legacy * 1000:>12.3f}{current * 1000:>12.3f}{speedup:>9.1f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="LaTeX 格式修正的微基準測試")
+    parser.add_argument("--check", action="store_true", help="只驗證最壞情況輸入的耗時")
+    parser.add_argument("--size", type=int, default=2000, help="最壞情況輸入的重複次數")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    if args.check:
+        sys.exit(0 if check(args.size) else 1)
+    benchmark(args.size, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,230 @@
+"""
+本機模擬 LLM 伺服器（相容 Groq / OpenAI Chat Completions API）
+
+可設定每個 token 的延遲、隨機抖動與錯誤率，用於在不消耗 Groq 配額的情況下量測後端的吞吐量與延遲。
+依提示詞內容返回合理格式的回應：大綱請求返回有效的大綱 JSON，JSON 模式（response_format）的章節請求
+返回含 content / questions 的 JSON，其餘返回含公式與方括號的 Markdown。
+
+單獨啟動：
+    python -m benchmarks.mock_llm_server --port 9000 --token-latency 0.005 --error-rate 0.02
+後端連線：
+    GROQ_BASE_URL=http://127.0.0.1:9000 GROQ_API_KEY=mock uvicorn main:app
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+from dataclasses import dataclass
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+
+@dataclass
+class MockLLMConfig:
+    # 每個輸出 token 的延遲（秒）
+    token_latency: float = 0.002
+    # 首個 token 前的固定延遲（秒），模擬排隊與 prefill
+    first_token_latency: float = 0.05
+    # 延遲的隨機抖動比例（0.2 表示 ±20%）
+    jitter: float = 0.2
+    # 回傳錯誤（429 / 500）的機率
+    error_rate: float = 0.0
+    # 每次回應的輸出 token 數上限（實際取 min(此值, max_tokens)）
+    output_tokens: int = 400
+    # 每個 token 的字元數（中文約 1~2 字一個 token）
+    chars_per_token: int = 2
+
+
+OUTLINE_MARKER = "教學大綱"
+QUESTIONS_MARKER = "題目設計師"
+
+
+def _outline_text(chapters: int = 4) -> str:
+    outline = {
+        "title": "模擬單元",
+        "objectives": ["理解核心概念", "能應用公式計算", "能解釋生活中的現象"],
+        "chapters": [
+            {
+                "chapter_number": i,
+                "title": f"第{i}個主題",
+                "topics": [f"主題{i}-1", f"主題{i}-2", f"主題{i}-3"],
+                "description": f"本章節介紹第{i}個主題的基本概念與應用",
+            }
+            for i in range(1, chapters + 1)
+        ],
+    }
+    return json.dumps(outline, ensure_ascii=False, indent=2)
+
+
+def _chapter_text(target_chars: int) -> str:
+    paragraph = (
+        "## 概念說明\n速率是物體在單位時間內移動的距離，公式為 [ v = \\frac{d}{t} ]，"
+        "其中 $d$ 為距離、$t$ 為時間。參考 [課本第 3 頁](https://example.com) 的圖表。\n"
+        "| 項目 | 說明 |\n|------|------|\n| 距離 | 公尺 |\n\n"
+        "計算範例：\\( 30 \\div 2 = 15 \\)，區塊公式 \\[ E = mc^2 \\]。\n\n"
+    )
+    repeat = max(1, target_chars // len(paragraph) + 1)
+    return (paragraph * repeat)[:target_chars]
+
+
+def _questions_text(target_chars: int) -> str:
+    question = (
+        "## 第1題（選擇題）\n小華以 $5\\text{ m/s}$ 跑步，換算成 km/h 是多少？\n\n"
+        "A) $12\\text{ km/h}$\nB) $15\\text{ km/h}$\nC) $18\\text{ km/h}$\nD) $20\\text{ km/h}$\n\n"
+        "**正確答案：** C\n\n**詳細解析：**\n$$5 \\times 3.6 = 18$$\n\n---\n\n"
+    )
+    repeat = max(1, target_chars // len(question) + 1)
+    return (question * repeat)[:target_chars]
+
+
+def create_app(config: MockLLMConfig) -> FastAPI:
+    app = FastAPI(title="Mock LLM Server")
+    app.state.config = config
+    app.state.requests = 0
+    app.state.prompt_tokens = 0
+    app.state.completion_tokens = 0
+
+    def _delay(base: float) -> float:
+        jitter = config.jitter
+        return max(0.0, base * (1 + random.uniform(-jitter, jitter)))
+
+    def _response_text(prompt: str, max_tokens: int, json_mode: bool = False) -> str:
+        if OUTLINE_MARKER in prompt:
+            return _outline_text()
+        tokens = min(config.output_tokens, max_tokens)
+        chars = tokens * config.chars_per_token
+        if json_mode:
+            return json.dumps({
+                "content": _chapter_text(chars // 2),
+                "questions": _questions_text(chars // 2),
+            }, ensure_ascii=False)
+        if QUESTIONS_MARKER in prompt:
+            return _questions_text(chars)
+        return _chapter_text(chars)
+
+    def _usage(prompt: str, completion: str) -> dict:
+        prompt_tokens = max(1, len(prompt) // config.chars_per_token)
+        completion_tokens = max(1, len(completion) // config.chars_per_token)
+        app.state.prompt_tokens += prompt_tokens
+        app.state.completion_tokens += completion_tokens
+        return {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        }
+
+    @app.post("/openai/v1/chat/completions")
+    async def chat_completions(request: Request):
+        app.state.requests += 1
+        body = await request.json()
+        prompt = "\n".join(m.get("content") or "" for m in body.get("messages", []))
+        model = body.get("model", "mock-model")
+        max_tokens = body.get("max_tokens") or config.output_tokens
+
+        if random.random() < config.error_rate:
+            await asyncio.sleep(_delay(config.first_token_latency))
+            if random.random() < 0.5:
+                return JSONResponse(
+                    {"error": {"message": "Rate limit reached (mock)", "type": "rate_limit_exceeded"}},
+                    status_code=429,
+                    headers={"retry-after": "1"},
+                )
+            return JSONResponse(
+                {"error": {"message": "Internal error (mock)", "type": "server_error"}},
+                status_code=500,
+            )
+
+        json_mode = (body.get("response_format") or {}).get("type") == "json_object"
+        text = _response_text(prompt, max_tokens, json_mode)
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        created = int(time.time())
+        step = config.chars_per_token
+
+        if body.get("stream"):
+            async def event_stream():
+                await asyncio.sleep(_delay(config.first_token_latency))
+                for i in range(0, len(text), step):
+                    await asyncio.sleep(_delay(config.token_latency))
+                    chunk = {
+                        "id": completion_id,
+                        "object": "chat.completion.chunk",
+                        "created": created,
+                        "model": model,
+                        "choices": [{"index": 0, "delta": {"content": text[i:i + step]}, "finish_reason": None}],
+                    }
+                    yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+                final = {
+                    "id": completion_id,
+                    "object": "chat.completion.chunk",
+                    "created": created,
+                    "model": model,
+                    "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+                    "x_groq": {"usage": _usage(prompt, text)},
+                }
+                yield f"data: {json.dumps(final, ensure_ascii=False)}\n\n"
+                yield "data: [DONE]\n\n"
+
+            return StreamingResponse(event_stream(), media_type="text/event-stream")
+
+        token_count = max(1, len(text) // step)
+        await asyncio.sleep(_delay(config.first_token_latency + token_count * config.token_latency))
+        return {
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": created,
+            "model": model,
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": text},
+                "finish_reason": "stop",
+            }],
+            "usage": _usage(prompt, text),
+        }
+
+    @app.get("/stats")
+    async def stats():
+        return {
+            "requests": app.state.requests,
+            "prompt_tokens": app.state.prompt_tokens,
+            "completion_tokens": app.state.completion_tokens,
+        }
+
+    return app
+
+
+def add_config_arguments(parser: argparse.ArgumentParser):
+    defaults = MockLLMConfig()
+    parser.add_argument("--token-latency", type=float, default=defaults.token_latency,
+                        help="每個輸出 token 的延遲（秒）")
+    parser.add_argument("--first-token-latency", type=float, default=defaults.first_token_latency,
+                        help="首個 token 前的延遲（秒）")
+    parser.add_argument("--jitter", type=float, default=defaults.jitter,
+                        help="延遲的隨機抖動比例")
+    parser.add_argument("--error-rate", type=float, default=defaults.error_rate,
+                        help="回傳 429/500 錯誤的機率")
+    parser.add_argument("--output-tokens", type=int, default=defaults.output_tokens,
+                        help="每次回應的輸出 token 數")
+
+
+def config_from_args(args) -> MockLLMConfig:
+    return MockLLMConfig(
+        token_latency=args.token_latency,
+        first_token_latency=args.first_token_latency,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        output_tokens=args.output_tokens,
+    )
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="本機模擬 LLM 伺服器")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9000)
+    add_config_arguments(parser)
+    args = parser.parse_args()
+    uvicorn.run(create_app(config_from_args(args)), host=args.host, port=args.port, log_level="warning")
@@ -0,0 +1,412 @@
+"""
+後端基準測試：以本機模擬 LLM 伺服器驅動完整的 大綱 → 教材 → 練習題 流程
+
+在 backend 目錄下執行：
+    python -m benchmarks.run_benchmark --units 20 --concurrency 5
+    python -m benchmarks.run_benchmark --units 20 --concurrency 5 --stream --compare benchmarks/results/baseline.json
+
+後端在同一程序內以 ASGI 直接呼叫（不經過網路），模擬 LLM 伺服器則在背景執行緒以 uvicorn 啟動。
+結果包含各階段的 p50/p95/p99 延遲、吞吐量、資料庫時間、_fix_latex_brackets 與 JSON 處理時間，並存為 JSON 檔。
+"""
+import argparse
+import asyncio
+import functools
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+import httpx
+import uvicorn
+
+from benchmarks.mock_llm_server import create_app, add_config_arguments, config_from_args
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+
+class TimingCounter:
+    def __init__(self):
+        self.calls = 0
+        self.seconds = 0.0
+
+    def add(self, seconds: float):
+        self.calls += 1
+        self.seconds += seconds
+
+    def to_dict(self) -> dict:
+        return {"calls": self.calls, "total_ms": round(self.seconds * 1000, 3)}
+
+
+class TimedJson:
+    """
+    取代模組中的 json 參考，統計 loads / dumps 的呼叫次數與耗時
+    """
+
+    def __init__(self, module, loads_counter: TimingCounter, dumps_counter: TimingCounter):
+        self._module = module
+        self._loads = loads_counter
+        self._dumps = dumps_counter
+
+    def loads(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return self._module.loads(*args, **kwargs)
+        finally:
+            self._loads.add(time.perf_counter() - start)
+
+    def dumps(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return self._module.dumps(*args, **kwargs)
+        finally:
+            self._dumps.add(time.perf_counter() - start)
+
+    def __getattr__(self, name):
+        return getattr(self._module, name)
+
+
+def _percentile(values, percent: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * percent / 100
+    lower = int(rank)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (rank - lower)
+
+
+def _latency_summary(values, errors: int = 0) -> dict:
+    return {
+        "count": len(values),
+        "errors": errors,
+        "mean_ms": round(sum(values) / len(values) * 1000, 2) if values else 0.0,
+        "p50_ms": round(_percentile(values, 50) * 1000, 2),
+        "p95_ms": round(_percentile(values, 95) * 1000, 2),
+        "p99_ms": round(_percentile(values, 99) * 1000, 2),
+        "max_ms": round(max(values) * 1000, 2) if values else 0.0,
+    }
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_mock_server(config, port: int) -> uvicorn.Server:
+    server = uvicorn.Server(uvicorn.Config(
+        create_app(config), host="127.0.0.1", port=port, log_level="warning"
+    ))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    deadline = time.time() + 10
+    while not server.started:
+        if time.time() > deadline:
+            raise RuntimeError("模擬 LLM 伺服器啟動逾時")
+        time.sleep(0.05)
+    return server
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except Exception:
+        return ""
+
+
+def instrument(app_modules: dict) -> dict:
+    """
+    為後端加上量測：資料庫語句時間、LaTeX 修正時間與 JSON 處理時間
+    """
+    from sqlalchemy import event
+
+    counters = {
+        "db": TimingCounter(),
+        "latex": TimingCounter(),
+        "json_loads": TimingCounter(),
+        "json_dumps": TimingCounter(),
+    }
+
+    engine = app_modules["database"].async_engine.sync_engine
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("bench_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        counters["db"].add(time.perf_counter() - conn.info["bench_start"].pop())
+
+    service_module = app_modules["groq_service"]
+    original_fix = service_module._fix_latex_brackets
+
+    @functools.wraps(original_fix)
+    def timed_fix(text):
+        start = time.perf_counter()
+        try:
+            return original_fix(text)
+        finally:
+            counters["latex"].add(time.perf_counter() - start)
+
+    service_module._fix_latex_brackets = timed_fix
+
+    for name in ("main", "groq_service", "chapter_store", "jobs"):
+        module = app_modules.get(name)
+        if module is not None and hasattr(module, "json"):
+            module.json = TimedJson(json, counters["json_loads"], counters["json_dumps"])
+
+    return counters
+
+
+async def _read_stream_content(response: httpx.Response) -> str:
+    """
+    讀取 SSE 串流，返回 done 事件中的教材內容
+    """
+    event = None
+    async for line in response.aiter_lines():
+        if line.startswith("event:"):
+            event = line[6:].strip()
+        elif line.startswith("data:"):
+            data = json.loads(line[5:])
+            if event == "done":
+                return data["content"]
+            if event == "error":
+                raise RuntimeError(data.get("detail"))
+    raise RuntimeError("串流未正常結束")
+
+
+async def run_unit(client: httpx.AsyncClient, index: int, args, stages: dict, errors: dict):
+    """
+    執行單一單元的完整流程，返回整體耗時（失敗時返回 None）
+    """
+    unit_start = time.perf_counter()
+
+    async def timed(stage: str, coro):
+        start = time.perf_counter()
+        try:
+            result = await coro
+        except Exception:
+            errors[stage] += 1
+            raise
+        stages[stage].append(time.perf_counter() - start)
+        return result
+
+    async def post(path: str, payload: dict) -> dict:
+        response = await client.post(path, json=payload)
+        response.raise_for_status()
+        return response.json()
+
+    async def stream_content(payload: dict) -> str:
+        async with client.stream("POST", "/api/generate-content/stream", json=payload) as response:
+            response.raise_for_status()
+            return await _read_stream_content(response)
+
+    try:
+        outline = await timed("outline", post("/api/generate-outline", {
+            "subject": "數學",
+            "grade": "國二",
+            "unit": f"基準測試單元 {index}",
+            "fresh": not args.cache,
+        }))
+        generation_id = outline["generation_id"]
+        payload = {
+            "generation_id": generation_id,
+            "outline": outline["outline"],
+            "fresh": not args.cache,
+            "chapter_mode": args.chapter_mode,
+        }
+        if args.stream:
+            content = await timed("content", stream_content(payload))
+        else:
+            content = (await timed("content", post("/api/generate-content", payload)))["content"]
+        await timed("questions", post("/api/generate-questions", {
+            "generation_id": generation_id,
+            "content": content,
+            "fresh": not args.cache,
+        }))
+    except Exception:
+        return None
+    return time.perf_counter() - unit_start
+
+
+async def run_benchmark(args, mock_server, counters: dict, app) -> dict:
+    stages = {"outline": [], "content": [], "questions": []}
+    errors = {"outline": 0, "content": 0, "questions": 0}
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    transport = httpx.ASGITransport(app=app)
+    timeout = httpx.Timeout(args.request_timeout)
+    async with httpx.AsyncClient(transport=transport, base_url="http://backend", timeout=timeout) as client:
+        async def bounded(index: int):
+            async with semaphore:
+                return await run_unit(client, index, args, stages, errors)
+
+        start = time.perf_counter()
+        unit_times = await asyncio.gather(*(bounded(i) for i in range(args.units)))
+        wall = time.perf_counter() - start
+
+    completed = [t for t in unit_times if t is not None]
+    backend_requests = sum(len(v) for v in stages.values()) + sum(errors.values())
+    llm_state = mock_server.config.app.state
+    llm_requests = llm_state.requests
+
+    return {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "git_commit": _git_commit(),
+        "config": vars(args),
+        "wall_time_s": round(wall, 3),
+        "units": {
+            **_latency_summary(completed, errors=args.units - len(completed)),
+        },
+        "stages": {stage: _latency_summary(values, errors[stage]) for stage, values in stages.items()},
+        "throughput": {
+            "units_per_s": round(len(completed) / wall, 3) if wall else 0.0,
+            "requests_per_s": round(backend_requests / wall, 3) if wall else 0.0,
+            "llm_requests": llm_requests,
+            "llm_requests_per_s": round(llm_requests / wall, 3) if wall else 0.0,
+        },
+        "llm_tokens": {
+            "prompt": llm_state.prompt_tokens,
+            "completion": llm_state.completion_tokens,
+            "prompt_per_unit": round(llm_state.prompt_tokens / max(1, len(completed)), 1),
+        },
+        "db": {
+            "statements": counters["db"].calls,
+            "total_ms": round(counters["db"].seconds * 1000, 3),
+            "ms_per_unit": round(counters["db"].seconds * 1000 / max(1, len(completed)), 3),
+        },
+        "fix_latex_brackets": counters["latex"].to_dict(),
+        "json": {
+            "loads": counters["json_loads"].to_dict(),
+            "dumps": counters["json_dumps"].to_dict(),
+        },
+    }
+
+
+def print_report(result: dict, baseline: dict = None):
+    def delta(path):
+        if baseline is None:
+            return ""
+        old, new = baseline, result
+        for key in path:
+            old = old.get(key, {}) if isinstance(old, dict) else {}
+            new = new.get(key, {}) if isinstance(new, dict) else {}
+        if isinstance(old, (int, float)) and old:
+            return f" ({(new - old) / old * 100:+.1f}%)"
+        return ""
+
+    print(f"\n=== 基準測試結果（{result['config']['units']} 個單元，並行 {result['config']['concurrency']}）===")
+    print(f"總耗時：{result['wall_time_s']} s")
+    for name, summary in [("單元", result["units"])] + list(result["stages"].items()):
+        key_path = ("units",) if name == "單元" else ("stages", name)
+        print(
+            f"{name:>10}: p50 {summary['p50_ms']} ms{delta(key_path + ('p50_ms',))}"
+            f" | p95 {summary['p95_ms']} ms{delta(key_path + ('p95_ms',))}"
+            f" | p99 {summary['p99_ms']} ms{delta(key_path + ('p99_ms',))}"
+            f" | 失敗 {summary['errors']}"
+        )
+    throughput = result["throughput"]
+    print(f"吞吐量：{throughput['units_per_s']} 單元/s{delta(('throughput', 'units_per_s'))}，"
+          f"{throughput['requests_per_s']} 請求/s，LLM 請求 {throughput['llm_requests']} 次")
+    print(f"資料庫：{result['db']['statements']} 個語句，共 {result['db']['total_ms']} ms"
+          f"{delta(('db', 'total_ms'))}")
+    print(f"_fix_latex_brackets：{result['fix_latex_brackets']['calls']} 次，"
+          f"共 {result['fix_latex_brackets']['total_ms']} ms{delta(('fix_latex_brackets', 'total_ms'))}")
+    print(f"JSON：loads {result['json']['loads']['calls']} 次 {result['json']['loads']['total_ms']} ms，"
+          f"dumps {result['json']['dumps']['calls']} 次 {result['json']['dumps']['total_ms']} ms")
+    print(f"LLM 輸入 token：共 {result['llm_tokens']['prompt']}，每單元 {result['llm_tokens']['prompt_per_unit']}"
+          f"{delta(('llm_tokens', 'prompt_per_unit'))}")
+    llm = result.get("llm_client")
+    if llm and "calls" in llm:
+        print(f"LLM 呼叫：{llm['calls']} 次，重試 {llm['retries']} 次（429 {llm['rate_limited']} 次），失敗 {llm['failed']} 次；"
+              f"排隊 p95 {llm['queue_wait']['p95_ms']} ms，退避 p95 {llm['backoff_wait']['p95_ms']} ms，"
+              f"模型 p50 {llm['model_latency']['p50_ms']} ms / p95 {llm['model_latency']['p95_ms']} ms")
+    for template, metrics in result.get("prompt_metrics", {}).items():
+        print(f"提示詞 {template}：{metrics['calls']} 次，平均輸入 {metrics['avg_prompt_tokens']} tokens"
+              f"{delta(('prompt_metrics', template, 'avg_prompt_tokens'))}，"
+              f"參考內容 {metrics['context_tokens_original']} → {metrics['context_tokens_compacted']} tokens"
+              f"（減少 {metrics['context_reduction'] * 100:.1f}%）")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="以模擬 LLM 伺服器量測後端吞吐量與延遲")
+    parser.add_argument("--units", type=int, default=10, help="要生成的單元數")
+    parser.add_argument("--concurrency", type=int, default=5, help="同時進行的單元數")
+    parser.add_argument("--stream", action="store_true", help="教材改用 SSE 串流端點")
+    parser.add_argument("--chapter-mode", choices=["separate", "combined"], default="separate",
+                        help="章節生成模式：separate 兩次呼叫，combined 單次 JSON 呼叫")
+    parser.add_argument("--cache", action="store_true", help="啟用 LLM 回應快取（預設停用以量測實際呼叫）")
+    parser.add_argument("--rpm-limit", type=float, default=0, help="LLM 每分鐘請求數限制（0 為不限制）")
+    parser.add_argument("--tpm-limit", type=float, default=0, help="LLM 每分鐘 token 數限制（0 為不限制）")
+    parser.add_argument("--request-timeout", type=float, default=600, help="單一請求逾時（秒）")
+    parser.add_argument("--output", help="結果 JSON 路徑（預設 benchmarks/results/bench-<時間>.json）")
+    parser.add_argument("--compare", help="與先前的結果 JSON 比較")
+    add_config_arguments(parser)
+    args = parser.parse_args()
+
+    port = _free_port()
+    mock_server = start_mock_server(config_from_args(args), port)
+
+    # 必須在匯入後端模組前設定環境變數
+    workdir = tempfile.mkdtemp(prefix="bench-")
+    os.environ.update({
+        "GROQ_API_KEY": "mock",
+        "GROQ_BASE_URL": f"http://127.0.0.1:{port}",
+        "DATABASE_URL": f"sqlite:///{os.path.join(workdir, 'bench.db')}",
+        "LLM_CACHE_PATH": os.path.join(workdir, "llm_cache.db"),
+        "LLM_CACHE_ENABLED": "true" if args.cache else "false",
+        "LLM_RPM_LIMIT": str(args.rpm_limit),
+        "LLM_TPM_LIMIT": str(args.tpm_limit),
+    })
+    os.environ.pop("ASYNC_DATABASE_URL", None)
+
+    import database
+    import groq_service
+    import chapter_store
+    import jobs
+    import main as backend_main
+
+    counters = instrument({
+        "database": database,
+        "groq_service": groq_service,
+        "chapter_store": chapter_store,
+        "jobs": jobs,
+        "main": backend_main,
+    })
+
+    try:
+        result = asyncio.run(run_benchmark(args, mock_server, counters, backend_main.app))
+    finally:
+        mock_server.should_exit = True
+    metrics = getattr(backend_main.groq_service, "metrics", None)
+    if metrics is not None:
+        result["prompt_metrics"] = metrics.stats()
+    provider = getattr(backend_main.groq_service, "provider", None)
+    if provider is not None:
+        result["llm_client"] = provider.stats()
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+    print_report(result, baseline)
+
+    output = args.output
+    if not output:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output = os.path.join(RESULTS_DIR, f"bench-{datetime.now():%Y%m%d-%H%M%S}.json")
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    print(f"\n結果已儲存至 {output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,356 @@
+import hashlib
+import json
+from datetime import datetime
+from typing import List, Optional
+
+from sqlalchemy import select, update, delete
+from sqlalchemy.exc import IntegrityError
+
+from database import session_scope
+from models import Generation, Chapter
+from question_store import replace_questions, delete_chapter_questions
+from search_index import index_chapter, index_unit_content, remove_chapters
+from outline_schema import validate_outline, dump_outline
+
+
+def parse_outline(outline: str) -> Optional[dict]:
+    """
+    解析並驗證新輸入的大綱（程式碼區塊標記、前後多餘文字與多餘逗號會在本機修復）
+    無法修復或不符合大綱格式時返回 None（改用備用方法整份生成）
+    已儲存的大綱直接讀取驗證後的 generation.outline_data，不需重新解析
+    """
+    parsed, _ = validate_outline(outline)
+    return parsed.model_dump() if parsed is not None else None
+
+
+def split_content(content: str):
+    """
+    將教材 JSON 拆成單元標頭（title、objectives，chapters 為空）與章節列表
+    內容不是結構化 JSON（例如備用方法生成的 Markdown）時返回 (原內容, None)
+    """
+    try:
+        content_json = json.loads(content)
+    except (TypeError, json.JSONDecodeError):
+        return content, None
+    if not isinstance(content_json, dict) or not isinstance(content_json.get("chapters"), list):
+        return content, None
+
+    chapters = content_json["chapters"]
+    content_json["chapters"] = []
+    return json.dumps(content_json, ensure_ascii=False), chapters
+
+
+def chapter_to_dict(chapter: Chapter) -> dict:
+    """
+    章節記錄轉換為 API 使用的章節格式
+    """
+    return {
+        "chapter_number": chapter.chapter_number,
+        "title": chapter.title,
+        "topics": json.loads(chapter.topics) if chapter.topics else [],
+        "description": chapter.description or "",
+        "content": chapter.content,
+        "questions": chapter.questions,
+        "status": chapter.status,
+    }
+
+
+def chapter_status(chapter: Chapter) -> dict:
+    """
+    章節生成狀態（不含內容）
+    """
+    return {
+        "chapter_number": chapter.chapter_number,
+        "title": chapter.title,
+        "status": chapter.status,
+        "error": chapter.error,
+    }
+
+
+def content_status(generation: Generation, chapters: List[Chapter]) -> str:
+    """
+    教材狀態：empty（尚未生成）/ partial（部分章節未完成）/ completed
+    """
+    if generation.content is None:
+        return "empty"
+    if all(c.status == "completed" for c in chapters):
+        return "completed"
+    return "partial"
+
+
+def _chapter_values(entry: dict) -> dict:
+    return {
+        "title": entry.get("title"),
+        "topics": json.dumps(entry.get("topics", []), ensure_ascii=False),
+        "description": entry.get("description", ""),
+        "content": entry.get("content"),
+        "questions": entry.get("questions"),
+        "status": "completed",
+        "error": None,
+    }
+
+
+def build_content_header(outline_data: dict) -> str:
+    """
+    由大綱建立單元標頭（title、objectives，chapters 為空）
+    """
+    return json.dumps({
+        "title": outline_data.get("title", ""),
+        "objectives": outline_data.get("objectives", []),
+        "chapters": [],
+    }, ensure_ascii=False)
+
+
+def _hash_etag(text: str) -> str:
+    return '"' + hashlib.sha256(text.encode("utf-8")).hexdigest()[:32] + '"'
+
+
+def outline_etag(outline: Optional[str]) -> Optional[str]:
+    """
+    大綱的 ETag（大綱以 dump_outline 的固定格式儲存，內容相同即相同）
+    """
+    return _hash_etag(outline) if outline is not None else None
+
+
+async def content_etag(db, generation: Generation) -> Optional[str]:
+    """
+    教材的 ETag：由單元標頭與各章節的 (編號, version, 狀態) 計算，不需讀取或組合章節內容
+    章節每次改寫 version 遞增，重設為 pending 或標記失敗時狀態改變，ETag 隨之改變
+    """
+    if generation.content is None:
+        return None
+    result = await db.execute(
+        select(Chapter.chapter_number, Chapter.version, Chapter.status)
+        .where(Chapter.generation_id == generation.id)
+        .order_by(Chapter.chapter_number)
+    )
+    parts = [generation.content] + [f"{row.chapter_number}:{row.version}:{row.status}" for row in result]
+    return _hash_etag("\n".join(parts))
+
+
+def generation_etag(generation_id: int, created_at: datetime, version: int) -> str:
+    """
+    整筆記錄（大綱、教材、章節與練習題）的 ETag：由記錄的 version 產生，不需讀取內容
+    加入建立時間，刪除後重新使用相同 id 的記錄不會得到相同的 ETag
+    同一內容可能以不同的壓縮編碼傳送，因此為弱 ETag
+    """
+    created = created_at.isoformat() if created_at else ""
+    return "W/" + _hash_etag(f"{generation_id}:{created}:{version}")
+
+
+def etag_matches(if_match: str, etag: Optional[str]) -> bool:
+    """
+    If-Match / If-None-Match 標頭（可為多個以逗號分隔的 ETag 或 *）是否符合目前的 ETag；資源不存在時不符合
+    """
+    if etag is None:
+        return False
+    tags = {tag.strip().removeprefix("W/") for tag in if_match.split(",")}
+    return "*" in tags or etag.removeprefix("W/") in tags
+
+
+async def touch_generation(db, generation_id: int):
+    """
+    記錄的大綱、教材、章節或練習題改寫時遞增 version（updated_at 同時更新）；呼叫端負責 commit
+    """
+    await db.execute(
+        update(Generation).where(Generation.id == generation_id).values(version=Generation.version + 1)
+    )
+
+
+async def list_chapters(db, generation_id: int) -> List[Chapter]:
+    result = await db.execute(
+        select(Chapter)
+        .where(Chapter.generation_id == generation_id)
+        .order_by(Chapter.chapter_number)
+    )
+    return result.scalars().all()
+
+
+async def list_chapter_statuses(db, generation_id: int):
+    """
+    只讀取章節的狀態欄位（不載入、解壓縮內容），可直接傳給 chapter_status
+    """
+    result = await db.execute(
+        select(Chapter.chapter_number, Chapter.title, Chapter.status, Chapter.error)
+        .where(Chapter.generation_id == generation_id)
+        .order_by(Chapter.chapter_number)
+    )
+    return result.all()
+
+
+async def get_chapter(db, generation_id: int, chapter_number: int) -> Optional[Chapter]:
+    result = await db.execute(
+        select(Chapter).where(
+            Chapter.generation_id == generation_id,
+            Chapter.chapter_number == chapter_number,
+        )
+    )
+    return result.scalar_one_or_none()
+
+
+async def save_content(db, generation: Generation, content: str):
+    """
+    儲存整份教材：單元標頭寫入 generation.content，各章節寫入 chapters 表
+    不在新教材中的舊章節會被刪除；呼叫端負責 commit
+    """
+    header, chapters = split_content(content)
+    generation.content = header
+    await touch_generation(db, generation.id)
+    if chapters is None:
+        # 只需要章節編號，不載入（解壓縮）章節內容
+        existing = list((await db.execute(
+            select(Chapter.chapter_number).where(Chapter.generation_id == generation.id)
+        )).scalars())
+        await db.execute(delete(Chapter).where(Chapter.generation_id == generation.id))
+        await delete_chapter_questions(db, generation.id)
+        await remove_chapters(db, generation.id, existing)
+        await index_unit_content(db, generation.id, content)
+        return
+    await index_unit_content(db, generation.id, None)
+
+    existing = {c.chapter_number: c for c in await list_chapters(db, generation.id)}
+    numbers = set()
+    for entry in chapters:
+        number = entry.get("chapter_number")
+        numbers.add(number)
+        chapter = existing.get(number)
+        if chapter is None:
+            db.add(Chapter(generation_id=generation.id, chapter_number=number, version=1,
+                           **_chapter_values(entry)))
+        else:
+            for key, value in _chapter_values(entry).items():
+                setattr(chapter, key, value)
+            chapter.version += 1
+        await _write_derived(db, generation.id, entry)
+
+    await _delete_stale_chapters(db, generation.id, [number for number in existing if number not in numbers])
+
+
+async def _delete_stale_chapters(db, generation_id: int, stale: List[int]):
+    if stale:
+        await db.execute(
+            delete(Chapter).where(
+                Chapter.generation_id == generation_id,
+                Chapter.chapter_number.in_(stale),
+            )
+        )
+        await delete_chapter_questions(db, generation_id, stale)
+        await remove_chapters(db, generation_id, stale)
+
+
+async def _write_derived(db, generation_id: int, entry: dict):
+    """
+    重建章節的衍生資料（結構化題目與全文索引），與章節寫入在同一個交易中
+    """
+    await replace_questions(db, generation_id, entry.get("chapter_number"), entry.get("questions"))
+    await index_chapter(db, generation_id, entry)
+
+
+async def prepare_chapters(db, generation: Generation, outline_data: dict,
+                           reset: bool = False) -> List[int]:
+    """
+    依大綱建立教材骨架：寫入驗證後的大綱（文字與結構）與單元標頭，尚未存在的章節建立為 pending，不在大綱中的章節刪除
+    reset 為 True 時（重新生成整份教材）既有章節也改回 pending 並清除內容
+    返回尚未完成（pending / failed）的章節編號；呼叫端負責 commit
+    """
+    generation.outline = dump_outline(outline_data)
+    generation.outline_data = outline_data
+    generation.content = build_content_header(outline_data)
+    await touch_generation(db, generation.id)
+    existing = {c.chapter_number: c for c in await list_chapters(db, generation.id)}
+    numbers = set()
+    unfinished = []
+    reset_numbers = []
+    for entry in outline_data.get("chapters", []):
+        number = entry.get("chapter_number")
+        numbers.add(number)
+        chapter = existing.get(number)
+        if chapter is None:
+            values = {**_chapter_values(entry), "content": None, "questions": None, "status": "pending"}
+            db.add(Chapter(generation_id=generation.id, chapter_number=number, version=1, **values))
+        elif reset:
+            chapter.status = "pending"
+            chapter.error = None
+            chapter.content = None
+            chapter.questions = None
+            reset_numbers.append(number)
+        if chapter is None or chapter.status != "completed":
+            unfinished.append(number)
+
+    await delete_chapter_questions(db, generation.id, reset_numbers)
+    await remove_chapters(db, generation.id, reset_numbers)
+    await index_unit_content(db, generation.id, None)
+    await _delete_stale_chapters(db, generation.id, [number for number in existing if number not in numbers])
+    return unfinished
+
+
+async def mark_chapter_failed(db, generation_id: int, chapter_number: int, error: str):
+    """
+    記錄章節生成失敗（保留先前的內容）；呼叫端負責 commit
+    """
+    await db.execute(
+        update(Chapter)
+        .where(Chapter.generation_id == generation_id, Chapter.chapter_number == chapter_number)
+        .values(status="failed", error=error)
+    )
+    await touch_generation(db, generation_id)
+
+
+def chapter_writer(generation_id: int):
+    """
+    generate_content 的 chapter_callback：章節完成時以短交易寫入內容，失敗時記錄錯誤
+    """
+    async def write(entry: dict, error: Exception = None):
+        async with session_scope() as db:
+            if error is None:
+                await upsert_chapter(db, generation_id, entry)
+            else:
+                await mark_chapter_failed(db, generation_id, entry["chapter_number"], str(error))
+    return write
+
+
+async def upsert_chapter(db, generation_id: int, entry: dict):
+    """
+    以單筆 UPDATE / INSERT 寫入單一章節（version 遞增），不需讀取或改寫其他章節，題目與全文索引在同一個交易中重建
+    同時有其他請求建立同一章節時只回復 SAVEPOINT 中的 INSERT 並改為更新，
+    呼叫端在同一交易中的其他寫入（例如單元標頭）不受影響；呼叫端負責 commit
+    """
+    values = _chapter_values(entry)
+    number = entry.get("chapter_number")
+    condition = (Chapter.generation_id == generation_id, Chapter.chapter_number == number)
+    await _write_derived(db, generation_id, entry)
+    await touch_generation(db, generation_id)
+
+    result = await db.execute(
+        update(Chapter).where(*condition).values(version=Chapter.version + 1, **values)
+    )
+    if result.rowcount == 0:
+        try:
+            async with db.begin_nested():
+                db.add(Chapter(generation_id=generation_id, chapter_number=number, version=1, **values))
+        except IntegrityError:
+            await db.execute(
+                update(Chapter).where(*condition).values(version=Chapter.version + 1, **values)
+            )
+
+
+async def load_content(db, generation: Generation,
+                       chapters: Optional[List[Chapter]] = None) -> Optional[str]:
+    """
+    組合完整教材 JSON（與 /api/generate-content 的輸出格式相同）
+    尚未拆分章節的內容（備用方法的 Markdown）直接返回原內容
+    呼叫端已讀取章節時可傳入 chapters，避免重複讀取與解壓縮
+    """
+    if generation.content is None:
+        return None
+    if chapters is None:
+        chapters = await list_chapters(db, generation.id)
+    if not chapters:
+        return generation.content
+
+    try:
+        content_json = json.loads(generation.content)
+    except json.JSONDecodeError:
+        return generation.content
+    content_json["chapters"] = [chapter_to_dict(c) for c in chapters]
+    return json.dumps(content_json, ensure_ascii=False, indent=2)
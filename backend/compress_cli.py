@@ -0,0 +1,276 @@
+"""
+大型文字欄位壓縮的遷移與報告工具
+
+在 backend 目錄下執行：
+    python compress_cli.py report                  # 比較原始格式與各種壓縮格式的大小與解壓縮延遲
+    python compress_cli.py migrate --vacuum        # 將既有資料轉為目前設定的格式（大綱改為緊湊 JSON）
+    python compress_cli.py migrate --method none   # 還原為未壓縮的文字
+    python compress_cli.py train --output text.dict
+
+壓縮的欄位為模型中型別為 CompressedText 的欄位（generations、chapters 的大型文字）。
+migrate 依 id 分批讀寫，每批一個交易，可在服務執行中進行；中斷後重新執行即可（已轉換的資料列會略過）。
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+from contextlib import redirect_stdout
+
+from sqlalchemy import text
+
+from config import settings
+import models  # 載入所有模型的資料表定義
+from database import engine, Base
+from migrations import run_migrations
+from outline_schema import dump_outline
+from text_compression import (
+    BUILTIN_DICTIONARY, CompressedText, TextCodec, get_codec, train_dictionary, zstandard
+)
+
+
+def compressed_columns():
+    """
+    模型中以 CompressedText 儲存的 (資料表, 欄位)，包含以 CompressedText 為底層型別的欄位（outline_data）
+    """
+    for table in Base.metadata.sorted_tables:
+        for column in table.columns:
+            if (isinstance(column.type, CompressedText)
+                    or isinstance(getattr(column.type, "impl", None), CompressedText)):
+                yield table.name, column.name
+
+
+def _batches(table: str, column: str, batch_size: int):
+    last_id = 0
+    while True:
+        with engine.connect() as conn:
+            rows = conn.execute(
+                text(f"SELECT id, {column} FROM {table} WHERE id > :last_id AND {column} IS NOT NULL "
+                     "ORDER BY id LIMIT :limit"),
+                {"last_id": last_id, "limit": batch_size},
+            ).fetchall()
+        if not rows:
+            return
+        yield rows
+        last_id = rows[-1][0]
+
+
+def _compact(table: str, column: str, value: str) -> str:
+    # 舊版大綱以 indent=2 儲存，改為緊湊 JSON
+    if (table, column) != ("generations", "outline"):
+        return value
+    try:
+        data = json.loads(value)
+    except json.JSONDecodeError:
+        return value
+    return dump_outline(data) if isinstance(data, dict) else value
+
+
+def _database_size() -> int:
+    path = engine.url.database
+    if engine.dialect.name != "sqlite" or not path or not os.path.exists(path):
+        return 0
+    return os.path.getsize(path)
+
+
+def _target_codec(args) -> TextCodec:
+    """
+    寫入使用的格式（預設為目前的設定）；讀取時也認得目前設定的字典
+    """
+    dictionary = BUILTIN_DICTIONARY
+    dictionary_path = args.dict or settings.TEXT_COMPRESSION_DICT
+    if dictionary_path:
+        with open(dictionary_path, "rb") as f:
+            dictionary = f.read()
+    return TextCodec(
+        args.method or settings.TEXT_COMPRESSION,
+        args.level if args.level is not None else settings.TEXT_COMPRESSION_LEVEL,
+        settings.TEXT_COMPRESSION_MIN_BYTES,
+        dictionary,
+        extra_dictionaries=[get_codec().dictionary or b""],
+    )
+
+
+def migrate(args):
+    if engine.dialect.name != "sqlite":
+        print("只有 SQLite 支援壓縮欄位，其他資料庫不需遷移", file=sys.stderr)
+        return 1
+    codec = _target_codec(args)
+    size_before = _database_size()
+    for table, column in compressed_columns():
+        scanned = changed = 0
+        for rows in _batches(table, column, args.batch_size):
+            updates = []
+            for row_id, raw in rows:
+                value = codec.decode(raw)
+                stored = codec.encode(_compact(table, column, value))
+                if stored != raw:
+                    updates.append({"id": row_id, "value": stored})
+            if updates:
+                with engine.begin() as conn:
+                    conn.execute(text(f"UPDATE {table} SET {column} = :value WHERE id = :id"), updates)
+            scanned += len(rows)
+            changed += len(updates)
+        print(f"{table}.{column}: 讀取 {scanned} 列，轉換 {changed} 列", file=sys.stderr)
+
+    if args.vacuum:
+        # 轉換後釋出的空間需 VACUUM 才會從資料庫檔案移除
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            conn.execute(text("VACUUM"))
+            # WAL 模式下 VACUUM 的結果先寫入 WAL，checkpoint 後資料庫檔案才會縮小
+            conn.execute(text("PRAGMA wal_checkpoint(TRUNCATE)"))
+    size_after = _database_size()
+    if size_before:
+        print(f"資料庫檔案：{size_before / 1024:.1f} KB → {size_after / 1024:.1f} KB", file=sys.stderr)
+    return 0
+
+
+def _candidate_codecs(args):
+    """
+    報告中比較的格式：zlib（無字典 / 內建字典 / 設定的字典），有安裝 zstandard 時另比較 zstd
+    """
+    level = args.level if args.level is not None else settings.TEXT_COMPRESSION_LEVEL
+    candidates = [
+        ("zlib", TextCodec("zlib", level, 0, None)),
+        ("zlib+builtin", TextCodec("zlib", level, 0, BUILTIN_DICTIONARY)),
+    ]
+    dictionary_path = args.dict or settings.TEXT_COMPRESSION_DICT
+    trained = None
+    if dictionary_path:
+        with open(dictionary_path, "rb") as f:
+            trained = f.read()
+        candidates.append(("zlib+dict", TextCodec("zlib", level, 0, trained)))
+    if zstandard is not None:
+        candidates.append(("zstd", TextCodec("zstd", 3, 0, None)))
+        if trained:
+            candidates.append(("zstd+dict", TextCodec("zstd", 3, 0, trained)))
+    return candidates
+
+
+def _measure(codec: TextCodec, values):
+    """
+    返回 (總位元組數, 平均壓縮時間 µs, 解壓縮時間中位數 µs, 解壓縮時間 p95 µs)
+    """
+    total = 0
+    encode_times = []
+    decode_times = []
+    for value in values:
+        start = time.perf_counter()
+        stored = codec.encode(value)
+        encode_times.append(time.perf_counter() - start)
+        total += len(stored) if isinstance(stored, bytes) else len(stored.encode("utf-8"))
+        start = time.perf_counter()
+        codec.decode(stored)
+        decode_times.append(time.perf_counter() - start)
+    decode_times.sort()
+    p95 = decode_times[min(len(decode_times) - 1, int(len(decode_times) * 0.95))]
+    return (total, statistics.mean(encode_times) * 1e6,
+            statistics.median(decode_times) * 1e6, p95 * 1e6)
+
+
+def _sample(table: str, column: str, limit: int):
+    with engine.connect() as conn:
+        rows = conn.execute(
+            text(f"SELECT {column} FROM {table} WHERE {column} IS NOT NULL ORDER BY id DESC LIMIT :limit"),
+            {"limit": limit},
+        ).fetchall()
+    codec = get_codec()
+    return [row[0] for row in rows], [codec.decode(row[0]) for row in rows]
+
+
+def report(args):
+    """
+    各欄位以原始格式（大綱為 indent=2 的 JSON）與各種壓縮格式儲存時的大小與延遲
+    """
+    results = []
+    candidates = _candidate_codecs(args)
+    for table, column in compressed_columns():
+        raws, values = _sample(table, column, args.sample)
+        if not values:
+            continue
+        stored = sum(len(raw) if isinstance(raw, bytes) else len(raw.encode("utf-8")) for raw in raws)
+        if (table, column) == ("generations", "outline"):
+            original = []
+            for value in values:
+                try:
+                    original.append(json.dumps(json.loads(value), ensure_ascii=False, indent=2))
+                except json.JSONDecodeError:
+                    original.append(value)
+        else:
+            original = values
+        baseline = sum(len(value.encode("utf-8")) for value in original)
+        compact = [_compact(table, column, value) for value in values]
+        formats = [{"format": "plain", "bytes": baseline, "ratio": 1.0,
+                    "encode_us": 0.0, "decode_p50_us": 0.0, "decode_p95_us": 0.0}]
+        for name, codec in candidates:
+            total, encode_us, decode_p50, decode_p95 = _measure(codec, compact)
+            formats.append({
+                "format": name, "bytes": total, "ratio": round(total / baseline, 3),
+                "encode_us": round(encode_us, 1),
+                "decode_p50_us": round(decode_p50, 1), "decode_p95_us": round(decode_p95, 1),
+            })
+        results.append({
+            "column": f"{table}.{column}", "rows": len(values),
+            "stored_bytes": stored, "formats": formats,
+        })
+
+    if args.json:
+        print(json.dumps(results, ensure_ascii=False, indent=2))
+        return 0
+    for item in results:
+        print(f"{item['column']}（樣本 {item['rows']} 列，目前儲存 {item['stored_bytes']} bytes）")
+        print(f"  {'格式':<14}{'bytes':>12}{'比例':>8}{'壓縮 µs':>10}{'解壓 p50 µs':>13}{'解壓 p95 µs':>13}")
+        for row in item["formats"]:
+            print(f"  {row['format']:<14}{row['bytes']:>12}{row['ratio']:>8.3f}{row['encode_us']:>10.1f}"
+                  f"{row['decode_p50_us']:>13.1f}{row['decode_p95_us']:>13.1f}")
+    return 0
+
+
+def train(args):
+    samples = []
+    for table, column in compressed_columns():
+        _, values = _sample(table, column, args.sample)
+        samples.extend(_compact(table, column, value) for value in values)
+    dictionary = train_dictionary(samples, args.size)
+    with open(args.output, "wb") as f:
+        f.write(dictionary)
+    print(f"已由 {len(samples)} 份樣本建立字典 {args.output}（{len(dictionary)} bytes），"
+          f"設定 TEXT_COMPRESSION_DICT={args.output} 後執行 migrate 即可套用", file=sys.stderr)
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="大型文字欄位壓縮的遷移與報告工具")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    migrate_parser = sub.add_parser("migrate", help="將既有資料轉為目前設定的儲存格式")
+    migrate_parser.add_argument("--method", choices=["none", "zlib", "zstd"], help="預設為 TEXT_COMPRESSION")
+    migrate_parser.add_argument("--batch-size", type=int, default=500)
+    migrate_parser.add_argument("--vacuum", action="store_true", help="完成後執行 VACUUM 縮小資料庫檔案")
+
+    report_parser = sub.add_parser("report", help="比較各儲存格式的大小與延遲")
+    report_parser.add_argument("--sample", type=int, default=2000, help="每個欄位讀取的最新資料列數")
+    report_parser.add_argument("--json", action="store_true", help="以 JSON 輸出")
+
+    train_parser = sub.add_parser("train", help="由既有資料建立壓縮字典")
+    train_parser.add_argument("--output", required=True)
+    train_parser.add_argument("--size", type=int, default=16384, help="字典大小（bytes，zlib 最多使用 32 KB）")
+    train_parser.add_argument("--sample", type=int, default=2000, help="每個欄位讀取的最新資料列數")
+
+    for command in (migrate_parser, report_parser):
+        command.add_argument("--dict", help="字典檔（預設為 TEXT_COMPRESSION_DICT 或內建字典）")
+        command.add_argument("--level", type=int, help="壓縮等級（預設為 TEXT_COMPRESSION_LEVEL）")
+    args = parser.parse_args()
+
+    # 標準輸出只保留報告，遷移訊息輸出到標準錯誤
+    out = sys.stdout
+    with redirect_stdout(sys.stderr):
+        run_migrations(engine)
+    with redirect_stdout(out):
+        code = {"migrate": migrate, "report": report, "train": train}[args.command](args)
+    sys.exit(code)
+
+
+if __name__ == "__main__":
+    main()
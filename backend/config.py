@@ -3,10 +3,106 @@ from dotenv import load_dotenv
 
 load_dotenv()
 
+# 同步資料庫驅動對應的非同步驅動
+_ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+    "mysql": "mysql+aiomysql",
+}
+
+def _to_async_url(url: str) -> str:
+    """
+    將同步資料庫連接字串轉換為對應的非同步驅動版本
+    例如 sqlite:///./app.db -> sqlite+aiosqlite:///./app.db
+    """
+    scheme, sep, rest = url.partition("://")
+    if "+" in scheme or scheme not in _ASYNC_DRIVERS:
+        return url
+    return f"{_ASYNC_DRIVERS[scheme]}{sep}{rest}"
+
 class Settings:
     GROQ_API_KEY: str = os.getenv("GROQ_API_KEY", "")
+    # 選填：改用其他相容 Groq/OpenAI API 的端點（例如基準測試用的本機模擬伺服器）
+    GROQ_BASE_URL: str = os.getenv("GROQ_BASE_URL", "")
     DATABASE_URL: str = os.getenv("DATABASE_URL", "sqlite:///./learning_generator.db")
+    ASYNC_DATABASE_URL: str = os.getenv("ASYNC_DATABASE_URL", _to_async_url(DATABASE_URL))
+    # 啟動時執行資料庫遷移（以資料庫鎖依序執行）；設為 false 時需先執行 python -m migrations
+    MIGRATE_ON_STARTUP: bool = os.getenv("MIGRATE_ON_STARTUP", "true").lower() == "true"
+    # SQLite 遇到鎖定時的等待時間（毫秒）
+    SQLITE_BUSY_TIMEOUT_MS: int = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+    # 連線池設定（僅用於 PostgreSQL 等非 SQLite 資料庫）
+    DB_POOL_SIZE: int = int(os.getenv("DB_POOL_SIZE", "10"))
+    DB_MAX_OVERFLOW: int = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+    DB_POOL_TIMEOUT: int = int(os.getenv("DB_POOL_TIMEOUT", "30"))
+    DB_POOL_RECYCLE: int = int(os.getenv("DB_POOL_RECYCLE", "1800"))
     CORS_ORIGINS: list = ["http://localhost:5173", "http://localhost:3000"]
+    # 同時生成章節時允許的最大同時請求數（避免超過 API 速率限制）
+    GENERATION_MAX_CONCURRENCY: int = int(os.getenv("GENERATION_MAX_CONCURRENCY", "3"))
+    # 背景生成工作：worker 數量、輪詢間隔（秒）與租約時間（秒，逾時未更新心跳即由其他 worker 接手）
+    JOB_WORKERS: int = int(os.getenv("JOB_WORKERS", "2"))
+    JOB_POLL_INTERVAL: float = float(os.getenv("JOB_POLL_INTERVAL", "2"))
+    JOB_LEASE_SECONDS: int = int(os.getenv("JOB_LEASE_SECONDS", "60"))
+    # 批次生成：同時處理的單元數（每個單元內的章節另受 GENERATION_MAX_CONCURRENCY 限制）
+    BATCH_WORKERS: int = int(os.getenv("BATCH_WORKERS", "2"))
+    # 單一批次最多可提交的單元數
+    BATCH_MAX_UNITS: int = int(os.getenv("BATCH_MAX_UNITS", "1000"))
+    # 生成進度儲存：memory（單一程序）或 database（多個 uvicorn worker 共用）
+    PROGRESS_BACKEND: str = os.getenv("PROGRESS_BACKEND", "database")
+    # 進度在最後一次更新後保留的秒數
+    PROGRESS_TTL_SECONDS: int = int(os.getenv("PROGRESS_TTL_SECONDS", "3600"))
+    # database 模式下長輪詢查詢其他 worker 更新的間隔（秒）
+    PROGRESS_POLL_INTERVAL: float = float(os.getenv("PROGRESS_POLL_INTERVAL", "0.5"))
+    # 進度 SSE 連線超過此秒數沒有任何更新時送出 timeout 事件並結束
+    PROGRESS_STREAM_IDLE_SECONDS: int = int(os.getenv("PROGRESS_STREAM_IDLE_SECONDS", "600"))
+    # 大綱回應無法在本機修復時，附上驗證錯誤要求模型修正的最多次數
+    OUTLINE_REPAIR_ATTEMPTS: int = int(os.getenv("OUTLINE_REPAIR_ATTEMPTS", "1"))
+    # 相似單元偵測：相似度達 SIMILARITY_REUSE_THRESHOLD 的已完成教材可直接沿用，
+    # 達 SIMILARITY_SUGGEST_THRESHOLD 的列入建議；SIMILARITY_DIM 為 n-gram 雜湊維度（每筆記錄約 4 × DIM bytes）
+    SIMILARITY_ENABLED: bool = os.getenv("SIMILARITY_ENABLED", "true").lower() == "true"
+    SIMILARITY_REUSE_THRESHOLD: float = float(os.getenv("SIMILARITY_REUSE_THRESHOLD", "0.9"))
+    SIMILARITY_SUGGEST_THRESHOLD: float = float(os.getenv("SIMILARITY_SUGGEST_THRESHOLD", "0.5"))
+    SIMILARITY_DIM: int = int(os.getenv("SIMILARITY_DIM", "1024"))
+    # 大型文字欄位（大綱、教材、練習題）的壓縮：none / zlib / zstd（需安裝 zstandard），僅 SQLite 生效
+    # 短於 TEXT_COMPRESSION_MIN_BYTES 的文字不壓縮；TEXT_COMPRESSION_DICT 為 compress_cli.py train 建立的字典檔
+    TEXT_COMPRESSION: str = os.getenv("TEXT_COMPRESSION", "zlib").lower()
+    TEXT_COMPRESSION_LEVEL: int = int(os.getenv("TEXT_COMPRESSION_LEVEL", "6"))
+    TEXT_COMPRESSION_MIN_BYTES: int = int(os.getenv("TEXT_COMPRESSION_MIN_BYTES", "256"))
+    TEXT_COMPRESSION_DICT: str = os.getenv("TEXT_COMPRESSION_DICT", "")
+    # HTTP 回應壓縮：超過 RESPONSE_COMPRESSION_MIN_BYTES 的回應以 br（需安裝 brotli）或 gzip 壓縮
+    RESPONSE_COMPRESSION_ENABLED: bool = os.getenv("RESPONSE_COMPRESSION_ENABLED", "true").lower() == "true"
+    RESPONSE_COMPRESSION_MIN_BYTES: int = int(os.getenv("RESPONSE_COMPRESSION_MIN_BYTES", "1024"))
+    # LLM 回應快取（記憶體 LRU + SQLite 磁碟層）
+    LLM_CACHE_ENABLED: bool = os.getenv("LLM_CACHE_ENABLED", "true").lower() == "true"
+    LLM_CACHE_PATH: str = os.getenv("LLM_CACHE_PATH", "./llm_cache.db")
+    LLM_CACHE_MEMORY_SIZE: int = int(os.getenv("LLM_CACHE_MEMORY_SIZE", "256"))
+    LLM_CACHE_TTL_SECONDS: int = int(os.getenv("LLM_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+    LLM_CACHE_MAX_ENTRIES: int = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "10000"))
+    # LLM 供應商（以逗號分隔，多於一個時依延遲與錯誤率路由並自動切換），例如 "groq,gemini"
+    LLM_PROVIDERS: str = os.getenv("LLM_PROVIDERS", "groq")
+    # Gemini（選用，需安裝 google-generativeai）
+    GEMINI_API_KEY: str = os.getenv("GEMINI_API_KEY", "")
+    GEMINI_MODEL: str = os.getenv("GEMINI_MODEL", "gemini-1.5-flash")
+    # 多供應商路由：統計的樣本數與時間範圍（秒）、視為不健康的錯誤率、單次嘗試逾時（秒）
+    LLM_ROUTER_WINDOW: int = int(os.getenv("LLM_ROUTER_WINDOW", "50"))
+    LLM_ROUTER_WINDOW_SECONDS: float = float(os.getenv("LLM_ROUTER_WINDOW_SECONDS", "300"))
+    LLM_ROUTER_MAX_ERROR_RATE: float = float(os.getenv("LLM_ROUTER_MAX_ERROR_RATE", "0.5"))
+    LLM_ROUTER_ATTEMPT_TIMEOUT: float = float(os.getenv("LLM_ROUTER_ATTEMPT_TIMEOUT", "90"))
+    # LLM 呼叫的速率限制（每分鐘請求數 / token 數，0 表示不限制），依 Groq 帳號方案設定
+    LLM_RPM_LIMIT: float = float(os.getenv("LLM_RPM_LIMIT", "30"))
+    LLM_TPM_LIMIT: float = float(os.getenv("LLM_TPM_LIMIT", "0"))
+    # 單次呼叫逾時（秒）與失敗重試：最多重試次數、指數退避的基準與上限（秒）
+    LLM_TIMEOUT_SECONDS: float = float(os.getenv("LLM_TIMEOUT_SECONDS", "120"))
+    LLM_MAX_RETRIES: int = int(os.getenv("LLM_MAX_RETRIES", "4"))
+    LLM_BACKOFF_BASE_SECONDS: float = float(os.getenv("LLM_BACKOFF_BASE_SECONDS", "1"))
+    LLM_BACKOFF_MAX_SECONDS: float = float(os.getenv("LLM_BACKOFF_MAX_SECONDS", "30"))
+    # 斷路器：連續失敗次數達門檻即暫停呼叫，經過指定秒數後再試探
+    LLM_CIRCUIT_FAILURE_THRESHOLD: int = int(os.getenv("LLM_CIRCUIT_FAILURE_THRESHOLD", "5"))
+    LLM_CIRCUIT_RESET_SECONDS: float = float(os.getenv("LLM_CIRCUIT_RESET_SECONDS", "30"))
+    # 提示詞壓縮：出題時的教材內容預設只移除格式，不截斷內容
+    # 單章出題的章節內容超過 PROMPT_CHAPTER_CONTEXT_CHARS 字元、整份教材出題的內容超過
+    # PROMPT_UNIT_CONTEXT_TOKENS（估算的 token 數）時才截斷；0 表示不限制
+    PROMPT_CHAPTER_CONTEXT_CHARS: int = int(os.getenv("PROMPT_CHAPTER_CONTEXT_CHARS", "0"))
+    PROMPT_UNIT_CONTEXT_TOKENS: int = int(os.getenv("PROMPT_UNIT_CONTEXT_TOKENS", "0"))
 
 settings = Settings()
 
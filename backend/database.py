@@ -1,15 +1,62 @@
-from sqlalchemy import create_engine
+from contextlib import asynccontextmanager
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from config import settings
 
+_is_sqlite = "sqlite" in settings.DATABASE_URL
+
+def _engine_options() -> dict:
+    """
+    連線池設定：SQLite 使用 SQLAlchemy 預設值，其他資料庫（如 PostgreSQL）依環境變數調整
+    """
+    if _is_sqlite:
+        return {}
+    return {
+        "pool_size": settings.DB_POOL_SIZE,
+        "max_overflow": settings.DB_MAX_OVERFLOW,
+        "pool_timeout": settings.DB_POOL_TIMEOUT,
+        "pool_recycle": settings.DB_POOL_RECYCLE,
+        "pool_pre_ping": True,
+    }
+
+def _apply_sqlite_pragmas(dbapi_connection, connection_record):
+    """
+    每條 SQLite 連線建立時套用的設定：
+    - WAL：讀取不會被寫入阻擋，寫入也不會被讀取阻擋
+    - busy_timeout：遇到鎖定時等待而非立即回報 "database is locked"
+    - synchronous=NORMAL：WAL 模式下仍安全，且大幅減少 fsync 次數
+    """
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute(f"PRAGMA busy_timeout={settings.SQLITE_BUSY_TIMEOUT_MS}")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.close()
+
 engine = create_engine(
     settings.DATABASE_URL, 
-    connect_args={"check_same_thread": False} if "sqlite" in settings.DATABASE_URL else {}
+    connect_args={"check_same_thread": False} if _is_sqlite else {},
+    **_engine_options()
 )
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# 非同步引擎：供 FastAPI 非同步端點使用，等待資料庫時不阻塞事件迴圈
+async_engine = create_async_engine(settings.ASYNC_DATABASE_URL, **_engine_options())
+
+if _is_sqlite:
+    event.listen(engine, "connect", _apply_sqlite_pragmas)
+    event.listen(async_engine.sync_engine, "connect", _apply_sqlite_pragmas)
+
+AsyncSessionLocal = async_sessionmaker(
+    async_engine,
+    class_=AsyncSession,
+    autoflush=False,
+    expire_on_commit=False,
+)
+
 Base = declarative_base()
 
 def get_db():
@@ -18,3 +65,21 @@ def get_db():
         yield db
     finally:
         db.close()
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+@asynccontextmanager
+async def session_scope():
+    """
+    短交易：區塊正常結束時 commit、發生例外時 rollback，離開後立即歸還連線
+    呼叫 LLM 等耗時操作前應先離開區塊，避免長時間佔用連線或持有資料庫鎖
+    """
+    async with AsyncSessionLocal() as db:
+        try:
+            yield db
+            await db.commit()
+        except BaseException:
+            await db.rollback()
+            raise
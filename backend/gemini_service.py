@@ -1,109 +1,86 @@
-import google.generativeai as genai
-from config import settings
-import json
-
-class GeminiService:
-    def __init__(self):
-        genai.configure(api_key=settings.GEMINI_API_KEY)
-        self.model = genai.GenerativeModel('gemini-pro')
-
-    def generate_outline(self, subject: str, grade: str, unit: str) -> str:
-        """
-        階段一：生成教學大綱
-        使用 Chain of Thought 確保結構化輸出
-        """
-        prompt = f"""
-你是一位專業的教育內容規劃師。請為以下教學需求生成一個結構化的教學大綱。
-
-科目：{subject}
-年級：{grade}
-單元：{unit}
-
-請使用 Chain of Thought 方法，先思考該單元的核心概念，然後規劃教學順序。
-
-請以 JSON 格式輸出大綱，格式如下：
-{{
-  "title": "單元標題",
-  "objectives": ["學習目標1", "學習目標2"],
-  "sections": [
-    {{
-      "order": 1,
-      "title": "章節標題",
-      "topics": ["主題1", "主題2"]
-    }}
-  ]
-}}
-
-要求：
-1. 大綱應該循序漸進，從基礎到進階
-2. 考慮該年級學生的認知能力
-3. 確保邏輯連貫性
-4. 包含 3-5 個主要章節
-"""
-        
-        response = self.model.generate_content(prompt)
-        return response.text
-
-    def generate_content(self, subject: str, grade: str, unit: str, outline: str) -> str:
-        """
-        階段二：根據大綱生成詳細教材
-        """
-        prompt = f"""
-你是一位經驗豐富的{subject}老師。請根據以下大綱，為{grade}學生編寫詳細的教材內容。
-
-單元：{unit}
+import asyncio
 
-大綱：
-{outline}
-
-要求：
-1. 使用淺顯易懂的語言，適合{grade}學生的理解程度
-2. 提供生活化的例子和情境
-3. 對於數學/理化科目，請清楚說明公式和計算步驟
-4. 適當使用圖表說明（用文字描述圖表內容）
-5. 每個概念後面提供簡單的範例
-
-請以清晰的段落和標題組織內容，確保學生能夠理解並應用所學知識。
-"""
-        
-        response = self.model.generate_content(prompt)
-        return response.text
-
-    def generate_questions(self, subject: str, grade: str, unit: str, content: str) -> str:
-        """
-        階段三：根據教材內容生成練習題
-        """
-        prompt = f"""
-你是一位專業的題目設計師。請根據以下教材內容，為{grade}學生設計練習題。
-
-科目：{subject}
-單元：{unit}
-
-教材內容：
-{content}
-
-請以 JSON 格式輸出題目，格式如下：
-{{
-  "questions": [
-    {{
-      "number": 1,
-      "type": "選擇題/填充題/計算題/問答題",
-      "question": "題目內容",
-      "options": ["選項A", "選項B", "選項C", "選項D"],  // 僅選擇題需要
-      "answer": "正確答案",
-      "explanation": "詳細解析"
-    }}
-  ]
-}}
-
-要求：
-1. 設計 5-8 題練習題
-2. 題目難度應符合{grade}程度
-3. 涵蓋教材中的主要概念
-4. 對於數學題目，確保數值準確且合理
-5. 提供詳細的解題步驟和說明
-6. 題型多樣化（選擇、填充、計算等）
-"""
-        
-        response = self.model.generate_content(prompt)
-        return response.text
+from config import settings
+from groq_service import AsyncGroqService
+from llm_cache import LLMCache
+from llm_providers import ChatResult, ChatUsage, LLMProvider
+
+try:
+    import google.generativeai as genai
+except ImportError:  # 選用套件：只有使用 Gemini 時才需要安裝
+    genai = None
+
+
+def _usage(response) -> ChatUsage:
+    metadata = getattr(response, "usage_metadata", None)
+    if metadata is None:
+        return None
+    return ChatUsage(
+        prompt_tokens=metadata.prompt_token_count or 0,
+        completion_tokens=metadata.candidates_token_count or 0,
+        total_tokens=metadata.total_token_count or 0,
+    )
+
+
+class GeminiProvider(LLMProvider):
+    """
+    Google Gemini 供應商（google-generativeai 非同步 API）
+    Gemini 沒有經過 LLMClient 的速率限制與重試，失敗時由 ProviderRouter 改用其他供應商
+    """
+
+    name = "gemini"
+
+    def __init__(self, model: str = None, api_key: str = None):
+        if genai is None:
+            raise RuntimeError("使用 Gemini 需先安裝 google-generativeai 套件")
+        api_key = api_key or settings.GEMINI_API_KEY
+        if not api_key:
+            raise RuntimeError("使用 Gemini 需設定 GEMINI_API_KEY")
+        genai.configure(api_key=api_key)
+        self.model = model or settings.GEMINI_MODEL
+        self._model = genai.GenerativeModel(self.model)
+
+    def _prompt(self, messages: list) -> str:
+        return "\n\n".join(m.get("content") or "" for m in messages)
+
+    def _config(self, max_tokens: int, temperature: float, json_mode: bool):
+        config = {"max_output_tokens": max_tokens, "temperature": temperature}
+        if json_mode:
+            config["response_mime_type"] = "application/json"
+        return genai.GenerationConfig(**config)
+
+    async def complete(self, messages: list, max_tokens: int, temperature: float = 0.7,
+                       json_mode: bool = False) -> ChatResult:
+        response = await asyncio.wait_for(
+            self._model.generate_content_async(
+                self._prompt(messages),
+                generation_config=self._config(max_tokens, temperature, json_mode),
+            ),
+            timeout=settings.LLM_TIMEOUT_SECONDS,
+        )
+        return ChatResult(response.text, _usage(response))
+
+    async def stream(self, messages: list, max_tokens: int, temperature: float = 0.7,
+                     json_mode: bool = False):
+        response = await self._model.generate_content_async(
+            self._prompt(messages),
+            generation_config=self._config(max_tokens, temperature, json_mode),
+            stream=True,
+        )
+        usage = None
+        async for chunk in response:
+            usage = _usage(chunk) or usage
+            if chunk.text:
+                yield chunk.text, None
+        yield "", usage
+
+
+class GeminiService(AsyncGroqService):
+    """
+    以 Gemini 生成教材：提示詞與輸出格式（大綱 chapters / chapter_number、教材 JSON、練習題 Markdown）
+    與 AsyncGroqService 完全相同，只替換底層的 LLM 供應商
+    provider 未指定時建立 GeminiProvider（測試時可傳入不呼叫 API 的替代實作）
+    """
+
+    def __init__(self, cache: LLMCache = None, provider: LLMProvider = None):
+        super().__init__(cache=cache, provider=provider or GeminiProvider())
@@ -1,37 +1,35 @@
-from groq import Groq
 from config import settings
+from llm_cache import LLMCache
+from llm_client import estimate_tokens
+from llm_providers import LLMProvider, create_provider
+from prompt_compaction import build_outline_digest, compact_markdown, compact_unit_content
+from prompt_metrics import PromptMetrics
+from latex_normalizer import normalize_latex, LatexStreamNormalizer
+from outline_schema import Outline, OutlineStreamParser, validate_outline, dump_outline
+import asyncio
+import inspect
 import json
 import re
+from typing import Union
 
-class GroqService:
-    def __init__(self):
-        self.client = Groq(api_key=settings.GROQ_API_KEY)
-        # 使用 Groq 支援的模型
-        self.model = "openai/gpt-oss-120b"
-    
-    def _fix_latex_brackets(self, text: str) -> str:
-        """
-        自動修正 LaTeX 公式格式：將 [ ] 替換為 $ $
-        同時處理 \[ \] 格式
-        """
-        # 替換 [ ... ] 為 $ ... $
-        # 使用非貪婪匹配，只匹配數學公式（包含反斜線或特殊符號）
-        text = re.sub(r'\[\s*([^\[\]]*?(?:\\[a-zA-Z]+|\\frac|\\text|\\times|\\div)[^\[\]]*?)\s*\]', r'$\1$', text)
-        
-        # 替換 \[ ... \] 為 $$ ... $$
-        text = re.sub(r'\\\[\s*(.+?)\s*\\\]', r'$$\1$$', text, flags=re.DOTALL)
-        
-        # 替換 \( ... \) 為 $ ... $
-        text = re.sub(r'\\\(\s*(.+?)\s*\\\)', r'$\1$', text)
-        
-        return text
 
-    def generate_outline(self, subject: str, grade: str, unit: str) -> str:
-        """
-        階段一：生成教學大綱（JSON格式）
-        返回結構化的章節資訊，用於後續分章節生成內容
-        """
-        prompt = f"""
+def _default_cache():
+    return LLMCache.from_settings() if settings.LLM_CACHE_ENABLED else None
+
+
+def _fix_latex_brackets(text: str) -> str:
+    """
+    自動修正 LaTeX 公式格式：將 [ ] 與 \( \) 替換為 $ $，\[ \] 替換為 $$ $$
+    （單次線性掃描，不含 [ 與 \( 的文字直接返回）
+    """
+    return normalize_latex(text)
+
+
+# ===== 提示詞建構 =====
+
+
+def _build_outline_prompt(subject: str, grade: str, unit: str) -> str:
+    return f"""
 你是一位專業的教育內容規劃師。請為以下教學需求生成一個結構化的教學大綱。
 
 科目：{subject}
@@ -79,32 +77,36 @@ class GroqService:
 5. 每個章節包含 2-4 個主題
 6. 只輸出有效的 JSON，不要有額外的文字說明
 """
-        
-        chat_completion = self.client.chat.completions.create(
-            messages=[
-                {
-                    "role": "user",
-                    "content": prompt,
-                }
-            ],
-            model=self.model,
-            temperature=0.7,
-            max_tokens=4096,
-        )
-        
-        return chat_completion.choices[0].message.content
 
-    def generate_chapter_content(self, subject: str, grade: str, unit: str, 
-                                chapter_number: int, chapter_title: str, 
-                                topics: list, full_outline: str) -> dict:
-        """
-        為單個章節生成詳細內容和練習題
-        返回包含內容和練習題的字典
-        """
-        topics_text = "\n".join([f"- {topic}" for topic in topics])
-        
-        # 生成章節內容
-        content_prompt = f"""
+
+def _build_outline_repair_prompt(subject: str, grade: str, unit: str,
+                                 output: str, error: str) -> str:
+    return f"""
+你先前為以下教學需求生成的教學大綱 JSON 格式不正確，請修正後重新輸出。
+
+科目：{subject}
+年級：{grade}
+單元：{unit}
+
+錯誤：{error}
+
+先前的輸出：
+{output[:6000]}
+
+請保留原本的內容，只修正格式，輸出完整的 JSON 物件：
+- title：單元標題（字串）
+- objectives：學習目標（字串陣列）
+- chapters：章節陣列，每個章節包含 chapter_number（不重複的整數）、title、topics（字串陣列）、description
+只輸出有效的 JSON，不要有額外的文字說明或 markdown 標記。
+"""
+
+
+def _build_chapter_content_prompt(subject: str, grade: str, unit: str,
+                                  chapter_number: int, chapter_title: str,
+                                  topics: list, outline_digest: str) -> str:
+    topics_text = "\n".join([f"- {topic}" for topic in topics])
+    
+    return f"""
 你是一位經驗豐富的{subject}老師。請為{grade}學生編寫以下章節的詳細教材內容。
 
 單元：{unit}
@@ -113,8 +115,8 @@ class GroqService:
 本章節主題：
 {topics_text}
 
-完整大綱參考：
-{full_outline}
+單元大綱（各章節與主題）：
+{outline_digest}
 
 要求：
 1. 使用淺顯易懂的語言，適合{grade}學生的理解程度
@@ -137,21 +139,12 @@ class GroqService:
 
 請生成完整的章節內容：
 """
-        
-        content_completion = self.client.chat.completions.create(
-            messages=[{"role": "user", "content": content_prompt}],
-            model=self.model,
-            temperature=0.7,
-            max_tokens=2048,
-        )
-        
-        chapter_content = content_completion.choices[0].message.content
-        
-        # 自動修正 LaTeX 公式格式
-        chapter_content = self._fix_latex_brackets(chapter_content)
-        
-        # 生成該章節的練習題
-        questions_prompt = f"""
+
+
+def _build_chapter_questions_prompt(subject: str, grade: str, unit: str,
+                                    chapter_number: int, chapter_title: str,
+                                    chapter_context: str) -> str:
+    return f"""
 你是一位專業的題目設計師。請根據以下章節內容，為{grade}學生設計練習題。
 
 科目：{subject}
@@ -159,7 +152,7 @@ class GroqService:
 章節：第{chapter_number}章 - {chapter_title}
 
 章節內容：
-{chapter_content}
+{chapter_context}
 
 請以清晰的 Markdown 格式輸出 3-5 題練習題，**所有題型都必須使用選擇題格式（提供 A/B/C/D 四個選項）**：
 
@@ -239,89 +232,67 @@ $$v = \\frac{{d}}{{t}} = \\frac{{800\\text{{ m}}}}{{10\\text{{ min}}}} = 80\\tex
 11. 四個選項中要包含：正確答案 + 3個有干擾性的錯誤答案
 12. 錯誤選項應該是學生可能犯的常見錯誤（如計算錯誤、單位換算錯誤、概念混淆等）
 """
-        
-        questions_completion = self.client.chat.completions.create(
-            messages=[{"role": "user", "content": questions_prompt}],
-            model=self.model,
-            temperature=0.7,
-            max_tokens=2048,
-        )
-        
-        chapter_questions = questions_completion.choices[0].message.content
-        
-        # 自動修正 LaTeX 公式格式
-        chapter_questions = self._fix_latex_brackets(chapter_questions)
-        
-        return {
-            "content": chapter_content,
-            "questions": chapter_questions
-        }
 
-    def generate_content(self, subject: str, grade: str, unit: str, outline: str, progress_callback=None) -> str:
-        """
-        階段二：根據大綱逐章節生成詳細教材
-        返回包含所有章節內容和練習題的JSON字符串
-        """
-        try:
-            # 解析 JSON 大綱
-            import json
-            outline_data = json.loads(outline)
-            
-            # 準備結果結構
-            result = {
-                "title": outline_data['title'],
-                "objectives": outline_data['objectives'],
-                "chapters": []
-            }
-            
-            # 逐章節生成內容
-            chapters = outline_data['chapters']
-            total_chapters = len(chapters)
-            
-            for index, chapter in enumerate(chapters, 1):
-                chapter_num = chapter['chapter_number']
-                chapter_title = chapter['title']
-                topics = chapter['topics']
-                description = chapter.get('description', '')
-                
-                print(f"正在生成第 {chapter_num} 章：{chapter_title}... ({index}/{total_chapters})")
-                
-                # 調用 AI 生成本章節內容和練習題
-                chapter_data = self.generate_chapter_content(
-                    subject, grade, unit,
-                    chapter_num, chapter_title, topics,
-                    outline
-                )
-                
-                # 生成完成後再更新進度（表示已完成的章數）
-                if progress_callback:
-                    progress_callback(index, total_chapters)
-                
-                # 添加到結果中
-                result["chapters"].append({
-                    "chapter_number": chapter_num,
-                    "title": chapter_title,
-                    "topics": topics,
-                    "description": description,
-                    "content": chapter_data["content"],
-                    "questions": chapter_data["questions"]
-                })
-            
-            print(f"所有章節生成完成！")
-            
-            # 返回JSON字符串
-            return json.dumps(result, ensure_ascii=False, indent=2)
-            
-        except json.JSONDecodeError as e:
-            # 如果 JSON 解析失敗，回退到原來的方法
-            print(f"JSON 解析失敗: {e}，使用備用方法")
-            return self._generate_content_fallback(subject, grade, unit, outline)
+
+def _build_chapter_combined_prompt(subject: str, grade: str, unit: str,
+                                   chapter_number: int, chapter_title: str,
+                                   topics: list, outline_digest: str) -> str:
+    topics_text = "\n".join([f"- {topic}" for topic in topics])
     
-    def _generate_content_fallback(self, subject: str, grade: str, unit: str, outline: str) -> str:
-        """
-        備用方法：如果 JSON 解析失敗，使用原來的一次性生成方法
-        """
-        prompt = f"""
+    return f"""
+你是一位經驗豐富的{subject}老師兼題目設計師。請為{grade}學生編寫以下章節的詳細教材內容，並依據該內容設計練習題。
+
+單元：{unit}
+章節：第{chapter_number}章 - {chapter_title}
+
+本章節主題：
+{topics_text}
+
+單元大綱（各章節與主題）：
+{outline_digest}
+
+請只輸出一個 JSON 物件，格式如下：
+{{
+  "content": "本章節的教材內容（Markdown）",
+  "questions": "本章節的練習題（Markdown）"
+}}
+
+content 要求：
+1. 使用淺顯易懂的語言，適合{grade}學生的理解程度，提供生活化的例子和情境
+2. 對於數學/理化科目，請清楚說明公式和計算步驟，每個概念後面提供簡單的範例
+3. 使用 Markdown 格式，包含適當的標題層級（##, ###）；表格使用標準 Markdown 表格格式
+4. 內容應該完整且詳細，約500-800字
+
+questions 要求：
+1. 設計 3-5 題涵蓋本章節主要概念的練習題，難度符合{grade}程度
+2. **所有題目都必須是選擇題格式，提供 A/B/C/D 四個選項**，錯誤選項應為學生常見的錯誤
+3. 每題格式如下，每題結束用 --- 分隔：
+
+## 第1題（計算題）
+題目內容
+
+A) 選項A
+B) 選項B
+C) 選項C
+D) 選項D
+
+**正確答案：** C
+
+**詳細解析：**
+解題步驟和說明
+
+---
+
+**【重要】數學公式格式規範（content 與 questions 皆適用）**：
+- ✅ 正確：行內公式用單個 $ 符號，例如 $v = \\frac{{d}}{{t}}$；塊級公式用雙 $$ 符號
+- ❌ 錯誤：絕對不要使用方括號 [ ] 包裹公式
+- JSON 字串中的反斜線與換行必須正確跳脫（\\\\ 與 \\n）
+- 只輸出有效的 JSON，不要有額外的文字說明
+"""
+
+
+def _build_content_fallback_prompt(subject: str, grade: str, unit: str, outline: str) -> str:
+    return f"""
 你是一位經驗豐富的{subject}老師。請根據以下大綱，為{grade}學生編寫詳細的教材內容。
 
 單元：{unit}
@@ -340,26 +311,10 @@ $$v = \\frac{{d}}{{t}} = \\frac{{800\\text{{ m}}}}{{10\\text{{ min}}}} = 80\\tex
 
 請生成完整且結構清晰的教材內容，確保學生能夠理解並應用所學知識。
 """
-        
-        chat_completion = self.client.chat.completions.create(
-            messages=[
-                {
-                    "role": "user",
-                    "content": prompt,
-                }
-            ],
-            model=self.model,
-            temperature=0.7,
-            max_tokens=4096,
-        )
-        
-        return chat_completion.choices[0].message.content
 
-    def generate_questions(self, subject: str, grade: str, unit: str, content: str) -> str:
-        """
-        階段三：根據教材內容生成練習題
-        """
-        prompt = f"""
+
+def _build_questions_prompt(subject: str, grade: str, unit: str, content: str) -> str:
+    return f"""
 你是一位專業的題目設計師。請根據以下教材內容，為{grade}學生設計練習題。
 
 科目：{subject}
@@ -406,18 +361,698 @@ D) 選項D
 6. 題型多樣化（選擇、填充、計算、問答等）
 7. 使用清晰的 Markdown 格式，每題之間用分隔線（---）區分
 """
+
+
+def _parse_outline(outline) -> dict:
+    """
+    取得結構化大綱：已驗證的 dict 直接使用，文字則先本機修復再以 Outline 驗證
+    無法解析時返回 None（改用備用方法整份生成）
+    """
+    if isinstance(outline, dict):
+        return outline
+    parsed, error = validate_outline(outline)
+    if parsed is None:
+        print(f"大綱無法解析: {error}，使用備用方法")
+        return None
+    return parsed.model_dump()
+
+
+def _outline_text(outline) -> str:
+    return outline if isinstance(outline, str) else json.dumps(outline, ensure_ascii=False, indent=2)
+
+
+def _build_content_result(outline_data: dict) -> dict:
+    """
+    建立教材結果的外層結構（章節稍後填入）
+    """
+    return {
+        "title": outline_data['title'],
+        "objectives": outline_data['objectives'],
+        "chapters": []
+    }
+
+
+def _select_chapters(outline_data: dict, chapter_numbers=None) -> list:
+    """
+    依 chapter_numbers 篩選要生成的章節（None 表示全部），維持大綱中的順序
+    """
+    chapters = outline_data['chapters']
+    if chapter_numbers is None:
+        return chapters
+    wanted = set(chapter_numbers)
+    return [c for c in chapters if c['chapter_number'] in wanted]
+
+
+def build_chapter_entry(chapter: dict, chapter_data: dict) -> dict:
+    """
+    將大綱中的章節定義與生成結果合併為輸出格式
+    """
+    return {
+        "chapter_number": chapter['chapter_number'],
+        "title": chapter['title'],
+        "topics": chapter['topics'],
+        "description": chapter.get('description', ''),
+        "content": chapter_data["content"],
+        "questions": chapter_data["questions"]
+    }
+
+
+def _parse_combined_chapter(text: str) -> dict:
+    """
+    解析合併模式的回應，返回 {"content", "questions"}（已修正 LaTeX 格式）
+    無法解析時返回 None；只缺少練習題時 questions 為 None，由呼叫端另外生成
+    """
+    text = (text or "").strip()
+    if text.startswith("```"):
+        text = re.sub(r"^```(?:json)?\s*|\s*```$", "", text)
+    try:
+        data = json.loads(text)
+    except json.JSONDecodeError:
+        return None
+    if not isinstance(data, dict):
+        return None
+    content = data.get("content")
+    if not isinstance(content, str) or not content.strip():
+        return None
+    questions = data.get("questions")
+    if not isinstance(questions, str) or not questions.strip():
+        questions = None
+    return {
+        "content": _fix_latex_brackets(content),
+        "questions": _fix_latex_brackets(questions) if questions else None
+    }
+
+
+class AsyncGroqService:
+    """
+    教材生成服務（非同步）：等待模型回應時不佔用執行緒，單一 worker 即可同時處理大量生成請求。
+    提示詞與輸出格式由本模組的提示詞建構函式統一處理，
+    模型呼叫交給 LLMProvider（預設依 LLM_PROVIDERS 設定建立，可為 Groq、Gemini 或多供應商路由）
+    """
+
+    def __init__(self, cache: LLMCache = None, provider: LLMProvider = None):
+        self.provider = provider or create_provider()
+        # 快取鍵使用供應商的模型名稱
+        self.model = self.provider.model
+        self.cache = cache if cache is not None else _default_cache()
+        # 各提示詞模板的 token 用量統計
+        self.metrics = PromptMetrics()
+
+    # ===== 提示詞壓縮 =====
+
+    def _outline_context(self, full_outline: str, outline_digest: str = None,
+                         template: str = "chapter_content") -> str:
+        """
+        章節提示詞使用的大綱摘要；未提供時由完整大綱建立
+        """
+        if outline_digest is None:
+            outline_digest = build_outline_digest(full_outline)
+        self.metrics.record_compaction(template, full_outline, outline_digest)
+        return outline_digest
+
+    def _chapter_questions_context(self, chapter_content: str) -> str:
+        """
+        單章出題提示詞使用的章節內容：預設只移除不影響出題的格式（不遺失內容），
+        PROMPT_CHAPTER_CONTEXT_CHARS 大於 0 時才截斷至該字元數
+        """
+        context = compact_markdown(chapter_content, settings.PROMPT_CHAPTER_CONTEXT_CHARS)
+        self.metrics.record_compaction("chapter_questions", chapter_content, context)
+        return context
+
+    def _unit_questions_context(self, content: str) -> str:
+        """
+        整份教材出題提示詞使用的內容（不含各章節已生成的練習題）：預設不截斷，
+        超過 PROMPT_UNIT_CONTEXT_TOKENS 時才截斷，並記錄於 context_truncations
+        """
+        context, truncated = compact_unit_content(content)
+        if truncated:
+            print(f"整份教材出題內容超過 PROMPT_UNIT_CONTEXT_TOKENS={settings.PROMPT_UNIT_CONTEXT_TOKENS}，"
+                  f"已截斷為約 {estimate_tokens(context)} tokens")
+        self.metrics.record_compaction("unit_questions", content, context, truncated=truncated)
+        return context
+
+    # ===== 回應快取 =====
+
+    def _cache_lookup(self, messages: list, temperature: float, max_tokens: int,
+                      use_cache: bool, **params):
+        """
+        計算快取鍵並查詢快取，返回 (快取鍵, 快取內容)
+        未啟用快取時快取鍵為 None；use_cache=False 時略過讀取，但新結果仍會寫入快取
+        """
+        if self.cache is None:
+            return None, None
+        key = LLMCache.make_key(self.model, messages, temperature, max_tokens, **params)
+        if not use_cache:
+            self.cache.record_bypass()
+            return key, None
+        return key, self.cache.get(key)
+
+    def _cache_store(self, key: str, text: str):
+        if key is not None and text:
+            self.cache.set(key, text)
+
+    # ===== API 呼叫 =====
+
+    async def _chat(self, prompt: str, max_tokens: int, temperature: float = 0.7,
+                    use_cache: bool = True, template: str = "other",
+                    json_mode: bool = False) -> str:
+        """
+        非同步呼叫 LLM 並返回文字內容（相同請求優先使用快取）
+        """
+        messages = [
+            {
+                "role": "user",
+                "content": prompt,
+            }
+        ]
+        params = {"response_format": {"type": "json_object"}} if json_mode else {}
+        # 磁碟快取為同步 SQLite 操作，放到執行緒中避免阻塞事件迴圈
+        key, cached = await asyncio.to_thread(
+            self._cache_lookup, messages, temperature, max_tokens, use_cache, **params
+        )
+        if cached is not None:
+            self.metrics.record_cache_hit(template)
+            return cached
+        
+        result = await self.provider.complete(messages, max_tokens, temperature, json_mode)
+        self.metrics.record_call(template, len(prompt), result.usage)
+        
+        text = result.text
+        await asyncio.to_thread(self._cache_store, key, text)
+        return text
+
+    async def _chat_stream(self, prompt: str, max_tokens: int, temperature: float = 0.7,
+                           use_cache: bool = True, template: str = "other",
+                           json_mode: bool = False):
+        """
+        以串流模式呼叫 LLM，逐段產出模型生成的文字
+        快取命中時直接一次產出完整內容；快取鍵與 _chat 相同，兩者可共用快取
+        """
+        messages = [
+            {
+                "role": "user",
+                "content": prompt,
+            }
+        ]
+        params = {"response_format": {"type": "json_object"}} if json_mode else {}
+        key, cached = await asyncio.to_thread(
+            self._cache_lookup, messages, temperature, max_tokens, use_cache, **params
+        )
+        if cached is not None:
+            self.metrics.record_cache_hit(template)
+            yield cached
+            return
+        
+        parts = []
+        usage = None
+        async for delta, chunk_usage in self.provider.stream(messages, max_tokens, temperature,
+                                                             json_mode):
+            usage = chunk_usage or usage
+            if delta:
+                parts.append(delta)
+                yield delta
+        
+        self.metrics.record_call(template, len(prompt), usage)
+        # 完整串流結束後才寫入快取，避免中斷時存入不完整的內容
+        await asyncio.to_thread(self._cache_store, key, "".join(parts))
+
+    async def generate_outline(self, subject: str, grade: str, unit: str,
+                               use_cache: bool = True) -> Outline:
+        """
+        階段一：生成教學大綱（JSON 模式）
+        回應以 Outline 驗證，格式錯誤先在本機修復；無法修復時才附上錯誤重新要求模型修正
+        返回驗證後的大綱，呼叫端以 dump_outline 取得儲存用的文字，結構直接寫入 outline_data
+        """
+        prompt = _build_outline_prompt(subject, grade, unit)
+        text = await self._chat(prompt, max_tokens=4096, use_cache=use_cache, template="outline",
+                                json_mode=True)
+        return await self._validated_outline(subject, grade, unit, text, use_cache)
+
+    async def _validated_outline(self, subject: str, grade: str, unit: str, text: str,
+                                 use_cache: bool) -> Outline:
+        """
+        驗證模型輸出的大綱（先本機修復），仍無效時要求模型修正，最多 OUTLINE_REPAIR_ATTEMPTS 次
+        """
+        outline, error = validate_outline(text)
+        for _ in range(settings.OUTLINE_REPAIR_ATTEMPTS):
+            if outline is not None:
+                break
+            print(f"大綱格式錯誤: {error}，要求模型修正")
+            repair_prompt = _build_outline_repair_prompt(subject, grade, unit, text, error)
+            text = await self._chat(repair_prompt, max_tokens=4096, temperature=0.2,
+                                    use_cache=use_cache, template="outline_repair", json_mode=True)
+            outline, error = validate_outline(text)
+        if outline is None:
+            raise ValueError(f"大綱格式無效: {error}")
+        return outline
+
+    async def generate_chapter_content(self, subject: str, grade: str, unit: str,
+                                       chapter_number: int, chapter_title: str,
+                                       topics: list, full_outline: str,
+                                       use_cache: bool = True, outline_digest: str = None,
+                                       chapter_mode: str = "separate") -> dict:
+        """
+        為單個章節生成詳細內容和練習題
+        提示詞只帶入大綱摘要（章節標題與主題）；同一單元的多個章節可傳入預先建立的 outline_digest
+        chapter_mode 為 "combined" 時以單次 JSON 模式呼叫同時取得內容與練習題，
+        回應無法解析時改用分兩次呼叫（先內容、再練習題）的流程
+        """
+        chapter_content = None
+        if chapter_mode == "combined":
+            combined = await self._generate_chapter_combined(
+                subject, grade, unit, chapter_number, chapter_title, topics,
+                full_outline, outline_digest, use_cache
+            )
+            if combined is not None and combined["questions"] is not None:
+                return combined
+            if combined is not None:
+                # 只缺少練習題時沿用已生成的內容，只補生成練習題
+                chapter_content = combined["content"]
+        
+        if chapter_content is None:
+            content_prompt = _build_chapter_content_prompt(
+                subject, grade, unit, chapter_number, chapter_title, topics,
+                self._outline_context(full_outline, outline_digest)
+            )
+            chapter_content = _fix_latex_brackets(
+                await self._chat(content_prompt, max_tokens=2048, use_cache=use_cache,
+                                 template="chapter_content")
+            )
+        
+        questions_prompt = _build_chapter_questions_prompt(
+            subject, grade, unit, chapter_number, chapter_title,
+            self._chapter_questions_context(chapter_content)
+        )
+        chapter_questions = _fix_latex_brackets(
+            await self._chat(questions_prompt, max_tokens=2048, use_cache=use_cache,
+                             template="chapter_questions")
+        )
+        
+        return {
+            "content": chapter_content,
+            "questions": chapter_questions
+        }
+
+    async def _generate_chapter_combined(self, subject: str, grade: str, unit: str,
+                                         chapter_number: int, chapter_title: str, topics: list,
+                                         full_outline: str, outline_digest: str, use_cache: bool):
+        """
+        合併模式：單次呼叫生成章節內容與練習題，無法取得有效 JSON 時返回 None
+        """
+        prompt = _build_chapter_combined_prompt(
+            subject, grade, unit, chapter_number, chapter_title, topics,
+            self._outline_context(full_outline, outline_digest, template="chapter_combined")
+        )
+        try:
+            text = await self._chat(prompt, max_tokens=4096, use_cache=use_cache,
+                                    template="chapter_combined", json_mode=True)
+        except Exception as e:
+            # 供應商經由 ProviderRouter 呼叫，錯誤型別依供應商而異（Groq 的 BadRequestError、Gemini 的例外等）；
+            # 任何錯誤都改用分次生成（CancelledError 不是 Exception，取消時照常中止）
+            print(f"第 {chapter_number} 章合併生成失敗: {e}，改用分次生成")
+            return None
+        combined = _parse_combined_chapter(text)
+        if combined is None:
+            print(f"第 {chapter_number} 章合併生成的回應無法解析，改用分次生成")
+        return combined
+
+    async def generate_content(self, subject: str, grade: str, unit: str, outline: Union[str, dict],
+                               progress_callback=None, max_concurrency: int = None,
+                               use_cache: bool = True, chapter_mode: str = "separate",
+                               chapter_numbers=None, chapter_callback=None) -> str:
+        """
+        階段二：根據大綱分章節生成詳細教材
+        以 asyncio.Semaphore 限制同時進行中的章節數，輸出維持大綱中的章節順序
+        chapter_numbers 指定時只生成這些章節（結果也只包含這些章節），用於續傳未完成的章節；
+        chapter_callback(entry, error) 在每個章節完成或失敗時呼叫，可用於逐章寫入資料庫
+        outline 可為大綱文字或已驗證的大綱 dict（不需重新解析）
+        """
+        outline_data = _parse_outline(outline)
+        if outline_data is None:
+            return await self._generate_content_fallback(subject, grade, unit, outline, use_cache)
+        outline = _outline_text(outline)
         
-        chat_completion = self.client.chat.completions.create(
-            messages=[
-                {
-                    "role": "user",
-                    "content": prompt,
-                }
-            ],
-            model=self.model,
-            temperature=0.7,
-            max_tokens=4096,
+        result = _build_content_result(outline_data)
+        total_chapters = len(outline_data['chapters'])
+        chapters = _select_chapters(outline_data, chapter_numbers)
+        if max_concurrency is None:
+            max_concurrency = settings.GENERATION_MAX_CONCURRENCY
+        semaphore = asyncio.Semaphore(max(1, max_concurrency))
+        # 大綱摘要每個單元只建立一次，所有章節共用
+        outline_digest = build_outline_digest(outline_data)
+        # 續傳時未指定的章節視為已完成
+        completed = total_chapters - len(chapters)
+        
+        async def notify(callback, *args, **kwargs):
+            # 回調可為一般函式或 coroutine function（例如寫入共用的進度儲存）
+            if callback:
+                callback_result = callback(*args, **kwargs)
+                if inspect.isawaitable(callback_result):
+                    await callback_result
+        
+        async def generate_one(index: int, chapter: dict) -> dict:
+            nonlocal completed
+            async with semaphore:
+                print(f"正在生成第 {chapter['chapter_number']} 章：{chapter['title']}... ({index}/{total_chapters})")
+                try:
+                    chapter_data = await self.generate_chapter_content(
+                        subject, grade, unit,
+                        chapter['chapter_number'], chapter['title'], chapter['topics'],
+                        outline, use_cache=use_cache, outline_digest=outline_digest,
+                        chapter_mode=chapter_mode
+                    )
+                except Exception as e:
+                    await notify(chapter_callback, chapter, error=e)
+                    raise
+            entry = build_chapter_entry(chapter, chapter_data)
+            await notify(chapter_callback, entry)
+            # 單執行緒事件迴圈中更新計數，不需加鎖
+            completed += 1
+            await notify(progress_callback, completed, total_chapters)
+            return entry
+        
+        tasks = [
+            asyncio.create_task(generate_one(index, chapter))
+            for index, chapter in enumerate(chapters, 1)
+        ]
+        try:
+            result["chapters"] = await asyncio.gather(*tasks)
+        except Exception:
+            # 任一章節失敗時取消其餘章節，避免浪費 API 配額
+            for task in tasks:
+                task.cancel()
+            raise
+        
+        print(f"所有章節生成完成！")
+        return json.dumps(result, ensure_ascii=False, indent=2)
+
+    async def stream_chapter_content(self, subject: str, grade: str, unit: str,
+                                     chapter_number: int, chapter_title: str,
+                                     topics: list, full_outline: str,
+                                     use_cache: bool = True, outline_digest: str = None,
+                                     chapter_mode: str = "separate"):
+        """
+        串流生成單一章節：先逐段產出教材內容，再逐段產出練習題
+        產出 (field, delta) 事件，field 為 "content" 或 "questions"，delta 已逐段修正 LaTeX 格式
+        （可能成為公式的片段會等到結尾符號出現後才送出）；
+        最後產出 ("done", {"content": ..., "questions": ...})，內容與所有 delta 串接的結果相同
+        合併模式的回應是 JSON，無法逐段轉送，取得完整結果後一次產出內容與練習題
+        """
+        if chapter_mode == "combined":
+            combined = await self.generate_chapter_content(
+                subject, grade, unit, chapter_number, chapter_title, topics, full_outline,
+                use_cache=use_cache, outline_digest=outline_digest, chapter_mode=chapter_mode
+            )
+            yield "content", combined["content"]
+            yield "questions", combined["questions"]
+            yield "done", combined
+            return
+        
+        content_prompt = _build_chapter_content_prompt(
+            subject, grade, unit, chapter_number, chapter_title, topics,
+            self._outline_context(full_outline, outline_digest)
+        )
+        content_parts = []
+        async for field, delta in self._stream_normalized(
+            "content", content_prompt, use_cache=use_cache, template="chapter_content"
+        ):
+            content_parts.append(delta)
+            yield field, delta
+        chapter_content = "".join(content_parts)
+        
+        questions_prompt = _build_chapter_questions_prompt(
+            subject, grade, unit, chapter_number, chapter_title,
+            self._chapter_questions_context(chapter_content)
         )
+        questions_parts = []
+        async for field, delta in self._stream_normalized(
+            "questions", questions_prompt, use_cache=use_cache, template="chapter_questions"
+        ):
+            questions_parts.append(delta)
+            yield field, delta
+        chapter_questions = "".join(questions_parts)
         
-        return chat_completion.choices[0].message.content
+        yield "done", {
+            "content": chapter_content,
+            "questions": chapter_questions
+        }
 
+    async def _stream_normalized(self, field: str, prompt: str, use_cache: bool, template: str):
+        """
+        串流生成並逐段修正 LaTeX 格式，產出 (field, delta)（不產出空字串）
+        """
+        normalizer = LatexStreamNormalizer()
+        async for delta in self._chat_stream(prompt, max_tokens=2048, use_cache=use_cache,
+                                             template=template):
+            normalized = normalizer.feed(delta)
+            if normalized:
+                yield field, normalized
+        rest = normalizer.flush()
+        if rest:
+            yield field, rest
+
+    async def stream_content(self, subject: str, grade: str, unit: str, outline: Union[str, dict],
+                             max_concurrency: int = None, use_cache: bool = True,
+                             chapter_mode: str = "separate"):
+        """
+        串流版的階段二：各章節並行生成，將所有章節的 token 與章節邊界事件合併成單一事件流
+        產出 (event, data) 事件：
+        - ("chapter_start", {"chapter_number", "title", "index", "total"})
+        - ("token", {"chapter_number", "field", "delta"})
+        - ("chapter_end", {"chapter": 章節結果, "completed", "total"})
+        - ("done", {"content": 完整教材 JSON 字串})
+        大綱無法解析時改用備用方法串流，token 事件的 chapter_number 為 None
+        """
+        outline_data = _parse_outline(outline)
+        if outline_data is None:
+            prompt = _build_content_fallback_prompt(subject, grade, unit, outline)
+            parts = []
+            async for delta in self._chat_stream(prompt, max_tokens=4096, use_cache=use_cache,
+                                                 template="content_fallback"):
+                parts.append(delta)
+                yield "token", {"chapter_number": None, "field": "content", "delta": delta}
+            yield "done", {"content": "".join(parts)}
+            return
+        outline = _outline_text(outline)
+        
+        result = _build_content_result(outline_data)
+        chapters = outline_data['chapters']
+        total_chapters = len(chapters)
+        if max_concurrency is None:
+            max_concurrency = settings.GENERATION_MAX_CONCURRENCY
+        semaphore = asyncio.Semaphore(max(1, max_concurrency))
+        outline_digest = build_outline_digest(outline_data)
+        queue: asyncio.Queue = asyncio.Queue()
+        chapter_entries = [None] * total_chapters
+        completed = 0
+        
+        async def stream_one(index: int, chapter: dict):
+            nonlocal completed
+            chapter_number = chapter['chapter_number']
+            async with semaphore:
+                await queue.put(("chapter_start", {
+                    "chapter_number": chapter_number,
+                    "title": chapter['title'],
+                    "index": index + 1,
+                    "total": total_chapters
+                }))
+                async for field, data in self.stream_chapter_content(
+                    subject, grade, unit,
+                    chapter_number, chapter['title'], chapter['topics'],
+                    outline, use_cache=use_cache, outline_digest=outline_digest,
+                    chapter_mode=chapter_mode
+                ):
+                    if field == "done":
+                        chapter_entries[index] = build_chapter_entry(chapter, data)
+                    else:
+                        await queue.put(("token", {
+                            "chapter_number": chapter_number,
+                            "field": field,
+                            "delta": data
+                        }))
+            completed += 1
+            await queue.put(("chapter_end", {
+                "chapter": chapter_entries[index],
+                "completed": completed,
+                "total": total_chapters
+            }))
+        
+        async def run_all():
+            tasks = [
+                asyncio.create_task(stream_one(index, chapter))
+                for index, chapter in enumerate(chapters)
+            ]
+            try:
+                await asyncio.gather(*tasks)
+            except BaseException:
+                for task in tasks:
+                    task.cancel()
+                raise
+            finally:
+                # 以 None 標記所有章節結束（包含失敗時）
+                await queue.put(None)
+        
+        runner = asyncio.create_task(run_all())
+        try:
+            while True:
+                item = await queue.get()
+                if item is None:
+                    break
+                yield item
+            # 若有章節失敗，於此拋出例外
+            await runner
+        finally:
+            # 客戶端中斷連線或發生錯誤時，停止尚未完成的章節
+            if not runner.done():
+                runner.cancel()
+        
+        result["chapters"] = chapter_entries
+        yield "done", {"content": json.dumps(result, ensure_ascii=False, indent=2)}
+
+    async def stream_unit(self, subject: str, grade: str, unit: str, max_concurrency: int = None,
+                          use_cache: bool = True, chapter_mode: str = "separate"):
+        """
+        一次生成整個單元（大綱與各章節）：以串流模式生成大綱並增量解析，
+        chapters 中的章節物件一完整就開始生成該章，不等大綱結束，
+        單元總時間由「大綱 + 最慢的章節」縮短為約 max(大綱, 最慢的章節)
+        提前開始的章節以當時已收到的大綱（單元標題與已完成的章節）建立摘要；
+        大綱結束後以完整驗證（本機修復、重新要求修正）的結果為準，
+        章節定義與提前生成時不同的章節會取消並依完整大綱重新生成
+        產出 (event, data) 事件：
+        - ("outline_chapter", {"chapter": 章節定義})：章節已在大綱中完成並開始生成
+        - ("outline", {"outline": 驗證後的大綱 JSON 字串, "outline_data": dict})
+        - ("chapter_end", {"chapter": 章節結果, "completed", "total"})：大綱完成前 total 為 None
+        - ("done", {"content": 完整教材 JSON 字串})
+        任一章節失敗時取消其餘章節並拋出例外（提前開始、驗證後被取代的章節失敗不影響）
+        """
+        if max_concurrency is None:
+            max_concurrency = settings.GENERATION_MAX_CONCURRENCY
+        semaphore = asyncio.Semaphore(max(1, max_concurrency))
+        # 完成（或取消、失敗）的章節任務依完成順序放入佇列
+        finished: asyncio.Queue = asyncio.Queue()
+        # chapter_number -> (章節定義, 目前的任務)；task -> chapter_number（包含已被取代的任務）
+        running = {}
+        task_chapters = {}
+        # 大綱完成前失敗的任務：驗證後章節沒有被取代才拋出
+        early_failures = {}
+        entries = {}
+        total = None
+
+        async def generate_one(chapter: dict, outline_data: dict) -> dict:
+            async with semaphore:
+                print(f"正在生成第 {chapter['chapter_number']} 章：{chapter['title']}...")
+                chapter_data = await self.generate_chapter_content(
+                    subject, grade, unit,
+                    chapter['chapter_number'], chapter['title'], chapter['topics'],
+                    _outline_text(outline_data), use_cache=use_cache,
+                    outline_digest=build_outline_digest(outline_data),
+                    chapter_mode=chapter_mode
+                )
+            return build_chapter_entry(chapter, chapter_data)
+
+        def dispatch(chapter: dict, outline_data: dict):
+            task = asyncio.create_task(generate_one(chapter, outline_data))
+            task.add_done_callback(finished.put_nowait)
+            running[chapter['chapter_number']] = (chapter, task)
+            task_chapters[task] = chapter['chapter_number']
+
+        def drain(task: asyncio.Task):
+            """
+            處理一個結束的任務，返回 chapter_end 事件；已被取代或取消的任務返回 None
+            只有目前的任務失敗才拋出例外（已被取代的任務的例外忽略）；
+            大綱完成前失敗的任務先保留，驗證後章節仍使用該任務時才拋出
+            """
+            number = task_chapters.pop(task, None)
+            current = running.get(number)
+            if task.cancelled():
+                return None
+            error = task.exception()
+            if current is None or current[1] is not task:
+                return None
+            if error is not None:
+                if total is None:
+                    early_failures[number] = task
+                    return None
+                raise error
+            entry = task.result()
+            entries[number] = entry
+            return "chapter_end", {"chapter": entry, "completed": len(entries), "total": total}
+
+        try:
+            prompt = _build_outline_prompt(subject, grade, unit)
+            parser = OutlineStreamParser()
+            partial = {"title": unit, "objectives": [], "chapters": []}
+            async for delta in self._chat_stream(prompt, max_tokens=4096, use_cache=use_cache,
+                                                 template="outline", json_mode=True):
+                for parsed in parser.feed(delta):
+                    chapter = parsed.model_dump()
+                    if chapter['chapter_number'] in running:
+                        continue
+                    partial = {
+                        "title": parser.header.get("title") or unit,
+                        "objectives": [],
+                        "chapters": partial["chapters"] + [chapter],
+                    }
+                    dispatch(chapter, partial)
+                    yield "outline_chapter", {"chapter": chapter}
+                # 大綱串流期間完成的章節即時送出
+                while not finished.empty():
+                    event = drain(finished.get_nowait())
+                    if event is not None:
+                        yield event
+
+            outline = await self._validated_outline(subject, grade, unit, parser.text, use_cache)
+            outline_data = outline.model_dump()
+            numbers = {chapter['chapter_number'] for chapter in outline_data['chapters']}
+            for number in list(running):
+                if number not in numbers:
+                    running.pop(number)[1].cancel()
+                    entries.pop(number, None)
+            for chapter in outline_data['chapters']:
+                current = running.get(chapter['chapter_number'])
+                if current is not None and current[0] == chapter:
+                    continue
+                if current is not None:
+                    current[1].cancel()
+                    entries.pop(chapter['chapter_number'], None)
+                dispatch(chapter, outline_data)
+            # 提前開始且章節定義沒有改變的章節若已失敗，整個單元失敗
+            for number, task in early_failures.items():
+                current = running.get(number)
+                if current is not None and current[1] is task:
+                    raise task.exception()
+            total = len(outline_data['chapters'])
+            yield "outline", {"outline": dump_outline(outline), "outline_data": outline_data}
+
+            while len(entries) < total:
+                event = drain(await finished.get())
+                if event is not None:
+                    yield event
+        finally:
+            # 客戶端中斷連線或章節失敗時，停止尚未完成的章節
+            for _, task in running.values():
+                task.cancel()
+
+        result = _build_content_result(outline_data)
+        result["chapters"] = [entries[chapter['chapter_number']] for chapter in outline_data['chapters']]
+        print(f"所有章節生成完成！")
+        yield "done", {"content": json.dumps(result, ensure_ascii=False, indent=2)}
+
+    async def _generate_content_fallback(self, subject: str, grade: str, unit: str, outline: str,
+                                         use_cache: bool = True) -> str:
+        """
+        備用方法：如果 JSON 解析失敗，使用一次性生成方法
+        """
+        prompt = _build_content_fallback_prompt(subject, grade, unit, outline)
+        return await self._chat(prompt, max_tokens=4096, use_cache=use_cache,
+                                template="content_fallback")
+
+    async def generate_questions(self, subject: str, grade: str, unit: str, content: str,
+                                 use_cache: bool = True) -> str:
+        """
+        階段三：根據教材內容生成練習題
+        教材先壓縮為各章節重點（不含已生成的章節練習題）再帶入提示詞
+        """
+        prompt = _build_questions_prompt(subject, grade, unit, self._unit_questions_context(content))
+        return await self._chat(prompt, max_tokens=4096, use_cache=use_cache,
+                                template="unit_questions")
@@ -0,0 +1,111 @@
+import gzip
+
+from starlette.datastructures import Headers, MutableHeaders
+
+try:
+    import brotli
+except ImportError:  # 選用套件：未安裝時只使用 gzip
+    brotli = None
+
+# 值得壓縮的回應類型（圖片等已壓縮的格式不再壓縮）
+_COMPRESSIBLE_TYPES = ("application/json", "text/", "application/x-ndjson", "application/javascript")
+
+
+def _accepted_encodings(accept_encoding: str) -> dict:
+    """
+    解析 Accept-Encoding，返回 {編碼: q 值}（q=0 表示不接受）
+    """
+    encodings = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        name = name.strip().lower()
+        if not name:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        encodings[name] = q
+    return encodings
+
+
+def choose_encoding(accept_encoding: str):
+    """
+    依客戶端接受的編碼選擇 br（有安裝 brotli 時）或 gzip，都不接受時返回 None
+    """
+    accepted = _accepted_encodings(accept_encoding)
+    candidates = (["br"] if brotli is not None else []) + ["gzip"]
+    best, best_q = None, 0.0
+    for name in candidates:
+        q = accepted.get(name, accepted.get("*", 0.0))
+        if q > best_q:
+            best, best_q = name, q
+    return best
+
+
+class CompressionMiddleware:
+    """
+    回應壓縮（br / gzip）：只壓縮一次送出完整內容、超過 minimum_size 的文字回應
+    Starlette 的 GZipMiddleware 已可處理 gzip，但它也會壓縮分段送出的串流回應（SSE 事件被壓縮器緩衝而延遲送達）、
+    不支援 br，也不處理 ETag，因此另外實作：
+    - 串流回應（SSE、NDJSON 報告）分段送出時不壓縮
+    - 可壓縮類型的回應與 304 一律帶 Vary: Accept-Encoding（包含因太小而未壓縮的回應），
+      快取才不會把某種編碼的回應給不接受該編碼的客戶端
+    - 客戶端接受壓縮時，強 ETag 一律改為弱 ETag（同一 ETag 不可對應不同的位元組）；
+      不論實際是否壓縮都相同，因此 200 與之後的 304 帶相同的 ETag
+    """
+
+    def __init__(self, app, minimum_size: int = 1024, gzip_level: int = 6, brotli_quality: int = 4):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = choose_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        start_message = None
+
+        async def send_compressed(message):
+            nonlocal start_message
+            if message["type"] == "http.response.start":
+                # 等到第一段內容才決定是否壓縮
+                start_message = message
+                return
+            if message["type"] != "http.response.body" or start_message is None:
+                await send(message)
+                return
+
+            start, start_message = start_message, None
+            body = message.get("body", b"")
+            headers = MutableHeaders(raw=start["headers"])
+            negotiated = "content-encoding" not in headers and (
+                start["status"] == 304 or headers.get("content-type", "").startswith(_COMPRESSIBLE_TYPES)
+            )
+            if negotiated:
+                headers.add_vary_header("Accept-Encoding")
+                etag = headers.get("etag")
+                if encoding is not None and etag is not None and not etag.startswith("W/"):
+                    # 壓縮後的位元組與原始回應不同，強 ETag 改為弱 ETag（If-Match 比對時忽略 W/ 前綴）
+                    headers["ETag"] = "W/" + etag
+            if (encoding is None or not negotiated or start["status"] in (204, 304)
+                    or message.get("more_body", False) or len(body) < self.minimum_size):
+                await send(start)
+                await send(message)
+                return
+
+            if encoding == "br":
+                body = brotli.compress(body, quality=self.brotli_quality)
+            else:
+                body = gzip.compress(body, compresslevel=self.gzip_level, mtime=0)
+            headers["Content-Encoding"] = encoding
+            headers["Content-Length"] = str(len(body))
+            await send(start)
+            await send({"type": "http.response.body", "body": body})
+
+        await self.app(scope, receive, send_compressed)
@@ -0,0 +1,151 @@
+import asyncio
+from typing import Awaitable, Callable, Optional
+
+from sqlalchemy import select
+from sqlalchemy.orm import undefer
+
+from config import settings
+from database import AsyncSessionLocal
+from models import Generation, GenerationJob
+from chapter_store import save_content, prepare_chapters, chapter_writer
+from prompt_compaction import build_outline_digest
+from groq_service import build_chapter_entry
+from lease_worker import LeaseWorker
+
+
+async def submit_content_job(db, generation: Generation, outline: str, outline_data: Optional[dict],
+                             use_cache: bool = True, chapter_mode: str = "separate") -> GenerationJob:
+    """
+    建立教材生成工作，並與 /api/generate-content 相同依大綱建立教材骨架（所有章節為 pending）
+    章節內容由 worker 逐章寫入 chapters 表，工作本身只記錄租約與狀態；
+    outline_data 為 None（大綱無法解析）時不建立章節，由 worker 改用備用方法一次生成
+    """
+    if outline_data is not None:
+        await prepare_chapters(db, generation, outline_data, reset=True)
+    job = GenerationJob(
+        generation_id=generation.id,
+        outline=outline,
+        use_cache=use_cache,
+        chapter_mode=chapter_mode,
+        status="queued",
+    )
+    db.add(job)
+    await db.commit()
+    return job
+
+
+async def active_job(db, generation_id: int) -> Optional[GenerationJob]:
+    """
+    教材尚未結束的背景工作（queued / running）；worker 中斷的工作租約到期後會被接手，同樣視為進行中
+    """
+    return (await db.execute(
+        select(GenerationJob)
+        .where(GenerationJob.generation_id == generation_id,
+               GenerationJob.status.in_(("queued", "running")))
+        .limit(1)
+    )).scalar()
+
+
+class JobRunner(LeaseWorker):
+    """
+    背景工作執行器：在應用程式啟動時建立數個 worker，從資料庫領取待處理的工作（領取與租約見 LeaseWorker）
+    - 章節結果與 /api/continue-content 共用 chapters 表：重新領取時只生成尚未完成的章節，
+      已完成的章節（包含由其他端點完成的）直接沿用，生成期間 /api/history/{id} 即可讀取已完成的章節
+    """
+
+    model = GenerationJob
+    pending_status = "queued"
+    order_by = "created_at"
+    label = "背景工作"
+
+    def __init__(self, service, on_progress: Optional[Callable[..., Awaitable]] = None,
+                 num_workers: int = None, poll_interval: float = None,
+                 lease_seconds: int = None):
+        super().__init__(service, on_progress, num_workers or settings.JOB_WORKERS,
+                         poll_interval, lease_seconds)
+
+    async def _run(self, job_id: int):
+        generation_id, completed, total = None, 0, 0
+        try:
+            async with AsyncSessionLocal() as db:
+                job = await db.get(GenerationJob, job_id)
+                generation = await db.get(
+                    Generation, job.generation_id, options=[undefer(Generation.outline_data)]
+                )
+                if generation is None:
+                    raise RuntimeError("找不到對應的生成記錄")
+                generation_id = generation.id
+                # 提交時已驗證的大綱與結構寫入教材（見 prepare_chapters）；工作的大綱無法解析時兩者不同
+                outline_data = generation.outline_data if generation.outline == job.outline else None
+                unfinished = []
+                if outline_data is not None:
+                    # 中斷或失敗後重新領取：已完成的章節保留，其餘（pending / failed）重新生成
+                    unfinished = await prepare_chapters(db, generation, outline_data)
+                await db.commit()
+
+            subject, grade, unit = generation.subject, generation.grade, generation.unit
+
+            if outline_data is None:
+                # 大綱不是有效的 JSON：使用備用方法一次生成
+                content = await self.service._generate_content_fallback(
+                    subject, grade, unit, job.outline, job.use_cache
+                )
+                await self._store_content(job, content)
+                await self._finish(job_id, "completed")
+                return
+
+            outline_chapters = {c["chapter_number"]: c for c in outline_data["chapters"]}
+            outline_digest = build_outline_digest(outline_data)
+            total = len(outline_chapters)
+            completed = total - len(unfinished)
+            await self._report(job.generation_id, completed, total, "processing")
+
+            semaphore = asyncio.Semaphore(max(1, settings.GENERATION_MAX_CONCURRENCY))
+            write_chapter = chapter_writer(job.generation_id)
+
+            async def run_chapter(outline_chapter: dict) -> bool:
+                nonlocal completed
+                async with semaphore:
+                    try:
+                        result = await self.service.generate_chapter_content(
+                            subject, grade, unit,
+                            outline_chapter["chapter_number"],
+                            outline_chapter["title"],
+                            outline_chapter["topics"],
+                            job.outline,
+                            use_cache=job.use_cache,
+                            outline_digest=outline_digest,
+                            chapter_mode=job.chapter_mode,
+                        )
+                    except Exception as e:
+                        await write_chapter(outline_chapter, error=e)
+                        return False
+                    await write_chapter(build_chapter_entry(outline_chapter, result))
+                completed += 1
+                await self._report(job.generation_id, completed, total, "processing")
+                return True
+
+            # 單一章節失敗不取消其他章節，失敗的章節可重新執行工作續傳
+            results = await asyncio.gather(*(
+                run_chapter(outline_chapters[number]) for number in unfinished
+            ))
+
+            if not all(results):
+                failed = len(results) - sum(results)
+                if await self._finish(job_id, "failed", f"{failed} 個章節生成失敗，可重新執行以續傳"):
+                    await self._report(job.generation_id, completed, total, "error")
+                return
+
+            if await self._finish(job_id, "completed"):
+                await self._report(job.generation_id, completed, total, "completed")
+        except Exception:
+            # 工作本身失敗（由 LeaseWorker 標記為 failed）：進度同樣回報錯誤，等待中的串流才會結束
+            if generation_id is not None:
+                await self._report(generation_id, completed, total, "error")
+            raise
+
+    async def _store_content(self, job: GenerationJob, content: str):
+        async with AsyncSessionLocal() as db:
+            generation = await db.get(Generation, job.generation_id)
+            await save_content(db, generation, content)
+            await db.commit()
@@ -0,0 +1,179 @@
+import re
+from typing import Tuple
+
+# 需要處理的起始符號：\[、\( 或單獨的 [
+_TRIGGER = re.compile(r"\\[\[(]|\[")
+# [ 之後的下一個方括號
+_BRACKET = re.compile(r"[\[\]]")
+# 內容不含方括號且包含 LaTeX 指令的 [ ... ]：前瞻與內容都只比對到最近的方括號，失敗時只回溯一段，整體為線性時間
+_BRACKET_FORMULA = re.compile(r"\[(?=[^\[\]]*\\[a-zA-Z])([^\[\]]*)\]")
+# LaTeX 指令（反斜線後接英文字母），用來判斷 [ ... ] 是否為數學公式
+_COMMAND = re.compile(r"\\[a-zA-Z]")
+_NON_SPACE = re.compile(r"\S")
+
+# 串流時為等待結尾符號最多保留的字元數，超過即將開頭的符號視為一般文字
+MAX_PENDING_CHARS = 4096
+
+
+def needs_normalization(text: str) -> bool:
+    """
+    快速判斷：不含 [ 與 \\( 的文字（包含 \\[）不需要處理
+    """
+    return "[" in text or "\\(" in text
+
+
+def _skip_space(text: str, start: int) -> int:
+    match = _NON_SPACE.search(text, start)
+    return match.start() if match else len(text)
+
+
+def _scan(text: str, final: bool) -> Tuple[str, int]:
+    """
+    由左至右掃描一次，將公式改為 $ 格式：
+    - \\[ ... \\]（可跨行）→ $$ ... $$
+    - \\( ... \\)（內容不跨行）→ $ ... $
+    - [ ... ]（內容不含方括號與 \\(、且包含 LaTeX 指令）→ $ ... $
+    公式內容去除前後空白。每個起始符號只往後找最近的結尾，整體為線性時間，不會回溯
+    公式內的符號不再轉換（\\( [\\alpha] \\) → $[\\alpha]$）；含 \\( 的方括號保留為一般文字，只轉換內層
+    （[\\( \\text{m} \\)] → [$\\text{m}$]）。舊版依序執行三次 re.sub，會把已轉換的公式再包一層
+    （→ $$\\text{m}$$），對照見 benchmarks/latex_benchmark.py 的 LEGACY_DIFFERENCES
+
+    final 為 False 時（串流）遇到結尾可能還沒收到的符號即停止，
+    返回 (已處理的文字, 停止位置)，停止位置之後的文字需等待更多輸入
+    """
+    n = len(text)
+    out = []
+    pos = i = 0
+    # 已確定之後沒有結尾的符號，避免對每個起始符號重複搜尋到文字結尾
+    no_display_close = no_bracket_close = False
+    inline_missing_until = -1
+
+    while True:
+        match = _TRIGGER.search(text, i)
+        if match is None:
+            break
+        j = match.start()
+        token = match.group()
+
+        if token == "\\[":
+            start = _skip_space(text, j + 2)
+            end = -1 if no_display_close else text.find("\\]", start)
+            if end == -1:
+                if not final:
+                    return "".join(out) + text[pos:j], j
+                no_display_close = True
+                i = j + 2
+            elif end == start:
+                i = j + 2
+            else:
+                out.append(text[pos:j])
+                out.append("$$" + text[start:end].rstrip() + "$$")
+                pos = i = end + 2
+
+        elif token == "\\(":
+            start = _skip_space(text, j + 2)
+            if start < inline_missing_until:
+                # 同一行先前的 \( 已確定找不到結尾
+                i = j + 2
+                continue
+            line_end = text.find("\n", start)
+            if line_end == -1:
+                if not final and text.find("\\)", start) == -1:
+                    return "".join(out) + text[pos:j], j
+                line_end = n
+            end = text.find("\\)", start, line_end)
+            if end == -1 and line_end < n:
+                # 公式之後只隔空白行就結尾，例如 "\( x \n \)"
+                after = _skip_space(text, line_end)
+                if not final and (after == n or (after == n - 1 and text[after] == "\\")):
+                    return "".join(out) + text[pos:j], j
+                if text.startswith("\\)", after):
+                    end = after
+            if end == -1:
+                inline_missing_until = line_end
+                i = j + 2
+            elif end == start:
+                i = j + 2
+            else:
+                out.append(text[pos:j])
+                out.append("$" + text[start:end].rstrip() + "$")
+                pos = i = end + 2
+
+        else:
+            if no_bracket_close:
+                i = j + 1
+                continue
+            close = _BRACKET.search(text, j + 1)
+            if close is None:
+                if not final:
+                    return "".join(out) + text[pos:j], j
+                no_bracket_close = True
+                i = j + 1
+                continue
+            end = close.start()
+            inner = text[j + 1:end]
+            # 內容已有 \( \) 的方括號為一般文字（例如單位 [\( \text{m} \)] 或區間），由內層的公式符號轉換
+            if text[end] == "]" and _COMMAND.search(inner) and "\\(" not in inner:
+                out.append(text[pos:j])
+                out.append("$" + inner.strip() + "$")
+                pos = i = end + 1
+            else:
+                i = j + 1
+
+    # 串流時結尾的反斜線可能是 \[ 或 \( 的開頭
+    stop = n - 1 if not final and text.endswith("\\") and pos < n else n
+    out.append(text[pos:stop])
+    return "".join(out), stop
+
+
+def _bracket_formula(match) -> str:
+    return "$" + match.group(1).strip() + "$"
+
+
+def normalize_latex(text: str) -> str:
+    """
+    修正 LaTeX 公式格式：將 [ ] 與 \\( \\) 改為 $ $，\\[ \\] 改為 $$ $$
+    """
+    if not text or not needs_normalization(text):
+        return text
+    if "\\(" not in text and "\\[" not in text:
+        # 只有方括號（最常見，例如 Markdown 連結與陣列）：以單一預先編譯的正規表示式處理
+        return _BRACKET_FORMULA.sub(_bracket_formula, text)
+    return _scan(text, final=True)[0]
+
+
+class LatexStreamNormalizer:
+    """
+    串流版的 normalize_latex：逐段輸入 token，輸出已可確定的部分
+    可能成為公式的片段會暫時保留，等收到結尾符號（或 flush）後再輸出；
+    所有輸出串接後與對整段文字呼叫 normalize_latex 的結果相同
+    （公式長度超過 max_pending 時例外，此時起始符號視為一般文字）
+    """
+
+    def __init__(self, max_pending: int = MAX_PENDING_CHARS):
+        self.max_pending = max_pending
+        self._pending = ""
+
+    def feed(self, chunk: str) -> str:
+        text = self._pending + chunk
+        if not needs_normalization(text) and not text.endswith("\\"):
+            self._pending = ""
+            return text
+
+        emitted = []
+        while True:
+            out, stop = _scan(text, final=False)
+            emitted.append(out)
+            text = text[stop:]
+            if len(text) <= self.max_pending:
+                break
+            # 等待結尾過久：開頭的起始符號視為一般文字
+            skip = 2 if text.startswith("\\") else 1
+            emitted.append(text[:skip])
+            text = text[skip:]
+        self._pending = text
+        return "".join(emitted)
+
+    def flush(self) -> str:
+        text, self._pending = self._pending, ""
+        return normalize_latex(text)
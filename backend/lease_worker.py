@@ -0,0 +1,173 @@
+import abc
+import asyncio
+import os
+import uuid
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Optional
+
+from sqlalchemy import select, update, or_, and_
+
+from config import settings
+from database import AsyncSessionLocal
+
+
+class LeaseWorker(abc.ABC):
+    """
+    以資料庫租約領取工作的背景執行器（JobRunner 與 BatchRunner 共用）
+    - 以條件式 UPDATE 領取，多個 uvicorn worker 同時執行時也不會重複領取
+    - 執行中定期更新心跳，worker 中斷後在租約到期時被重新領取
+    - 結束時只更新仍由自己持有的租約，租約已被接手時不覆寫新持有者的狀態
+    子類別設定 model（需有 status / worker_id / heartbeat_at / attempts 欄位）與待處理狀態，並實作 _run
+    """
+
+    model = None
+    # 可領取的待處理狀態；應用程式關閉時執行中的項目也放回此狀態
+    pending_status = "pending"
+    # 領取順序的欄位名稱
+    order_by = "id"
+    # 記錄訊息使用的名稱
+    label = "工作"
+
+    def __init__(self, service, on_progress: Optional[Callable[..., Awaitable]] = None,
+                 num_workers: int = 1, poll_interval: float = None,
+                 lease_seconds: int = None):
+        self.service = service
+        self.on_progress = on_progress
+        self.num_workers = num_workers
+        self.poll_interval = poll_interval or settings.JOB_POLL_INTERVAL
+        self.lease_seconds = lease_seconds or settings.JOB_LEASE_SECONDS
+        self.worker_id = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._wakeup = asyncio.Event()
+        self._tasks = []
+
+    def start(self):
+        self._tasks = [
+            asyncio.create_task(self._worker_loop())
+            for _ in range(self.num_workers)
+        ]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def notify(self):
+        """
+        有新項目提交時喚醒等待中的 worker
+        """
+        self._wakeup.set()
+
+    @abc.abstractmethod
+    async def _run(self, item_id: int):
+        """
+        處理一個已領取的項目；成功時自行呼叫 _finish，拋出例外時標記為 failed
+        """
+
+    async def _after_finish(self, db, item_id: int):
+        """
+        結束項目後、同一個交易提交前執行（例如更新所屬批次的狀態）
+        """
+
+    async def _worker_loop(self):
+        while True:
+            try:
+                item_id = await self._claim()
+            except Exception as e:
+                print(f"領取{self.label}失敗: {e}")
+                item_id = None
+
+            if item_id is None:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+                continue
+
+            heartbeat = asyncio.create_task(self._heartbeat(item_id))
+            try:
+                await self._run(item_id)
+            except asyncio.CancelledError:
+                # 應用程式關閉：放回待處理，重新啟動後從最後完成的部分繼續
+                await asyncio.shield(self._finish(item_id, self.pending_status))
+                raise
+            except Exception as e:
+                await self._finish(item_id, "failed", str(e))
+            finally:
+                heartbeat.cancel()
+
+    def _claimable(self, now: datetime):
+        model = self.model
+        stale_before = now - timedelta(seconds=self.lease_seconds)
+        return or_(
+            model.status == self.pending_status,
+            and_(
+                model.status == "running",
+                or_(model.heartbeat_at.is_(None), model.heartbeat_at < stale_before),
+            ),
+        )
+
+    async def _claim(self) -> Optional[int]:
+        model = self.model
+        now = datetime.utcnow()
+        async with AsyncSessionLocal() as db:
+            candidate = (await db.execute(
+                select(model.id)
+                .where(self._claimable(now))
+                .order_by(getattr(model, self.order_by))
+                .limit(1)
+            )).scalar()
+            if candidate is None:
+                return None
+
+            # 條件式更新：只有仍可領取時才會成功，避免與其他 worker 重複領取
+            result = await db.execute(
+                update(model)
+                .where(model.id == candidate, self._claimable(now))
+                .values(
+                    status="running",
+                    worker_id=self.worker_id,
+                    heartbeat_at=now,
+                    attempts=model.attempts + 1,
+                )
+            )
+            await db.commit()
+            return candidate if result.rowcount == 1 else None
+
+    async def _heartbeat(self, item_id: int):
+        model = self.model
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            async with AsyncSessionLocal() as db:
+                await db.execute(
+                    update(model)
+                    .where(model.id == item_id, model.worker_id == self.worker_id)
+                    .values(heartbeat_at=datetime.utcnow())
+                )
+                await db.commit()
+
+    async def _finish(self, item_id: int, status: str, error: str = None) -> bool:
+        """
+        結束持有租約的項目；租約已到期並由其他 worker 接手時不覆寫其狀態，返回 False
+        """
+        model = self.model
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(
+                update(model)
+                .where(model.id == item_id,
+                       model.worker_id == self.worker_id,
+                       model.status == "running")
+                .values(status=status, error=error, heartbeat_at=None)
+            )
+            if result.rowcount != 1:
+                await db.rollback()
+                print(f"{self.label} {item_id} 的租約已由其他 worker 接手，略過狀態更新")
+                return False
+            await self._after_finish(db, item_id)
+            await db.commit()
+        return True
+
+    async def _report(self, generation_id: int, current: int, total: int, status: str):
+        if self.on_progress:
+            await self.on_progress(generation_id, current, total, status)
@@ -0,0 +1,188 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from config import settings
+
+
+class LLMCache:
+    """
+    LLM 回應快取（以內容雜湊為鍵）
+    - 記憶體層：固定容量的 LRU
+    - 磁碟層：SQLite 檔案，依 TTL 過期並限制總筆數（超過時淘汰最久未使用的項目）
+    快取鍵為 model、messages、temperature、max_tokens（及其他請求參數）的 SHA-256
+    """
+
+    # 每寫入多少筆才執行一次磁碟層淘汰，避免每次寫入都掃描資料表
+    EVICT_EVERY = 50
+
+    def __init__(self, path: str, memory_size: int = 256,
+                 ttl_seconds: int = 7 * 24 * 3600, max_disk_entries: int = 10000):
+        self.path = path
+        self.memory_size = memory_size
+        self.ttl_seconds = ttl_seconds
+        self.max_disk_entries = max_disk_entries
+
+        self._memory: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._writes_since_evict = 0
+        self.hits = {"memory": 0, "disk": 0}
+        self.misses = 0
+        self.bypassed = 0
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS llm_cache (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS ix_llm_cache_accessed_at ON llm_cache (accessed_at)"
+        )
+        self._conn.commit()
+
+    @classmethod
+    def from_settings(cls) -> "LLMCache":
+        return cls(
+            settings.LLM_CACHE_PATH,
+            memory_size=settings.LLM_CACHE_MEMORY_SIZE,
+            ttl_seconds=settings.LLM_CACHE_TTL_SECONDS,
+            max_disk_entries=settings.LLM_CACHE_MAX_ENTRIES,
+        )
+
+    @staticmethod
+    def make_key(model: str, messages: list, temperature: float, max_tokens: int, **params) -> str:
+        """
+        以請求內容計算快取鍵（相同的模型、提示詞與參數得到相同的鍵）
+        """
+        payload = json.dumps(
+            {
+                "model": model,
+                "messages": messages,
+                "temperature": temperature,
+                "max_tokens": max_tokens,
+                "params": params,
+            },
+            ensure_ascii=False,
+            sort_keys=True,
+            separators=(",", ":"),
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _is_expired(self, created_at: float, now: float) -> bool:
+        return self.ttl_seconds > 0 and now - created_at > self.ttl_seconds
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                value, created_at = entry
+                if not self._is_expired(created_at, now):
+                    self._memory.move_to_end(key)
+                    self.hits["memory"] += 1
+                    return value
+                del self._memory[key]
+
+            row = self._conn.execute(
+                "SELECT value, created_at FROM llm_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+
+            value, created_at = row
+            if self._is_expired(created_at, now):
+                self._conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                self._conn.commit()
+                self.misses += 1
+                return None
+
+            self._conn.execute(
+                "UPDATE llm_cache SET accessed_at = ? WHERE key = ?", (now, key)
+            )
+            self._conn.commit()
+            self._remember(key, value, created_at)
+            self.hits["disk"] += 1
+            return value
+
+    def set(self, key: str, value: str):
+        now = time.time()
+        with self._lock:
+            self._remember(key, value, now)
+            self._conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, value, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, value, now, now),
+            )
+            self._writes_since_evict += 1
+            if self._writes_since_evict >= self.EVICT_EVERY:
+                self._evict_disk(now)
+            self._conn.commit()
+
+    def record_bypass(self):
+        """
+        記錄一次略過快取（使用者要求重新生成）
+        """
+        with self._lock:
+            self.bypassed += 1
+
+    def _remember(self, key: str, value: str, created_at: float):
+        self._memory[key] = (value, created_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_size:
+            self._memory.popitem(last=False)
+
+    def _evict_disk(self, now: float):
+        """
+        移除過期項目，並在超過筆數上限時淘汰最久未使用的項目（呼叫端需持有鎖）
+        """
+        self._writes_since_evict = 0
+        if self.ttl_seconds > 0:
+            self._conn.execute(
+                "DELETE FROM llm_cache WHERE created_at < ?", (now - self.ttl_seconds,)
+            )
+        count = self._conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+        overflow = count - self.max_disk_entries
+        if overflow > 0:
+            self._conn.execute(
+                """
+                DELETE FROM llm_cache WHERE key IN (
+                    SELECT key FROM llm_cache ORDER BY accessed_at ASC LIMIT ?
+                )
+                """,
+                (overflow,),
+            )
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            self._conn.execute("DELETE FROM llm_cache")
+            self._conn.commit()
+
+    def stats(self) -> dict:
+        with self._lock:
+            disk_entries = self._conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+            total_hits = self.hits["memory"] + self.hits["disk"]
+            lookups = total_hits + self.misses
+            return {
+                "memory_entries": len(self._memory),
+                "disk_entries": disk_entries,
+                "memory_hits": self.hits["memory"],
+                "disk_hits": self.hits["disk"],
+                "misses": self.misses,
+                "bypassed": self.bypassed,
+                "hit_rate": round(total_hits / lookups, 4) if lookups else 0.0,
+            }
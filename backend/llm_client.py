@@ -0,0 +1,488 @@
+import asyncio
+import random
+import threading
+import time
+from collections import deque
+from email.utils import parsedate_to_datetime
+from typing import Optional
+
+from groq import APIConnectionError, APIStatusError, APITimeoutError, RateLimitError
+
+from config import settings
+
+
+class CircuitOpenError(Exception):
+    """
+    斷路器開啟中：近期連續失敗過多，暫停呼叫 LLM API 以免持續浪費時間與配額
+    """
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    粗估文字的 token 數：非 ASCII 字元（中文）約 1 字 1 token，ASCII 約 4 字元 1 token
+    """
+    if not text:
+        return 0
+    ascii_chars = len(text.encode("ascii", "ignore"))
+    return (len(text) - ascii_chars) + ascii_chars // 4 + 1
+
+
+def chunk_usage(chunk):
+    """
+    取出串流 chunk 中的 token 用量（Groq 放在最後一個 chunk 的 x_groq.usage）
+    """
+    usage = getattr(chunk, "usage", None)
+    if usage is None:
+        x_groq = getattr(chunk, "x_groq", None)
+        usage = x_groq.usage if x_groq else None
+    return usage
+
+
+class TokenBucket:
+    """
+    每分鐘補充 rate_per_minute 個單位的權杖桶
+    採預約制：取用後餘額可為負數，返回需要等待的秒數，由呼叫端自行等待（同步 / 非同步皆可使用）
+    """
+
+    def __init__(self, rate_per_minute: float):
+        self.capacity = float(rate_per_minute)
+        self.rate = self.capacity / 60.0
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, amount: float, now: float) -> float:
+        self._refill(now)
+        # 單次需求超過桶容量時以容量計，否則永遠無法取得
+        self.level -= min(amount, self.capacity)
+        return 0.0 if self.level >= 0 else -self.level / self.rate
+
+    def adjust(self, delta: float):
+        self.level = min(self.capacity, self.level + delta)
+
+
+class RateLimiter:
+    """
+    依每分鐘請求數（RPM）與每分鐘 token 數（TPM）限制 LLM 呼叫，限制值為 0 表示不限制
+    收到 429 時可暫停所有呼叫直到 Retry-After 指定的時間
+    同一程序內的所有客戶端共用（API 配額以金鑰計算）；多個 uvicorn worker 需各自設定較低的限制
+    """
+
+    def __init__(self, requests_per_minute: float = 0, tokens_per_minute: float = 0):
+        self._lock = threading.Lock()
+        self._requests = TokenBucket(requests_per_minute) if requests_per_minute > 0 else None
+        self._tokens = TokenBucket(tokens_per_minute) if tokens_per_minute > 0 else None
+        self._paused_until = 0.0
+
+    def reserve(self, tokens: int) -> float:
+        """
+        預約一次請求與 tokens 個 token，返回需要等待的秒數
+        """
+        with self._lock:
+            now = time.monotonic()
+            wait = max(0.0, self._paused_until - now)
+            if self._requests is not None:
+                wait = max(wait, self._requests.reserve(1, now))
+            if self._tokens is not None:
+                wait = max(wait, self._tokens.reserve(tokens, now))
+            return wait
+
+    def settle(self, reserved: int, actual: Optional[int]):
+        """
+        以實際用量修正預約的 token 數（預約時以提示詞估計值加上 max_tokens 計算）
+        """
+        if self._tokens is None or actual is None:
+            return
+        with self._lock:
+            self._tokens.adjust(reserved - actual)
+
+    def pause(self, seconds: float):
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    def state(self) -> dict:
+        with self._lock:
+            now = time.monotonic()
+            for bucket in (self._requests, self._tokens):
+                if bucket is not None:
+                    bucket._refill(now)
+            return {
+                "requests_available": round(self._requests.level, 1) if self._requests else None,
+                "tokens_available": round(self._tokens.level, 1) if self._tokens else None,
+                "paused_seconds": round(max(0.0, self._paused_until - now), 2),
+            }
+
+
+class CircuitBreaker:
+    """
+    斷路器：連續 failure_threshold 次失敗後開啟，reset_seconds 內的呼叫直接失敗；
+    之後進入半開狀態只放行一次試探呼叫，成功即關閉，失敗則重新開啟
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_seconds: float = 30):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._trial_in_flight = False
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._state(time.monotonic())
+
+    def _state(self, now: float) -> str:
+        if self._opened_at is None:
+            return "closed"
+        if now - self._opened_at >= self.reset_seconds:
+            return "half_open"
+        return "open"
+
+    def before_call(self) -> bool:
+        """
+        呼叫前檢查，開啟中時拋出 CircuitOpenError；返回這次呼叫是否為半開狀態的試探呼叫
+        取得試探資格的呼叫結束時（不論成功、失敗或被取消）必須呼叫 release(True)
+        """
+        with self._lock:
+            state = self._state(time.monotonic())
+            if state == "open" or (state == "half_open" and self._trial_in_flight):
+                raise CircuitOpenError("LLM API 暫時無法使用（連續失敗過多），請稍後再試")
+            if state == "half_open":
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def release(self, trial: bool):
+        """
+        釋放試探資格：試探呼叫未記錄成功或失敗就結束（例如被取消）時，讓之後的呼叫可以再次試探
+        """
+        if trial:
+            with self._lock:
+                self._trial_in_flight = False
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._trial_in_flight = False
+            if self._opened_at is not None or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+
+
+class LLMClientMetrics:
+    """
+    LLM 呼叫統計：區分排隊等待（速率限制）、重試退避等待與模型回應時間
+    （串流呼叫的模型回應時間為取得串流的時間，即首個回應前的延遲）
+    延遲分位數以最近 SAMPLE_SIZE 筆計算
+    """
+
+    SAMPLE_SIZE = 1000
+    COUNTERS = ("calls", "succeeded", "failed", "attempts", "retries", "rate_limited",
+                "timeouts", "server_errors", "connection_errors", "circuit_rejected")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = dict.fromkeys(self.COUNTERS, 0)
+        self._samples = {
+            "queue_wait": deque(maxlen=self.SAMPLE_SIZE),
+            "backoff_wait": deque(maxlen=self.SAMPLE_SIZE),
+            "model_latency": deque(maxlen=self.SAMPLE_SIZE),
+        }
+        self.in_flight = 0
+
+    def incr(self, name: str, amount: int = 1):
+        with self._lock:
+            self._counters[name] += amount
+
+    def observe(self, name: str, seconds: float):
+        with self._lock:
+            self._samples[name].append(seconds)
+
+    def track_in_flight(self, delta: int):
+        with self._lock:
+            self.in_flight += delta
+
+    @staticmethod
+    def _summary(values) -> dict:
+        if not values:
+            return {"count": 0, "mean_ms": 0.0, "p50_ms": 0.0, "p95_ms": 0.0, "max_ms": 0.0}
+        ordered = sorted(values)
+
+        def pick(percent):
+            return round(ordered[min(len(ordered) - 1, int(len(ordered) * percent / 100))] * 1000, 2)
+
+        return {
+            "count": len(ordered),
+            "mean_ms": round(sum(ordered) / len(ordered) * 1000, 2),
+            "p50_ms": pick(50),
+            "p95_ms": pick(95),
+            "max_ms": round(ordered[-1] * 1000, 2),
+        }
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                **self._counters,
+                "in_flight": self.in_flight,
+                **{name: self._summary(values) for name, values in self._samples.items()},
+            }
+
+
+def _retry_after_seconds(error: APIStatusError) -> Optional[float]:
+    """
+    解析回應中的 retry-after-ms / retry-after（秒數或 HTTP 日期）
+    """
+    headers = error.response.headers
+    value = headers.get("retry-after-ms")
+    if value:
+        try:
+            return float(value) / 1000
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+_default_limiter = None
+_default_limiter_lock = threading.Lock()
+
+
+def default_rate_limiter() -> RateLimiter:
+    """
+    程序內共用的速率限制器（依 LLM_RPM_LIMIT / LLM_TPM_LIMIT 設定建立）
+    """
+    global _default_limiter
+    with _default_limiter_lock:
+        if _default_limiter is None:
+            _default_limiter = RateLimiter(settings.LLM_RPM_LIMIT, settings.LLM_TPM_LIMIT)
+        return _default_limiter
+
+
+class LLMClient:
+    """
+    包裝 Groq 客戶端的 chat.completions.create：
+    - 呼叫前依 RPM / TPM 預約配額，超過時排隊等待
+    - 429、5xx、逾時與連線錯誤會重試：優先依 Retry-After 等待，否則以指數退避加隨機抖動
+    - 每次呼叫設定逾時；連續失敗過多時由斷路器直接拒絕呼叫
+    SDK 內建的重試應關閉（max_retries=0），避免與這裡的重試疊加
+    """
+
+    def __init__(self, client, limiter: RateLimiter = None, breaker: CircuitBreaker = None,
+                 max_retries: int = None, timeout: float = None,
+                 backoff_base: float = None, backoff_max: float = None):
+        self.client = client
+        self.limiter = limiter or default_rate_limiter()
+        self.breaker = breaker or CircuitBreaker(
+            settings.LLM_CIRCUIT_FAILURE_THRESHOLD, settings.LLM_CIRCUIT_RESET_SECONDS
+        )
+        self.max_retries = settings.LLM_MAX_RETRIES if max_retries is None else max_retries
+        self.timeout = timeout or settings.LLM_TIMEOUT_SECONDS
+        self.backoff_base = backoff_base or settings.LLM_BACKOFF_BASE_SECONDS
+        self.backoff_max = backoff_max or settings.LLM_BACKOFF_MAX_SECONDS
+        self.metrics = LLMClientMetrics()
+
+    # ===== 共用邏輯 =====
+
+    def _reserve_tokens(self, kwargs: dict) -> int:
+        prompt_tokens = sum(estimate_tokens(m.get("content") or "") for m in kwargs.get("messages", []))
+        return prompt_tokens + (kwargs.get("max_tokens") or 0)
+
+    def _handle_error(self, error: Exception, attempt: int, trial: bool = False) -> Optional[float]:
+        """
+        記錄失敗並決定是否重試：返回重試前要等待的秒數，不可重試時返回 None
+        """
+        if isinstance(error, RateLimitError):
+            # 429 表示配額用盡而非服務異常，不計入斷路器；但試探呼叫收到 429 時無法確認服務已恢復，重新開啟
+            self.metrics.incr("rate_limited")
+            if trial:
+                self.breaker.record_failure()
+            retry_after = _retry_after_seconds(error)
+            if retry_after is not None:
+                self.limiter.pause(retry_after)
+        elif isinstance(error, APITimeoutError):
+            self.metrics.incr("timeouts")
+            self.breaker.record_failure()
+            retry_after = None
+        elif isinstance(error, APIConnectionError):
+            self.metrics.incr("connection_errors")
+            self.breaker.record_failure()
+            retry_after = None
+        elif isinstance(error, APIStatusError) and error.status_code >= 500:
+            self.metrics.incr("server_errors")
+            self.breaker.record_failure()
+            retry_after = _retry_after_seconds(error)
+        else:
+            # 400 / 401 等請求本身的錯誤重試也不會成功，且代表服務仍可連線
+            self.breaker.record_success()
+            return None
+
+        if attempt >= self.max_retries:
+            return None
+        if retry_after is not None:
+            return retry_after + random.uniform(0, min(1.0, retry_after * 0.1))
+        # 完全隨機抖動（full jitter），避免多個請求同時重試
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def _check_circuit(self) -> bool:
+        try:
+            return self.breaker.before_call()
+        except CircuitOpenError:
+            self.metrics.incr("circuit_rejected")
+            self.metrics.incr("failed")
+            raise
+
+    def _record_attempt_success(self, started: float):
+        self.metrics.observe("model_latency", time.monotonic() - started)
+        self.breaker.record_success()
+        self.metrics.incr("succeeded")
+
+    def _settle(self, reserved: int, usage):
+        self.limiter.settle(reserved, getattr(usage, "total_tokens", None) if usage else None)
+
+    def _refund_failed_attempt(self, error: Exception, reserved: int):
+        # 被拒絕的請求（429、5xx 等有回應的錯誤）沒有消耗 token，退回預約；請求數仍計入 RPM
+        # 逾時與連線錯誤無法確認模型是否已處理，保留預約
+        if isinstance(error, APIStatusError):
+            self.limiter.settle(reserved, 0)
+
+    # ===== 同步呼叫 =====
+
+    def create(self, **kwargs):
+        self.metrics.incr("calls")
+        reserved = self._reserve_tokens(kwargs)
+        queue_total = 0.0
+        backoff_total = 0.0
+        attempt = 0
+        self.metrics.track_in_flight(1)
+        try:
+            while True:
+                # 每次嘗試（包含重試）都重新檢查斷路器並預約配額，重試的流量同樣受 RPM / TPM 限制
+                trial = self._check_circuit()
+                try:
+                    queue_wait = self.limiter.reserve(reserved)
+                    if queue_wait > 0:
+                        time.sleep(queue_wait)
+                    queue_total += queue_wait
+                    self.metrics.incr("attempts")
+                    started = time.monotonic()
+                    try:
+                        response = self.client.chat.completions.create(timeout=self.timeout, **kwargs)
+                    except Exception as e:
+                        self._refund_failed_attempt(e, reserved)
+                        delay = self._handle_error(e, attempt, trial)
+                        if delay is None:
+                            self.metrics.incr("failed")
+                            raise
+                    else:
+                        self._record_attempt_success(started)
+                        break
+                finally:
+                    # 試探呼叫被取消或等待重試時也要釋放試探資格
+                    self.breaker.release(trial)
+                self.metrics.incr("retries")
+                attempt += 1
+                backoff_total += delay
+                time.sleep(delay)
+        finally:
+            self.metrics.track_in_flight(-1)
+            self.metrics.observe("queue_wait", queue_total)
+            self.metrics.observe("backoff_wait", backoff_total)
+
+        if kwargs.get("stream"):
+            return self._observe_stream(response, reserved)
+        self._settle(reserved, response.usage)
+        return response
+
+    def _observe_stream(self, stream, reserved: int):
+        usage = None
+        try:
+            for chunk in stream:
+                usage = chunk_usage(chunk) or usage
+                yield chunk
+        finally:
+            self._settle(reserved, usage)
+
+    def stats(self) -> dict:
+        return {
+            **self.metrics.stats(),
+            "circuit_state": self.breaker.state,
+            "rate_limiter": self.limiter.state(),
+        }
+
+
+class AsyncLLMClient(LLMClient):
+    """
+    LLMClient 的非同步版本（包裝 AsyncGroq），等待配額與退避時不佔用事件迴圈
+    """
+
+    async def create(self, **kwargs):
+        self.metrics.incr("calls")
+        reserved = self._reserve_tokens(kwargs)
+        queue_total = 0.0
+        backoff_total = 0.0
+        attempt = 0
+        self.metrics.track_in_flight(1)
+        try:
+            while True:
+                trial = self._check_circuit()
+                try:
+                    queue_wait = self.limiter.reserve(reserved)
+                    if queue_wait > 0:
+                        await asyncio.sleep(queue_wait)
+                    queue_total += queue_wait
+                    self.metrics.incr("attempts")
+                    started = time.monotonic()
+                    try:
+                        response = await self.client.chat.completions.create(timeout=self.timeout, **kwargs)
+                    except Exception as e:
+                        self._refund_failed_attempt(e, reserved)
+                        delay = self._handle_error(e, attempt, trial)
+                        if delay is None:
+                            self.metrics.incr("failed")
+                            raise
+                    else:
+                        self._record_attempt_success(started)
+                        break
+                finally:
+                    # 包含 CancelledError 等不經過 except Exception 的情況
+                    self.breaker.release(trial)
+                self.metrics.incr("retries")
+                attempt += 1
+                backoff_total += delay
+                await asyncio.sleep(delay)
+        finally:
+            self.metrics.track_in_flight(-1)
+            self.metrics.observe("queue_wait", queue_total)
+            self.metrics.observe("backoff_wait", backoff_total)
+
+        if kwargs.get("stream"):
+            return self._observe_stream(response, reserved)
+        self._settle(reserved, response.usage)
+        return response
+
+    async def _observe_stream(self, stream, reserved: int):
+        usage = None
+        try:
+            async for chunk in stream:
+                usage = chunk_usage(chunk) or usage
+                yield chunk
+        finally:
+            self._settle(reserved, usage)
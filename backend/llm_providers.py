@@ -0,0 +1,259 @@
+import abc
+import asyncio
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import List, Optional
+
+from groq import AsyncGroq
+
+from config import settings
+from llm_client import AsyncLLMClient, chunk_usage
+
+
+@dataclass
+class ChatUsage:
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    total_tokens: int = 0
+
+
+@dataclass
+class ChatResult:
+    text: str
+    # 與 Groq 的 CompletionUsage 相同欄位（prompt_tokens / completion_tokens / total_tokens），未知時為 None
+    usage: Optional[object] = None
+
+
+class LLMProvider(abc.ABC):
+    """
+    LLM 供應商介面：輸入 Chat 格式的 messages，返回模型生成的文字
+    提示詞與輸出格式（大綱 JSON、教材、練習題）由 AsyncGroqService 統一處理，
+    供應商只負責呼叫模型，因此各供應商的輸出契約相同
+    """
+
+    name = "provider"
+    model = ""
+
+    @abc.abstractmethod
+    async def complete(self, messages: list, max_tokens: int, temperature: float = 0.7,
+                       json_mode: bool = False) -> ChatResult:
+        """
+        一次生成完整回應
+        """
+
+    @abc.abstractmethod
+    async def stream(self, messages: list, max_tokens: int, temperature: float = 0.7,
+                     json_mode: bool = False):
+        """
+        串流生成（async generator）：產出 (delta, usage)，usage 只在最後一項提供（其餘為 None）
+        """
+
+    def stats(self) -> dict:
+        return {}
+
+
+class GroqProvider(LLMProvider):
+    """
+    Groq Chat Completions（經由 AsyncLLMClient 處理速率限制、重試與斷路器）
+    """
+
+    name = "groq"
+
+    def __init__(self, model: str = "openai/gpt-oss-120b", client: AsyncGroq = None):
+        self.model = model
+        # 重試、逾時與速率限制由 AsyncLLMClient 處理，關閉 SDK 內建的重試
+        self.client = client or AsyncGroq(
+            api_key=settings.GROQ_API_KEY, base_url=settings.GROQ_BASE_URL or None, max_retries=0
+        )
+        self.llm = AsyncLLMClient(self.client)
+
+    def _params(self, messages: list, max_tokens: int, temperature: float, json_mode: bool) -> dict:
+        params = {
+            "messages": messages,
+            "model": self.model,
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+        }
+        if json_mode:
+            params["response_format"] = {"type": "json_object"}
+        return params
+
+    async def complete(self, messages: list, max_tokens: int, temperature: float = 0.7,
+                       json_mode: bool = False) -> ChatResult:
+        chat_completion = await self.llm.create(
+            **self._params(messages, max_tokens, temperature, json_mode)
+        )
+        return ChatResult(chat_completion.choices[0].message.content, chat_completion.usage)
+
+    async def stream(self, messages: list, max_tokens: int, temperature: float = 0.7,
+                     json_mode: bool = False):
+        stream = await self.llm.create(
+            stream=True, **self._params(messages, max_tokens, temperature, json_mode)
+        )
+        usage = None
+        async for chunk in stream:
+            usage = chunk_usage(chunk) or usage
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                yield delta, None
+        yield "", usage
+
+    def stats(self) -> dict:
+        return self.llm.stats()
+
+
+class ProviderRouter(LLMProvider):
+    """
+    多供應商路由：依最近一段時間各供應商的錯誤率與 p95 延遲排序，優先使用表現最好的供應商
+    - 錯誤率超過 max_error_rate 的供應商排到最後（所有供應商都不健康時仍依序嘗試）
+    - 樣本不足 MIN_SAMPLES 的供應商優先試用；超過 window_seconds 的樣本會被捨棄，
+      因此暫時變慢的供應商在一段時間後會重新被試用
+    - 單次嘗試超過 attempt_timeout 秒或失敗時改用下一個供應商；
+      串流只在收到第一段輸出前切換，開始輸出後失敗則直接拋出
+    """
+
+    name = "router"
+    MIN_SAMPLES = 3
+
+    def __init__(self, providers: List[LLMProvider], window: int = None,
+                 window_seconds: float = None, max_error_rate: float = None,
+                 attempt_timeout: float = None):
+        if not providers:
+            raise ValueError("至少需要一個 LLM 供應商")
+        self.providers = providers
+        # 快取鍵使用的模型名稱：同一組供應商的結果視為可互換
+        self.model = "+".join(f"{p.name}:{p.model}" for p in providers)
+        self.window_seconds = window_seconds or settings.LLM_ROUTER_WINDOW_SECONDS
+        self.max_error_rate = (
+            settings.LLM_ROUTER_MAX_ERROR_RATE if max_error_rate is None else max_error_rate
+        )
+        self.attempt_timeout = attempt_timeout or settings.LLM_ROUTER_ATTEMPT_TIMEOUT
+        size = window or settings.LLM_ROUTER_WINDOW
+        # 每個供應商最近的 (時間, 延遲秒數, 是否成功)
+        self._samples = {p.name: deque(maxlen=size) for p in providers}
+        self._selected = {p.name: 0 for p in providers}
+        self._failovers = 0
+
+    def _record(self, provider: LLMProvider, started: float, ok: bool):
+        now = time.monotonic()
+        self._samples[provider.name].append((now, now - started, ok))
+
+    def _health(self, provider: LLMProvider) -> dict:
+        cutoff = time.monotonic() - self.window_seconds
+        samples = [s for s in self._samples[provider.name] if s[0] >= cutoff]
+        latencies = sorted(latency for _, latency, ok in samples if ok)
+        errors = sum(1 for _, _, ok in samples if not ok)
+        return {
+            "samples": len(samples),
+            "error_rate": errors / len(samples) if samples else 0.0,
+            "p95": latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] if latencies else None,
+        }
+
+    def ranked(self) -> List[LLMProvider]:
+        """
+        依健康狀態排序供應商（相同時維持設定順序）
+        """
+        def key(provider):
+            health = self._health(provider)
+            if health["samples"] < self.MIN_SAMPLES:
+                return (0, 0.0)
+            unhealthy = 1 if health["error_rate"] > self.max_error_rate else 0
+            p95 = health["p95"] if health["p95"] is not None else float("inf")
+            return (unhealthy, p95)
+
+        return sorted(self.providers, key=key)
+
+    async def complete(self, messages: list, max_tokens: int, temperature: float = 0.7,
+                       json_mode: bool = False) -> ChatResult:
+        last_error = None
+        for attempt, provider in enumerate(self.ranked()):
+            if attempt:
+                self._failovers += 1
+            self._selected[provider.name] += 1
+            started = time.monotonic()
+            try:
+                result = await asyncio.wait_for(
+                    provider.complete(messages, max_tokens, temperature, json_mode),
+                    timeout=self.attempt_timeout,
+                )
+            except Exception as e:
+                self._record(provider, started, False)
+                print(f"LLM 供應商 {provider.name} 失敗: {e!r}，改用下一個供應商")
+                last_error = e
+                continue
+            self._record(provider, started, True)
+            return result
+        raise last_error
+
+    async def stream(self, messages: list, max_tokens: int, temperature: float = 0.7,
+                     json_mode: bool = False):
+        last_error = None
+        for attempt, provider in enumerate(self.ranked()):
+            if attempt:
+                self._failovers += 1
+            self._selected[provider.name] += 1
+            started = time.monotonic()
+            chunks = provider.stream(messages, max_tokens, temperature, json_mode)
+            try:
+                first = await asyncio.wait_for(chunks.__anext__(), timeout=self.attempt_timeout)
+            except StopAsyncIteration:
+                self._record(provider, started, True)
+                return
+            except Exception as e:
+                self._record(provider, started, False)
+                await chunks.aclose()
+                print(f"LLM 供應商 {provider.name} 失敗: {e!r}，改用下一個供應商")
+                last_error = e
+                continue
+
+            yield first
+            try:
+                async for item in chunks:
+                    yield item
+            except Exception:
+                self._record(provider, started, False)
+                raise
+            self._record(provider, started, True)
+            return
+        raise last_error
+
+    def stats(self) -> dict:
+        providers = {}
+        for provider in self.providers:
+            health = self._health(provider)
+            providers[provider.name] = {
+                "model": provider.model,
+                "selected": self._selected[provider.name],
+                "samples": health["samples"],
+                "error_rate": round(health["error_rate"], 3),
+                "p95_ms": round(health["p95"] * 1000, 2) if health["p95"] is not None else None,
+                "client": provider.stats(),
+            }
+        return {
+            "order": [p.name for p in self.ranked()],
+            "failovers": self._failovers,
+            "providers": providers,
+        }
+
+
+def create_provider(names: str = None) -> LLMProvider:
+    """
+    依 LLM_PROVIDERS 設定（以逗號分隔，例如 "groq,gemini"）建立供應商；多於一個時以 ProviderRouter 路由
+    """
+    names = [n.strip().lower() for n in (names or settings.LLM_PROVIDERS).split(",") if n.strip()]
+    providers = []
+    for name in names:
+        if name == "groq":
+            providers.append(GroqProvider())
+        elif name == "gemini":
+            # google-generativeai 為選用套件，只在設定使用 Gemini 時才匯入
+            from gemini_service import GeminiProvider
+            providers.append(GeminiProvider())
+        else:
+            raise ValueError(f"不支援的 LLM 供應商: {name}")
+    if len(providers) == 1:
+        return providers[0]
+    return ProviderRouter(providers)
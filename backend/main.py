@@ -1,32 +1,89 @@
-from fastapi import FastAPI, Depends, HTTPException
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Depends, HTTPException, Query, File, Form, UploadFile, Header, Response
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy.orm import Session
-from typing import List, Dict
+from http_compression import CompressionMiddleware
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select, delete, update, or_, and_
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import undefer
+from typing import Optional, Tuple
+import base64
 import json
+import time
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
 
-from database import engine, get_db, Base
-from models import Generation
+from database import engine, get_async_db, session_scope
+from models import Generation, GenerationJob, Chapter, BatchRun, BatchUnit, Question
 from schemas import (
     GenerateOutlineRequest,
+    GenerateUnitRequest,
     GenerateContentRequest,
+    ContinueContentRequest,
     GenerateQuestionsRequest,
     OutlineResponse,
     ContentResponse,
     QuestionsResponse,
     GenerationHistoryItem,
+    GenerationSummary,
+    GenerationHistoryPage,
     RegenerateChapterRequest,
-    RegenerateChapterResponse
+    RegenerateChapterResponse,
+    JobSubmitResponse,
+    JobStatusResponse,
+    ChapterMode,
+    BatchSubmitRequest,
+    BatchStatusResponse,
+    BatchUnitStatus,
+    ChapterStatus,
+    SimilarGeneration,
+    QuestionItem,
+    GenerationQuestions,
+    QuestionPage,
+    SearchHit,
+    SearchPage
 )
-from groq_service import GroqService
+from groq_service import AsyncGroqService
+from jobs import JobRunner, submit_content_job, active_job
+from batch import BatchRunner, submit_batch, resume_batch, batch_counts, iter_batch_report, parse_units
+from progress_store import create_progress_store, TERMINAL_STATUSES
+from migrations import run_migrations
+from chapter_store import (
+    split_content, save_content, load_content, upsert_chapter,
+    list_chapters, list_chapter_statuses, chapter_status, content_status, prepare_chapters,
+    parse_outline, chapter_writer, build_content_header,
+    outline_etag, content_etag, generation_etag, etag_matches
+)
+from search_index import (
+    index_outline, index_unit_questions, remove_generation, search, search_enabled, check_search_index
+)
+from outline_schema import dump_outline
+from similarity_index import SimilarityIndex, find_similar
+from question_store import replace_questions, question_to_dict, list_questions, query_questions
 from config import settings
 
-# 建立資料庫表
-Base.metadata.create_all(bind=engine)
+# 建立資料庫表並補上新增的欄位與索引（多個 worker 同時啟動時以資料庫鎖依序執行）
+if settings.MIGRATE_ON_STARTUP:
+    run_migrations(engine)
+else:
+    check_search_index(engine)
+
+# 生成進度儲存（依 PROGRESS_BACKEND 選擇記憶體或資料庫，後者可在多個 worker 間共用）
+progress_store = create_progress_store()
 
-# 用於儲存生成進度的全域字典
-generation_progress: Dict[int, Dict] = {}
+# 相似單元索引（每個 worker 各自維護，查詢時載入其他 worker 新建立的記錄）
+similarity_index = SimilarityIndex()
 
-app = FastAPI(title="智慧教材生成平台 API")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 啟動背景工作 worker，關閉時將執行中的工作放回佇列
+    job_runner.start()
+    batch_runner.start()
+    yield
+    await batch_runner.stop()
+    await job_runner.stop()
+
+app = FastAPI(title="智慧教材生成平台 API", lifespan=lifespan)
 
 # CORS 設定
 app.add_middleware(
@@ -35,102 +92,186 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # 前端需讀取 ETag 才能在之後的請求帶上 If-Match
+    expose_headers=["ETag"],
 )
 
-# 初始化 Groq 服務
-groq_service = GroqService()
+# 大型 JSON 回應（歷史記錄、教材）以 br / gzip 壓縮
+if settings.RESPONSE_COMPRESSION_ENABLED:
+    app.add_middleware(CompressionMiddleware, minimum_size=settings.RESPONSE_COMPRESSION_MIN_BYTES)
+
+# 初始化 Groq 服務（非同步版本，等待模型時不佔用執行緒）
+groq_service = AsyncGroqService()
+
+# 背景教材生成工作執行器
+job_runner = JobRunner(groq_service, on_progress=progress_store.set)
+
+# 批次單元生成執行器
+batch_runner = BatchRunner(groq_service, on_progress=progress_store.set)
 
 @app.get("/")
-def root():
+async def root():
     return {"message": "智慧教材生成平台 API", "status": "running"}
 
+async def _get_generation_or_404(generation_id: int, with_outline: bool = False) -> Generation:
+    """
+    以短交易讀取生成記錄後立即歸還連線；返回的物件已脫離 session，
+    可在之後的 LLM 呼叫期間使用而不佔用資料庫連線
+    with_outline 為 True 時一併載入結構化大綱（outline_data 預設延遲載入）
+    """
+    options = [undefer(Generation.outline_data)] if with_outline else None
+    async with session_scope() as db:
+        generation = await db.get(Generation, generation_id, options=options)
+    if not generation:
+        raise HTTPException(status_code=404, detail="找不到該記錄")
+    return generation
+
+def _resolve_outline(generation: Generation, outline: Optional[str],
+                     if_match: Optional[str]) -> Tuple[str, Optional[dict]]:
+    """
+    返回 (大綱文字, 結構化大綱)；結構化大綱為 None 表示大綱無法解析（改用備用方法）
+    請求未附大綱時使用資料庫中已驗證的大綱（不需由前端送回整份大綱，也不需重新解析）；
+    附上的大綱視為覆寫，在此驗證一次
+    帶 If-Match 時先確認資料庫中的大綱仍是客戶端讀取的版本，否則返回 412
+    generation 須以 _get_generation_or_404(..., with_outline=True) 讀取
+    """
+    if if_match is not None and not etag_matches(if_match, outline_etag(generation.outline)):
+        raise HTTPException(status_code=412, detail="大綱已被其他請求修改，請重新讀取後再試")
+    if not outline:
+        if not generation.outline:
+            raise HTTPException(status_code=400, detail="尚未生成大綱")
+        return generation.outline, generation.outline_data
+    outline_data = parse_outline(outline)
+    return (dump_outline(outline_data) if outline_data is not None else outline), outline_data
+
+async def _ensure_no_active_job(generation_id: int, db: AsyncSession = None):
+    """
+    背景工作與其他生成端點共用 chapters 表；同一教材有進行中的工作時返回 409，避免重複生成同一章節
+    """
+    if db is None:
+        async with session_scope() as db:
+            job = await active_job(db, generation_id)
+    else:
+        job = await active_job(db, generation_id)
+    if job is not None:
+        raise HTTPException(
+            status_code=409,
+            detail=f"背景工作 {job.id} 正在生成此教材（{job.status}），請等待完成或查詢 /api/jobs/{job.id}"
+        )
+
+async def _set_content_etag(response: Response, generation_id: int):
+    async with session_scope() as db:
+        generation = await db.get(Generation, generation_id)
+        etag = await content_etag(db, generation) if generation else None
+    if etag is not None:
+        response.headers["ETag"] = etag
+
 @app.post("/api/generate-outline", response_model=OutlineResponse)
-def generate_outline(
-    request: GenerateOutlineRequest,
-    db: Session = Depends(get_db)
-):
+async def generate_outline(request: GenerateOutlineRequest, response: Response):
     """
     階段一：生成教學大綱
+    先查詢相似的既有單元（例如「速率與速度」與「速度和速率」）：reuse_similar 為 True 且
+    有相似度達 SIMILARITY_REUSE_THRESHOLD、教材已完成的記錄時直接沿用，否則生成新大綱並在回應中列出相似記錄
+    回應的 ETag 標頭為大綱的版本，之後的請求可只送 generation_id 並以 If-Match 確認大綱未被修改
     """
     try:
-        # 生成大綱
-        outline = groq_service.generate_outline(
+        similar = []
+        if settings.SIMILARITY_ENABLED:
+            async with session_scope() as db:
+                similar = await find_similar(
+                    similarity_index, db, request.subject, request.grade, request.unit
+                )
+        if request.reuse_similar and not request.fresh:
+            for candidate in similar:
+                if (candidate["score"] >= settings.SIMILARITY_REUSE_THRESHOLD
+                        and candidate["content_status"] == "completed"):
+                    existing = await _get_generation_or_404(candidate["generation_id"])
+                    response.headers["ETag"] = outline_etag(existing.outline)
+                    return OutlineResponse(
+                        generation_id=existing.id,
+                        outline=existing.outline,
+                        reused=True,
+                        similar=[SimilarGeneration(**item) for item in similar]
+                    )
+
+        # 生成大綱（已驗證）
+        outline_model = await groq_service.generate_outline(
             request.subject,
             request.grade,
-            request.unit
+            request.unit,
+            use_cache=not request.fresh
         )
+        outline = dump_outline(outline_model)
         
-        # 儲存到資料庫
+        # 儲存到資料庫（文字供 API 回應與 ETag 使用，結構供之後的階段直接讀取）
         generation = Generation(
             subject=request.subject,
             grade=request.grade,
             unit=request.unit,
-            outline=outline
+            outline=outline,
+            outline_data=outline_model.model_dump()
         )
-        db.add(generation)
-        db.commit()
-        db.refresh(generation)
+        async with session_scope() as db:
+            db.add(generation)
+            await db.flush()
+            await index_outline(db, generation.id, generation.unit, outline)
+        similarity_index.add(generation.id, generation.subject, generation.grade, generation.unit, outline)
         
+        response.headers["ETag"] = outline_etag(outline)
         return OutlineResponse(
             generation_id=generation.id,
-            outline=outline
+            outline=outline,
+            similar=[SimilarGeneration(**item) for item in similar]
         )
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"生成大綱失敗: {str(e)}")
 
 @app.post("/api/generate-content", response_model=ContentResponse)
-def generate_content(
-    request: GenerateContentRequest,
-    db: Session = Depends(get_db)
-):
+async def generate_content(request: GenerateContentRequest, response: Response,
+                           if_match: Optional[str] = Header(None)):
     """
     階段二：根據大綱生成詳細教材（支持進度追蹤）
+    未附 outline 時使用資料庫中的大綱；回應的 ETag 標頭為教材的版本（供 /api/generate-questions 的 If-Match 使用）
     """
     try:
         # 取得 generation 記錄
-        generation = db.query(Generation).filter(
-            Generation.id == request.generation_id
-        ).first()
+        generation = await _get_generation_or_404(request.generation_id, with_outline=True)
+        outline, outline_data = _resolve_outline(generation, request.outline, if_match)
+        await _ensure_no_active_job(request.generation_id)
         
-        if not generation:
-            raise HTTPException(status_code=404, detail="找不到該記錄")
-        
-        # 初始化進度（從0開始）
-        try:
-            outline_data = json.loads(request.outline)
-            total_chapters = len(outline_data.get('chapters', []))
-            generation_progress[request.generation_id] = {
-                "current": 0,
-                "total": total_chapters,
-                "status": "processing"
-            }
-        except:
-            total_chapters = 0
+        # 先建立教材骨架（所有章節為 pending），之後每完成一章即寫入
+        if outline_data is not None:
+            await _prepare_chapters(request.generation_id, outline_data, reset=True)
+            await progress_store.set(request.generation_id, 0, len(outline_data["chapters"]), "processing")
         
         # 生成教材內容（帶進度回調）
-        def progress_callback(current, total):
-            generation_progress[request.generation_id] = {
-                "current": current,
-                "total": total,
-                "status": "processing"
-            }
+        async def progress_callback(current, total):
+            await progress_store.set(request.generation_id, current, total, "processing")
         
-        content = groq_service.generate_content(
+        content = await groq_service.generate_content(
             generation.subject,
             generation.grade,
             generation.unit,
-            request.outline,
-            progress_callback=progress_callback
+            outline_data or outline,
+            progress_callback=progress_callback,
+            use_cache=not request.fresh,
+            chapter_mode=request.chapter_mode,
+            chapter_callback=chapter_writer(request.generation_id) if outline_data else None
         )
         
-        # 更新資料庫
-        generation.content = content
-        db.commit()
-        db.refresh(generation)
+        if outline_data is None:
+            # 備用方法生成的 Markdown 沒有章節，整份寫入
+            async with session_scope() as db:
+                generation = await db.get(Generation, request.generation_id)
+                if not generation:
+                    raise HTTPException(status_code=404, detail="找不到該記錄")
+                await save_content(db, generation, content)
         
         # 完成進度
-        if request.generation_id in generation_progress:
-            generation_progress[request.generation_id]["status"] = "completed"
+        await progress_store.update_status(request.generation_id, "completed")
+        await _set_content_etag(response, request.generation_id)
         
         return ContentResponse(
             generation_id=generation.id,
@@ -140,49 +281,305 @@ def generate_content(
         raise
     except Exception as e:
         # 錯誤時更新進度
-        if request.generation_id in generation_progress:
-            generation_progress[request.generation_id]["status"] = "error"
+        await progress_store.update_status(request.generation_id, "error")
         raise HTTPException(status_code=500, detail=f"生成教材失敗: {str(e)}")
 
+async def _prepare_chapters(generation_id: int, outline_data: dict, reset: bool) -> list:
+    async with session_scope() as db:
+        generation = await db.get(Generation, generation_id)
+        if not generation:
+            raise HTTPException(status_code=404, detail="找不到該記錄")
+        return await prepare_chapters(db, generation, outline_data, reset=reset)
+
+@app.post("/api/continue-content", response_model=ContentResponse)
+async def continue_content(request: ContinueContentRequest, response: Response,
+                           if_match: Optional[str] = Header(None)):
+    """
+    繼續生成教材：只生成尚未完成或失敗的章節，已完成的章節沿用資料庫中的內容
+    """
+    try:
+        generation = await _get_generation_or_404(request.generation_id, with_outline=True)
+        _, outline_data = _resolve_outline(generation, request.outline, if_match)
+        await _ensure_no_active_job(request.generation_id)
+        if outline_data is None:
+            raise HTTPException(status_code=400, detail="大綱不是有效的 JSON，無法繼續生成")
+        
+        unfinished = await _prepare_chapters(request.generation_id, outline_data, reset=False)
+        if unfinished:
+            total_chapters = len(outline_data["chapters"])
+            await progress_store.set(
+                request.generation_id, total_chapters - len(unfinished), total_chapters, "processing"
+            )
+            
+            async def progress_callback(current, total):
+                await progress_store.set(request.generation_id, current, total, "processing")
+            
+            await groq_service.generate_content(
+                generation.subject,
+                generation.grade,
+                generation.unit,
+                outline_data,
+                progress_callback=progress_callback,
+                use_cache=not request.fresh,
+                chapter_mode=request.chapter_mode,
+                chapter_numbers=unfinished,
+                chapter_callback=chapter_writer(request.generation_id)
+            )
+            await progress_store.update_status(request.generation_id, "completed")
+        
+        async with session_scope() as db:
+            stored = await db.get(Generation, request.generation_id)
+            content = await load_content(db, stored)
+            etag = await content_etag(db, stored)
+        if etag is not None:
+            response.headers["ETag"] = etag
+        return ContentResponse(generation_id=generation.id, content=content)
+    except HTTPException:
+        raise
+    except Exception as e:
+        await progress_store.update_status(request.generation_id, "error")
+        raise HTTPException(status_code=500, detail=f"繼續生成教材失敗: {str(e)}")
+
+def _sse_event(event: str, data: dict) -> str:
+    """
+    將事件格式化為 Server-Sent Events 訊息
+    """
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@app.post("/api/generate-content/stream")
+async def generate_content_stream(request: GenerateContentRequest,
+                                  if_match: Optional[str] = Header(None)):
+    """
+    階段二（串流版）：以 Server-Sent Events 即時推送各章節生成的 token
+    事件依序為 start → chapter_start / token / chapter_end（各章節交錯）→ done，失敗時送出 error
+    """
+    generation = await _get_generation_or_404(request.generation_id, with_outline=True)
+    subject, grade, unit = generation.subject, generation.grade, generation.unit
+    outline, outline_data = _resolve_outline(generation, request.outline, if_match)
+    await _ensure_no_active_job(request.generation_id)
+    
+    async def event_stream():
+        total_chapters = len(outline_data["chapters"]) if outline_data else 0
+        if outline_data is not None:
+            await _prepare_chapters(request.generation_id, outline_data, reset=True)
+        write_chapter = chapter_writer(request.generation_id)
+        
+        await progress_store.set(request.generation_id, 0, total_chapters, "processing")
+        yield _sse_event("start", {
+            "generation_id": request.generation_id,
+            "total": total_chapters
+        })
+        
+        try:
+            async for event, data in groq_service.stream_content(
+                subject, grade, unit, outline_data or outline,
+                use_cache=not request.fresh,
+                chapter_mode=request.chapter_mode
+            ):
+                if event == "chapter_end":
+                    # 每完成一章即寫入，中途失敗時已完成的章節不會遺失
+                    await write_chapter(data["chapter"])
+                    await progress_store.set(
+                        request.generation_id, data["completed"], data["total"], "processing"
+                    )
+                    yield _sse_event(event, data)
+                elif event == "done":
+                    if outline_data is None:
+                        # 備用方法生成的 Markdown 沒有章節，結束後整份寫入
+                        async with session_scope() as db:
+                            stored = await db.get(Generation, request.generation_id)
+                            if stored:
+                                await save_content(db, stored, data["content"])
+                    await progress_store.update_status(request.generation_id, "completed")
+                    yield _sse_event("done", {
+                        "generation_id": request.generation_id,
+                        "content": data["content"]
+                    })
+                else:
+                    yield _sse_event(event, data)
+        except Exception as e:
+            await progress_store.update_status(request.generation_id, "error")
+            yield _sse_event("error", {"detail": f"生成教材失敗: {str(e)}"})
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            # 避免反向代理緩衝串流內容
+            "X-Accel-Buffering": "no",
+        }
+    )
+
+@app.post("/api/generate-unit/stream")
+async def generate_unit_stream(request: GenerateUnitRequest):
+    """
+    一次生成整個單元（串流版）：大綱以串流模式生成，章節在大綱中一完整就開始生成，
+    不需等大綱結束、也不需由前端送回大綱
+    事件依序為 start → outline_chapter / chapter_end（交錯）→ outline → chapter_end → done，失敗時送出 error
+    大綱完成前 chapter_end 的 total 為 None
+    """
+    generation = Generation(subject=request.subject, grade=request.grade, unit=request.unit)
+    async with session_scope() as db:
+        db.add(generation)
+    generation_id = generation.id
+    
+    async def event_stream():
+        write_chapter = chapter_writer(generation_id)
+        await progress_store.set(generation_id, 0, 0, "processing")
+        yield _sse_event("start", {"generation_id": generation_id})
+        
+        try:
+            async for event, data in groq_service.stream_unit(
+                request.subject, request.grade, request.unit,
+                use_cache=not request.fresh,
+                chapter_mode=request.chapter_mode
+            ):
+                if event == "outline":
+                    # 大綱完成後寫入並建立教材骨架（已完成的章節保留）
+                    outline_data = data["outline_data"]
+                    async with session_scope() as db:
+                        stored = await db.get(Generation, generation_id)
+                        if not stored:
+                            raise HTTPException(status_code=404, detail="找不到該記錄")
+                        unfinished = await prepare_chapters(db, stored, outline_data)
+                        await index_outline(db, generation_id, request.unit, stored.outline)
+                    similarity_index.add(
+                        generation_id, request.subject, request.grade, request.unit, data["outline"]
+                    )
+                    total_chapters = len(outline_data["chapters"])
+                    await progress_store.set(
+                        generation_id, total_chapters - len(unfinished), total_chapters, "processing"
+                    )
+                    yield _sse_event("outline", {
+                        "generation_id": generation_id,
+                        "outline": data["outline"],
+                        "total": total_chapters
+                    })
+                elif event == "chapter_end":
+                    await write_chapter(data["chapter"])
+                    if data["total"] is not None:
+                        await progress_store.set(
+                            generation_id, data["completed"], data["total"], "processing"
+                        )
+                    yield _sse_event(event, data)
+                elif event == "done":
+                    await progress_store.update_status(generation_id, "completed")
+                    yield _sse_event("done", {
+                        "generation_id": generation_id,
+                        "content": data["content"]
+                    })
+                else:
+                    yield _sse_event(event, data)
+        except Exception as e:
+            await progress_store.update_status(generation_id, "error")
+            detail = e.detail if isinstance(e, HTTPException) else str(e)
+            yield _sse_event("error", {"detail": f"生成單元失敗: {detail}"})
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no",
+        }
+    )
+
 @app.get("/api/generation-progress/{generation_id}")
-def get_generation_progress(generation_id: int):
+async def get_generation_progress(
+    generation_id: int,
+    since_version: Optional[int] = None,
+    timeout: float = Query(25.0, ge=0, le=60)
+):
     """
     查詢教材生成進度
+    帶上 since_version 時為長輪詢：等到進度的 version 大於 since_version（或逾時）才返回
+    """
+    if since_version is None:
+        return await progress_store.get(generation_id)
+    return await progress_store.wait_for_update(generation_id, since_version, timeout)
+
+@app.get("/api/generation-progress/{generation_id}/events")
+async def stream_generation_progress(generation_id: int):
+    """
+    以 Server-Sent Events 推送進度更新，生成完成或失敗後結束
+    等待一次長輪詢後仍未開始（id 不存在或進度已過期），或超過 PROGRESS_STREAM_IDLE_SECONDS 沒有更新時，
+    送出最後的進度並結束，避免連線無限期送出 keep-alive
     """
-    if generation_id not in generation_progress:
-        return {"current": 0, "total": 0, "status": "not_started"}
+    async def event_stream():
+        version = -1
+        waited_not_started = False
+        last_update = time.monotonic()
+        while True:
+            progress = await progress_store.wait_for_update(generation_id, version, timeout=15)
+            if progress["status"] == "not_started":
+                # 第一次查詢立即返回，再等待一次長輪詢讓剛送出的生成請求有時間開始
+                if waited_not_started:
+                    yield _sse_event("progress", progress)
+                    break
+                waited_not_started = True
+                version = max(version, progress["version"])
+                yield ": keep-alive\n\n"
+            elif progress["version"] > version:
+                version = progress["version"]
+                last_update = time.monotonic()
+                yield _sse_event("progress", progress)
+                if progress["status"] in TERMINAL_STATUSES:
+                    break
+            elif time.monotonic() - last_update >= settings.PROGRESS_STREAM_IDLE_SECONDS:
+                yield _sse_event("timeout", progress)
+                break
+            else:
+                # 保持連線的註解行
+                yield ": keep-alive\n\n"
     
-    return generation_progress[generation_id]
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no",
+        }
+    )
 
 @app.post("/api/generate-questions", response_model=QuestionsResponse)
-def generate_questions(
-    request: GenerateQuestionsRequest,
-    db: Session = Depends(get_db)
-):
+async def generate_questions(request: GenerateQuestionsRequest,
+                             if_match: Optional[str] = Header(None)):
     """
     階段三：根據教材生成練習題
+    未附 content 時由資料庫組合教材（不需由前端送回整份教材）；
+    帶 If-Match 時先確認教材仍是客戶端取得的版本（generate-content 回應的 ETag），否則返回 412
     """
     try:
-        # 取得 generation 記錄
-        generation = db.query(Generation).filter(
-            Generation.id == request.generation_id
-        ).first()
-        
-        if not generation:
-            raise HTTPException(status_code=404, detail="找不到該記錄")
+        # 取得 generation 記錄與教材（短交易）
+        async with session_scope() as db:
+            generation = await db.get(Generation, request.generation_id)
+            if not generation:
+                raise HTTPException(status_code=404, detail="找不到該記錄")
+            if if_match is not None and not etag_matches(if_match, await content_etag(db, generation)):
+                raise HTTPException(status_code=412, detail="教材已被其他請求修改，請重新讀取後再試")
+            content = request.content or await load_content(db, generation)
+        if not content:
+            raise HTTPException(status_code=400, detail="尚未生成教材")
         
         # 生成練習題
-        questions = groq_service.generate_questions(
+        questions = await groq_service.generate_questions(
             generation.subject,
             generation.grade,
             generation.unit,
-            request.content
+            content,
+            use_cache=not request.fresh
         )
         
-        # 更新資料庫
-        generation.questions = questions
-        db.commit()
-        db.refresh(generation)
+        # 更新資料庫（短交易：練習題欄位與解析後的題目一併寫入）
+        async with session_scope() as db:
+            await db.execute(
+                update(Generation)
+                .where(Generation.id == request.generation_id)
+                .values(questions=questions, version=Generation.version + 1)
+            )
+            await replace_questions(db, request.generation_id, None, questions)
+            await index_unit_questions(db, request.generation_id, questions)
         
         return QuestionsResponse(
             generation_id=generation.id,
@@ -193,53 +590,450 @@ def generate_questions(
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"生成題目失敗: {str(e)}")
 
-@app.get("/api/history", response_model=List[GenerationHistoryItem])
-def get_history(db: Session = Depends(get_db)):
+@app.post("/api/jobs/generate-content", response_model=JobSubmitResponse, status_code=202)
+async def submit_generate_content_job(
+    request: GenerateContentRequest,
+    if_match: Optional[str] = Header(None),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    階段二（背景工作版）：立即返回工作 ID，由背景 worker 逐章節生成並寫入資料庫
+    客戶端中斷連線不影響生成，可透過 /api/jobs/{job_id} 查詢狀態與結果
+    """
+    generation = await db.get(Generation, request.generation_id, options=[undefer(Generation.outline_data)])
+    if not generation:
+        raise HTTPException(status_code=404, detail="找不到該記錄")
+    outline, outline_data = _resolve_outline(generation, request.outline, if_match)
+    await _ensure_no_active_job(request.generation_id, db)
+    
+    job = await submit_content_job(
+        db, generation, outline, outline_data,
+        use_cache=not request.fresh, chapter_mode=request.chapter_mode
+    )
+    job_runner.notify()
+    
+    return JobSubmitResponse(
+        job_id=job.id,
+        generation_id=job.generation_id,
+        status=job.status
+    )
+
+@app.get("/api/jobs/{job_id}", response_model=JobStatusResponse)
+async def get_job_status(job_id: int, db: AsyncSession = Depends(get_async_db)):
     """
-    取得所有歷史記錄
+    查詢背景工作狀態、各章節進度與錯誤；工作完成後一併返回教材內容
+    章節狀態來自教材的 chapters 表（與 /api/history/{id}、/api/continue-content 相同）
     """
-    generations = db.query(Generation).order_by(Generation.created_at.desc()).all()
-    return generations
+    job = await db.get(GenerationJob, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="找不到該工作")
+    
+    content = None
+    generation = await db.get(Generation, job.generation_id) if job.status == "completed" else None
+    if generation is not None:
+        chapters = await list_chapters(db, job.generation_id)
+        content = await load_content(db, generation, chapters)
+    else:
+        chapters = await list_chapter_statuses(db, job.generation_id)
+    
+    return JobStatusResponse(
+        job_id=job.id,
+        generation_id=job.generation_id,
+        status=job.status,
+        error=job.error,
+        total=len(chapters),
+        completed=sum(1 for c in chapters if c.status == "completed"),
+        chapters=[ChapterStatus(**chapter_status(c)) for c in chapters],
+        content=content
+    )
+
+@app.post("/api/jobs/{job_id}/resume", response_model=JobSubmitResponse)
+async def resume_job(job_id: int, db: AsyncSession = Depends(get_async_db)):
+    """
+    重新執行失敗的工作：只生成尚未完成的章節，已完成的章節沿用既有結果
+    """
+    job = await db.get(GenerationJob, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="找不到該工作")
+    if job.status != "failed":
+        raise HTTPException(status_code=409, detail=f"工作狀態為 {job.status}，無法重新執行")
+    await _ensure_no_active_job(job.generation_id, db)
+    
+    job.status = "queued"
+    job.error = None
+    await db.commit()
+    job_runner.notify()
+    
+    return JobSubmitResponse(
+        job_id=job.id,
+        generation_id=job.generation_id,
+        status=job.status
+    )
+
+async def _batch_status(db: AsyncSession, batch: BatchRun, include_units: bool = True) -> BatchStatusResponse:
+    units = []
+    if include_units:
+        units = (await db.execute(
+            select(BatchUnit).where(BatchUnit.batch_id == batch.id).order_by(BatchUnit.id)
+        )).scalars().all()
+    return BatchStatusResponse(
+        batch_id=batch.id,
+        name=batch.name,
+        status=batch.status,
+        total=batch.total,
+        duplicates=batch.duplicates,
+        counts=await batch_counts(db, batch.id),
+        units=[BatchUnitStatus.model_validate(u) for u in units]
+    )
+
+async def _submit_batch(db: AsyncSession, units: list, name: Optional[str], fresh: bool,
+                        chapter_mode: str) -> BatchStatusResponse:
+    if not units:
+        raise HTTPException(status_code=400, detail="單元清單是空的")
+    if len(units) > settings.BATCH_MAX_UNITS:
+        raise HTTPException(status_code=400, detail=f"單一批次最多 {settings.BATCH_MAX_UNITS} 個單元")
+    batch = await submit_batch(db, units, name=name, use_cache=not fresh, chapter_mode=chapter_mode)
+    batch_runner.notify()
+    return await _batch_status(db, batch, include_units=False)
+
+@app.post("/api/batches", response_model=BatchStatusResponse, status_code=202)
+async def submit_batch_run(request: BatchSubmitRequest, db: AsyncSession = Depends(get_async_db)):
+    """
+    批次生成：提交多個單元，由背景 worker 依序生成大綱、教材與練習題
+    重複的單元只生成一次；先前批次已完成的相同單元會標記為 skipped（fresh 為 True 時重新生成）
+    """
+    return await _submit_batch(
+        db, [u.model_dump() for u in request.units], request.name, request.fresh, request.chapter_mode
+    )
+
+@app.post("/api/batches/upload", response_model=BatchStatusResponse, status_code=202)
+async def upload_batch_run(
+    file: UploadFile = File(...),
+    name: Optional[str] = Form(None),
+    fresh: bool = Form(False),
+    chapter_mode: ChapterMode = Form("separate"),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    批次生成（上傳檔案版）：CSV（subject,grade,unit 或 科目,年級,單元）或 JSONL（每行一個單元）
+    """
+    try:
+        units = parse_units((await file.read()).decode("utf-8"), file.filename)
+    except (UnicodeDecodeError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=f"無法解析單元清單: {e}")
+    return await _submit_batch(db, units, name or file.filename, fresh, chapter_mode)
+
+@app.get("/api/batches/{batch_id}", response_model=BatchStatusResponse)
+async def get_batch_status(batch_id: int, db: AsyncSession = Depends(get_async_db)):
+    """
+    查詢批次狀態與各單元的進度（最後完成的階段、生成記錄 ID 與錯誤）
+    """
+    batch = await db.get(BatchRun, batch_id)
+    if not batch:
+        raise HTTPException(status_code=404, detail="找不到該批次")
+    return await _batch_status(db, batch)
+
+@app.get("/api/batches/{batch_id}/report")
+async def stream_batch_report(batch_id: int, db: AsyncSession = Depends(get_async_db)):
+    """
+    以 NDJSON 串流批次報告：每行一個單元狀態（狀態改變時送出），批次結束後以 summary 結尾
+    """
+    if not await db.get(BatchRun, batch_id):
+        raise HTTPException(status_code=404, detail="找不到該批次")
+
+    async def report_lines():
+        async for item in iter_batch_report(batch_id):
+            yield json.dumps(item, ensure_ascii=False) + "\n"
+
+    return StreamingResponse(
+        report_lines(),
+        media_type="application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.post("/api/batches/{batch_id}/resume", response_model=BatchStatusResponse)
+async def resume_batch_run(batch_id: int, db: AsyncSession = Depends(get_async_db)):
+    """
+    重新執行批次中失敗的單元：從各單元最後完成的階段繼續，已完成的單元不會重新生成
+    """
+    batch = await db.get(BatchRun, batch_id)
+    if not batch:
+        raise HTTPException(status_code=404, detail="找不到該批次")
+    if batch.status != "failed":
+        raise HTTPException(status_code=409, detail=f"批次狀態為 {batch.status}，無法重新執行")
+    await resume_batch(db, batch)
+    batch_runner.notify()
+    await db.refresh(batch)
+    return await _batch_status(db, batch, include_units=False)
+
+@app.get("/api/cache/stats")
+async def get_cache_stats():
+    """
+    查詢 LLM 回應快取的命中統計
+    """
+    if groq_service.cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **groq_service.cache.stats()}
+
+@app.get("/api/llm/stats")
+async def get_llm_stats():
+    """
+    查詢 LLM 呼叫統計：排隊等待（速率限制）、重試退避與模型回應時間、重試與錯誤次數、斷路器狀態
+    使用多個供應商時另外列出各供應商的路由順序、p95 延遲與錯誤率
+    """
+    return groq_service.provider.stats()
+
+@app.get("/api/prompt-metrics")
+async def get_prompt_metrics():
+    """
+    查詢各提示詞模板的輸入 / 輸出 token 用量，以及參考內容壓縮前後的 token 數
+    """
+    return groq_service.metrics.stats()
+
+@app.delete("/api/prompt-metrics")
+async def reset_prompt_metrics():
+    """
+    清除 token 用量統計（例如調整提示詞前後分別量測）
+    """
+    groq_service.metrics.reset()
+    return {"status": "success"}
+
+def _encode_cursor(created_at: datetime, generation_id: int) -> str:
+    raw = f"{created_at.isoformat()}|{generation_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def _decode_cursor(cursor: str):
+    try:
+        created_at, generation_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(created_at), int(generation_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="無效的分頁游標")
+
+@app.get("/api/history", response_model=GenerationHistoryPage)
+async def get_history(
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = None,
+    subject: Optional[str] = None,
+    grade: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    分頁取得歷史記錄摘要（依建立時間由新到舊）
+    只讀取中繼資料欄位，不載入大綱、教材與題目的完整內容；完整內容請用 /api/history/{id}
+    """
+    query = select(
+        Generation.id,
+        Generation.subject,
+        Generation.grade,
+        Generation.unit,
+        Generation.created_at,
+        Generation.outline.isnot(None).label("has_outline"),
+        Generation.content.isnot(None).label("has_content"),
+        Generation.questions.isnot(None).label("has_questions"),
+    )
+    if subject:
+        query = query.where(Generation.subject == subject)
+    if grade:
+        query = query.where(Generation.grade == grade)
+    if cursor:
+        # keyset 分頁：從上一頁最後一筆 (created_at, id) 之後繼續
+        cursor_created_at, cursor_id = _decode_cursor(cursor)
+        query = query.where(or_(
+            Generation.created_at < cursor_created_at,
+            and_(Generation.created_at == cursor_created_at, Generation.id < cursor_id)
+        ))
+    query = query.order_by(Generation.created_at.desc(), Generation.id.desc()).limit(limit + 1)
+    
+    rows = (await db.execute(query)).all()
+    items = [GenerationSummary.model_validate(row) for row in rows[:limit]]
+    next_cursor = None
+    if len(rows) > limit:
+        last = rows[limit - 1]
+        next_cursor = _encode_cursor(last.created_at, last.id)
+    
+    return GenerationHistoryPage(items=items, next_cursor=next_cursor)
+
+async def _history_cache_headers(db: AsyncSession, generation_id: int) -> dict:
+    """
+    只讀取記錄的 version 與時間欄位，產生 ETag、Last-Modified 與 Cache-Control（每次使用前向伺服器確認）
+    HTTP 日期只到秒：記錄在目前這一秒內修改時不附 Last-Modified（同一秒內可能再被修改，無法作為驗證器），
+    因此客戶端取得的 Last-Modified 之後的修改一定落在更晚的秒數
+    """
+    row = (await db.execute(
+        select(Generation.created_at, Generation.updated_at, Generation.version)
+        .where(Generation.id == generation_id)
+    )).first()
+    if row is None:
+        raise HTTPException(status_code=404, detail="找不到該記錄")
+    headers = {
+        "ETag": generation_etag(generation_id, row.created_at, row.version),
+        "Cache-Control": "private, no-cache",
+    }
+    now = datetime.utcnow().replace(microsecond=0)
+    modified = (row.updated_at or row.created_at or now).replace(microsecond=0)
+    if modified < now:
+        headers["Last-Modified"] = format_datetime(modified.replace(tzinfo=timezone.utc), usegmt=True)
+    return headers
+
+def _not_modified(headers: dict, if_none_match: Optional[str], if_modified_since: Optional[str]) -> bool:
+    """
+    條件式 GET：有 If-None-Match 時只比對 ETag，否則比對 If-Modified-Since（兩者都是截到秒的 HTTP 日期）
+    沒有 Last-Modified（剛修改過）時不返回 304
+    """
+    if if_none_match is not None:
+        return etag_matches(if_none_match, headers["ETag"])
+    if if_modified_since is None or "Last-Modified" not in headers:
+        return False
+    try:
+        since = parsedate_to_datetime(if_modified_since)
+    except (TypeError, ValueError):
+        return False
+    if since.tzinfo is None:
+        return False
+    return parsedate_to_datetime(headers["Last-Modified"]) <= since
 
 @app.get("/api/history/{generation_id}", response_model=GenerationHistoryItem)
-def get_history_item(generation_id: int, db: Session = Depends(get_db)):
+async def get_history_item(
+    generation_id: int,
+    response: Response,
+    if_none_match: Optional[str] = Header(None),
+    if_modified_since: Optional[str] = Header(None),
+    db: AsyncSession = Depends(get_async_db)
+):
     """
     取得特定記錄的詳細內容
+    附上 ETag 與 Last-Modified；內容未改變時返回 304，不讀取、解壓縮或組合教材
     """
-    generation = db.query(Generation).filter(Generation.id == generation_id).first()
+    headers = await _history_cache_headers(db, generation_id)
+    if _not_modified(headers, if_none_match, if_modified_since):
+        return Response(status_code=304, headers=headers)
+
+    generation = await db.get(Generation, generation_id)
     if not generation:
         raise HTTPException(status_code=404, detail="找不到該記錄")
-    return generation
+    
+    item = GenerationHistoryItem.model_validate(generation)
+    chapters = await list_chapters(db, generation_id)
+    item.content = await load_content(db, generation, chapters)
+    item.chapters = [ChapterStatus(**chapter_status(c)) for c in chapters]
+    item.content_status = content_status(generation, chapters)
+    response.headers.update(headers)
+    return item
+
+@app.get("/api/history/{generation_id}/questions", response_model=GenerationQuestions)
+async def get_history_questions(
+    generation_id: int,
+    response: Response,
+    chapter_number: Optional[int] = None,
+    if_none_match: Optional[str] = Header(None),
+    if_modified_since: Optional[str] = Header(None),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    取得教材的結構化題目（已在寫入時解析，前端不需再解析 Markdown）
+    指定 chapter_number 時只返回該章節的題目；與 /api/history/{id} 相同支援條件式 GET
+    """
+    headers = await _history_cache_headers(db, generation_id)
+    if _not_modified(headers, if_none_match, if_modified_since):
+        return Response(status_code=304, headers=headers)
+
+    questions = await list_questions(db, generation_id, chapter_number)
+    response.headers.update(headers)
+    return GenerationQuestions(
+        generation_id=generation_id,
+        questions=[QuestionItem(**question_to_dict(q)) for q in questions]
+    )
+
+@app.get("/api/questions", response_model=QuestionPage)
+async def search_questions(
+    subject: Optional[str] = None,
+    grade: Optional[str] = None,
+    type: Optional[str] = None,
+    multiple_choice: Optional[bool] = None,
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[int] = None,
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    跨單元查詢題目，例如 ?subject=物理&grade=八年級&multiple_choice=true
+    依題目建立順序由新到舊，以 next_cursor 取得下一頁
+    """
+    rows, next_cursor = await query_questions(
+        db, subject=subject, grade=grade, question_type=type,
+        multiple_choice=multiple_choice, cursor=cursor, limit=limit
+    )
+    return QuestionPage(
+        items=[QuestionItem(**question_to_dict(row.Question, row)) for row in rows],
+        next_cursor=next_cursor
+    )
+
+@app.get("/api/search", response_model=SearchPage)
+async def search_materials(
+    q: str = Query(..., min_length=1, max_length=200),
+    subject: Optional[str] = None,
+    grade: Optional[str] = None,
+    limit: int = Query(20, ge=1, le=50),
+    offset: int = Query(0, ge=0, le=10000),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    全文搜尋大綱、章節內容與練習題（SQLite FTS5，中文以二字組索引）
+    以空白分隔的每個詞都必須出現，結果依相關度排序並附上原文片段；以 next_offset 取得下一頁
+    """
+    if not search_enabled():
+        raise HTTPException(status_code=501, detail="全文搜尋需要支援 FTS5 的 SQLite 資料庫")
+    items, next_offset = await search(db, q, subject=subject, grade=grade, limit=limit, offset=offset)
+    return SearchPage(items=[SearchHit(**item) for item in items], next_offset=next_offset)
 
 @app.delete("/api/history/{generation_id}")
-def delete_history_item(generation_id: int, db: Session = Depends(get_db)):
+async def delete_history_item(generation_id: int, db: AsyncSession = Depends(get_async_db)):
     """
     刪除特定歷史記錄
     """
-    generation = db.query(Generation).filter(Generation.id == generation_id).first()
+    generation = await db.get(Generation, generation_id)
     if not generation:
         raise HTTPException(status_code=404, detail="找不到該記錄")
     
-    db.delete(generation)
-    db.commit()
+    # 一併刪除相關的背景工作與章節記錄
+    await db.execute(delete(GenerationJob).where(GenerationJob.generation_id == generation_id))
+    await db.execute(delete(Question).where(Question.generation_id == generation_id))
+    await remove_generation(db, generation_id)
+    await db.execute(delete(Chapter).where(Chapter.generation_id == generation_id))
+    # 批次記錄保留，但不再指向已刪除的生成記錄
+    await db.execute(
+        update(BatchUnit).where(BatchUnit.generation_id == generation_id).values(generation_id=None)
+    )
+    await db.delete(generation)
+    await db.commit()
+    similarity_index.remove(generation_id)
     return {"status": "success", "message": "已刪除歷史記錄", "id": generation_id}
 
+def _ensure_structured_content(generation: Generation):
+    """
+    教材為備用方法生成的 Markdown（未拆分章節）時返回 409
+    """
+    if generation.content is not None and split_content(generation.content)[1] is None:
+        raise HTTPException(
+            status_code=409,
+            detail="教材為備用方法生成的 Markdown，沒有可替換的章節，請重新生成整份教材"
+        )
+
 @app.post("/api/regenerate-chapter", response_model=RegenerateChapterResponse)
-def regenerate_chapter(
-    request: RegenerateChapterRequest,
-    db: Session = Depends(get_db)
-):
+async def regenerate_chapter(request: RegenerateChapterRequest, response: Response,
+                             if_match: Optional[str] = Header(None)):
     """
     重新生成單一章節的內容與題目
+    備用方法生成的 Markdown 教材沒有章節可替換，返回 409（需重新生成整份教材），避免以空白骨架覆蓋原內容
+    單元標頭與章節在同一個交易中寫入
     """
     try:
-        generation = db.query(Generation).filter(Generation.id == request.generation_id).first()
-        if not generation:
-            raise HTTPException(status_code=404, detail="找不到該記錄")
+        generation = await _get_generation_or_404(request.generation_id, with_outline=True)
+        _ensure_structured_content(generation)
 
-        # 取用 outline（優先使用請求中的 outline，否則用資料庫中的）
-        outline_text = request.outline or generation.outline
-        outline_data = json.loads(outline_text)
+        # 取用 outline（優先使用請求中的 outline，否則用資料庫中已驗證的大綱）
+        outline_text, outline_data = _resolve_outline(generation, request.outline, if_match)
+        if outline_data is None:
+            raise HTTPException(status_code=400, detail="大綱不是有效的 JSON，無法重新生成章節")
 
         # 找到對應章節定義
         target_outline_chapter = next(
@@ -250,14 +1044,16 @@ def regenerate_chapter(
             raise HTTPException(status_code=404, detail="找不到該章節定義")
 
         # 生成單章內容與題目
-        chapter_result = groq_service.generate_chapter_content(
+        chapter_result = await groq_service.generate_chapter_content(
             generation.subject,
             generation.grade,
             generation.unit,
             target_outline_chapter.get("chapter_number"),
             target_outline_chapter.get("title"),
             target_outline_chapter.get("topics", []),
-            outline_text
+            outline_text,
+            use_cache=not request.fresh,
+            chapter_mode=request.chapter_mode
         )
 
         updated_chapter = {
@@ -269,36 +1065,22 @@ def regenerate_chapter(
             "questions": chapter_result["questions"]
         }
 
-        # 更新存量的 content JSON
-        try:
-            content_json = json.loads(generation.content) if generation.content else None
-        except Exception:
-            content_json = None
-
-        if not content_json:
-            # 若尚未生成過，建立骨架
-            content_json = {
-                "title": outline_data.get("title", ""),
-                "objectives": outline_data.get("objectives", []),
-                "chapters": []
-            }
-
-        # 替換或新增章節
-        chapters = content_json.get("chapters", [])
-        replaced = False
-        for idx, ch in enumerate(chapters):
-            if ch.get("chapter_number") == request.chapter_number:
-                chapters[idx] = updated_chapter
-                replaced = True
-                break
-        if not replaced:
-            chapters.append(updated_chapter)
-        content_json["chapters"] = chapters
-
-        # 儲存
-        generation.content = json.dumps(content_json, ensure_ascii=False, indent=2)
-        db.commit()
-        db.refresh(generation)
+        async with session_scope() as db:
+            generation = await db.get(Generation, request.generation_id)
+            if not generation:
+                raise HTTPException(status_code=404, detail="找不到該記錄")
+
+            # 生成期間教材可能已被改寫為 Markdown，寫入前再確認一次
+            _ensure_structured_content(generation)
+            # 若尚未生成過教材，建立單元標頭骨架
+            if generation.content is None:
+                generation.content = build_content_header(outline_data)
+
+            # 以單列寫入替換或新增章節，不需改寫整份教材；標頭與章節在同一個交易中 commit
+            await upsert_chapter(db, generation.id, updated_chapter)
+            etag = await content_etag(db, generation)
+        if etag is not None:
+            response.headers["ETag"] = etag
 
         return RegenerateChapterResponse(
             generation_id=generation.id,
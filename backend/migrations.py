@@ -0,0 +1,181 @@
+import json
+import time
+from datetime import datetime
+
+from sqlalchemy import inspect, text
+from sqlalchemy.exc import OperationalError
+
+from database import Base, engine
+from models import Generation, Question
+from chapter_store import split_content, parse_outline
+from question_store import question_rows
+from search_index import ensure_search_index
+from text_compression import decode_text
+
+
+# PostgreSQL advisory lock 的鍵（任意固定值，所有 worker 相同）
+_MIGRATION_LOCK_KEY = 7_301_001
+# 等待其他程序完成遷移的最長時間（秒）
+MIGRATION_LOCK_TIMEOUT = 600
+
+
+def run_migrations(engine):
+    """
+    輕量的結構遷移：建立新資料表，並為既有資料表補上之後新增的欄位與索引
+    （create_all 只會在建立資料表時一併建立欄位與索引，既有資料表需另外補上）
+    資料遷移記錄在 schema_migrations 表，每項只執行一次；最後建立全文索引（第一次建立時由既有資料建立）
+    整個遷移先取得資料庫鎖（SQLite 為 BEGIN EXCLUSIVE、PostgreSQL 為 advisory lock）並在同一個交易中執行：
+    多個 worker 同時啟動時依序執行，後取得鎖的程序看到已完成的結構與遷移記錄即略過
+    """
+    with engine.connect() as conn:
+        _acquire_lock(conn)
+        Base.metadata.create_all(bind=conn)
+
+        inspector = inspect(conn)
+        for table in Base.metadata.sorted_tables:
+            _add_missing_columns(conn, inspector, table)
+            existing = {index["name"] for index in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in existing:
+                    index.create(bind=conn)
+
+        conn.execute(text(
+            "CREATE TABLE IF NOT EXISTS schema_migrations ("
+            "name VARCHAR(100) PRIMARY KEY, applied_at TIMESTAMP NOT NULL)"
+        ))
+        applied = {row[0] for row in conn.execute(text("SELECT name FROM schema_migrations"))}
+        for name, migration in DATA_MIGRATIONS:
+            if name in applied:
+                continue
+            migration(conn)
+            conn.execute(
+                text("INSERT INTO schema_migrations (name, applied_at) VALUES (:name, :applied_at)"),
+                {"name": name, "applied_at": datetime.utcnow()},
+            )
+            print(f"已完成資料遷移：{name}")
+
+        ensure_search_index(conn)
+        conn.commit()
+
+
+def _acquire_lock(conn):
+    """
+    取得遷移鎖，持有到交易結束；SQLite 的 busy_timeout 較短，鎖定時重試直到 MIGRATION_LOCK_TIMEOUT
+    """
+    if conn.dialect.name == "postgresql":
+        conn.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": _MIGRATION_LOCK_KEY})
+        return
+    if conn.dialect.name != "sqlite":
+        return
+    deadline = time.monotonic() + MIGRATION_LOCK_TIMEOUT
+    while True:
+        try:
+            conn.exec_driver_sql("BEGIN EXCLUSIVE")
+            return
+        except OperationalError as e:
+            if "locked" not in str(e) or time.monotonic() >= deadline:
+                raise
+            conn.rollback()
+            time.sleep(0.5)
+
+
+def _add_missing_columns(conn, inspector, table):
+    """
+    以 ALTER TABLE ADD COLUMN 補上既有資料表缺少的欄位（已存在的欄位略過）
+    新增的欄位必須可為 NULL 或設有 server_default，既有資料列才能取得值
+    """
+    existing = {column["name"] for column in inspector.get_columns(table.name)}
+    for column in table.columns:
+        if column.name in existing:
+            continue
+        column_type = column.type.compile(dialect=conn.dialect)
+        ddl = f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"
+        if column.server_default is not None:
+            default = column.server_default.arg
+            default = default.text if hasattr(default, "text") else f"'{default}'"
+            ddl += f" DEFAULT {default}"
+        if not column.nullable:
+            ddl += " NOT NULL"
+        conn.execute(text(ddl))
+        print(f"已新增欄位：{table.name}.{column.name}")
+
+
+def migrate_content_to_chapters(conn):
+    """
+    將舊版整份教材 JSON 的章節拆到 chapters 表，generation.content 只保留單元標頭
+    """
+    rows = conn.execute(text(
+        "SELECT id, content FROM generations WHERE content IS NOT NULL"
+    )).fetchall()
+    now = datetime.utcnow()
+    for generation_id, content in rows:
+        header, chapters = split_content(decode_text(content))
+        if not chapters:
+            continue
+        # 同一章節編號重複時保留最後一筆（與舊版 regenerate_chapter 的覆寫行為一致）
+        unique = {entry.get("chapter_number"): entry for entry in chapters}
+        for entry in unique.values():
+            conn.execute(
+                text(
+                    "INSERT INTO chapters (generation_id, chapter_number, title, topics, description, "
+                    "content, questions, version, updated_at) VALUES (:generation_id, :chapter_number, "
+                    ":title, :topics, :description, :content, :questions, 1, :updated_at)"
+                ),
+                {
+                    "generation_id": generation_id,
+                    "chapter_number": entry.get("chapter_number"),
+                    "title": entry.get("title"),
+                    "topics": json.dumps(entry.get("topics", []), ensure_ascii=False),
+                    "description": entry.get("description", ""),
+                    "content": entry.get("content"),
+                    "questions": entry.get("questions"),
+                    "updated_at": now,
+                },
+            )
+        conn.execute(
+            text("UPDATE generations SET content = :content WHERE id = :id"),
+            {"content": header, "id": generation_id},
+        )
+
+
+def migrate_parse_questions(conn):
+    """
+    解析既有章節與教材的練習題 Markdown，建立 questions 表的題目
+    """
+    sources = conn.execute(text(
+        "SELECT generation_id, chapter_number, questions FROM chapters WHERE questions IS NOT NULL "
+        "UNION ALL SELECT id, NULL, questions FROM generations WHERE questions IS NOT NULL"
+    )).fetchall()
+    for generation_id, chapter_number, markdown in sources:
+        rows = question_rows(generation_id, chapter_number, decode_text(markdown))
+        if rows:
+            conn.execute(Question.__table__.insert(), rows)
+
+
+def migrate_outline_data(conn):
+    """
+    驗證既有的大綱並寫入 outline_data（之後的階段直接讀取結構化大綱，不再重新解析）；
+    無法解析的舊大綱維持 NULL（改用備用方法生成）
+    """
+    table = Generation.__table__
+    rows = conn.execute(text(
+        "SELECT id, outline FROM generations WHERE outline IS NOT NULL AND outline_data IS NULL"
+    )).fetchall()
+    for generation_id, outline in rows:
+        outline_data = parse_outline(decode_text(outline))
+        if outline_data is not None:
+            # 經由資料表的欄位型別寫入（與 ORM 相同的格式與壓縮）
+            conn.execute(table.update().where(table.c.id == generation_id).values(outline_data=outline_data))
+
+
+# 依序執行的資料遷移（名稱一經發布不可更改）
+DATA_MIGRATIONS = [
+    ("0001_content_to_chapters", migrate_content_to_chapters),
+    ("0002_parse_questions", migrate_parse_questions),
+    ("0003_outline_data", migrate_outline_data),
+]
+
+
+if __name__ == "__main__":
+    # 部署多個 worker 時可先執行 python -m migrations，再以 MIGRATE_ON_STARTUP=false 啟動服務
+    run_migrations(engine)
@@ -1,6 +1,24 @@
-from sqlalchemy import Column, Integer, String, Text, DateTime
+from sqlalchemy import Column, Integer, String, Text, DateTime, Boolean, ForeignKey, Index, UniqueConstraint
+from sqlalchemy.orm import deferred
+from sqlalchemy.types import TypeDecorator
 from datetime import datetime
 from database import Base
+from text_compression import CompressedText
+from outline_schema import Outline, dump_outline
+
+class OutlineData(TypeDecorator):
+    """
+    驗證後的結構化大綱：以 dump_outline 的緊湊 JSON（壓縮）儲存，讀取時經 Outline 模型載入為 dict
+    寫入前已驗證，讀取時不需再做本機修復
+    """
+    impl = CompressedText
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        return None if value is None else dump_outline(value)
+
+    def process_result_value(self, value, dialect):
+        return None if value is None else Outline.model_validate_json(value).model_dump()
 
 class Generation(Base):
     __tablename__ = "generations"
@@ -9,7 +27,167 @@ class Generation(Base):
     subject = Column(String(100), nullable=False)
     grade = Column(String(50), nullable=False)
     unit = Column(String(200), nullable=False)
-    outline = Column(Text, nullable=True)
-    content = Column(Text, nullable=True)
-    questions = Column(Text, nullable=True)
+    # 大型文字欄位以壓縮格式儲存（見 text_compression.CompressedText）
+    outline = Column(CompressedText, nullable=True)
+    # outline 通過驗證時的結構化大綱（無法解析的舊大綱為 NULL，改用備用方法生成）；
+    # 延遲載入，只有使用大綱的端點以 undefer 讀取
+    outline_data = deferred(Column(OutlineData, nullable=True))
+    content = Column(CompressedText, nullable=True)
+    questions = Column(CompressedText, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    # 大綱、教材、章節或練習題每次改寫遞增（歷史記錄的 ETag）；舊資料的 updated_at 為 NULL，以 created_at 代替
+    version = Column(Integer, nullable=False, default=1, server_default="1")
+    updated_at = Column(DateTime, nullable=True, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (
+        # 歷史記錄依 (created_at, id) 做游標分頁
+        Index("ix_generations_created_at_id", "created_at", "id"),
+        # 依科目、年級篩選後再分頁
+        Index("ix_generations_subject_grade_created_at", "subject", "grade", "created_at", "id"),
+    )
+
+class Chapter(Base):
+    """
+    教材中的單一章節；generation.content 只保留單元標頭（title、objectives），
+    章節內容與練習題逐列存放，單章讀寫不需解析或改寫整份教材
+    """
+    __tablename__ = "chapters"
+
+    id = Column(Integer, primary_key=True, index=True)
+    generation_id = Column(Integer, ForeignKey("generations.id"), nullable=False)
+    chapter_number = Column(Integer, nullable=False)
+    title = Column(String(200), nullable=True)
+    # 主題列表（JSON 陣列）
+    topics = Column(Text, nullable=True)
+    description = Column(Text, nullable=True)
+    content = Column(CompressedText, nullable=True)
+    questions = Column(CompressedText, nullable=True)
+    # 生成狀態：pending / completed / failed；章節完成即寫入，生成中途失敗時保留已完成的章節
+    status = Column(String(20), nullable=False, default="completed", server_default="completed")
+    error = Column(Text, nullable=True)
+    # 每次改寫遞增
+    version = Column(Integer, nullable=False, default=1)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (
+        UniqueConstraint("generation_id", "chapter_number", name="uq_chapters_generation_chapter"),
+    )
+
+class Question(Base):
+    """
+    從練習題 Markdown 解析出的單一題目，練習題寫入時整批重建
+    chapter_number 為 NULL 表示整份教材的練習題（generation.questions）
+    """
+    __tablename__ = "questions"
+
+    id = Column(Integer, primary_key=True, index=True)
+    generation_id = Column(Integer, ForeignKey("generations.id"), nullable=False)
+    chapter_number = Column(Integer, nullable=True)
+    # 在原始 Markdown 中的順序
+    position = Column(Integer, nullable=False)
+    number = Column(Integer, nullable=True)
+    question_type = Column(String(50), nullable=True)
+    stem = Column(Text, nullable=False)
+    # 選項列表（JSON 陣列：[{"label": "A", "text": "..."}]）
+    options = Column(Text, nullable=True)
+    answer = Column(Text, nullable=True)
+    # 選擇題的正確選項（A–D），其他題型為 NULL
+    answer_letter = Column(String(1), nullable=True)
+    multiple_choice = Column(Boolean, nullable=False, default=False)
+    explanation = Column(Text, nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        # 讀取單一教材（或章節）的題目
+        Index("ix_questions_generation_chapter_position", "generation_id", "chapter_number", "position"),
+        # 跨單元依題型或是否為選擇題篩選，並以 id 游標分頁（WHERE ... AND id < ? ORDER BY id DESC）；
+        # 依科目、年級篩選時先由 generations 的索引找出教材
+        Index("ix_questions_type_id", "question_type", "id"),
+        Index("ix_questions_multiple_choice_id", "multiple_choice", "id"),
+    )
+
+class GenerationJob(Base):
+    """
+    背景教材生成工作：狀態為 queued / running / completed / failed
+    只記錄租約與工作狀態，章節結果寫入教材的 chapters 表
+    執行中的工作會定期更新 heartbeat_at，逾時未更新即視為 worker 已中斷，可由其他 worker 接手
+    """
+    __tablename__ = "generation_jobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    generation_id = Column(Integer, ForeignKey("generations.id"), nullable=False, index=True)
+    outline = Column(Text, nullable=False)
+    use_cache = Column(Boolean, nullable=False, default=True)
+    # 章節生成模式：separate / combined
+    chapter_mode = Column(String(20), nullable=False, default="separate", server_default="separate")
+    status = Column(String(20), nullable=False, default="queued", index=True)
+    error = Column(Text, nullable=True)
+    worker_id = Column(String(64), nullable=True)
+    heartbeat_at = Column(DateTime, nullable=True)
+    attempts = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class GenerationProgress(Base):
+    """
+    教材生成進度（供多個 uvicorn worker 共用），超過 expires_at 的項目會被定期清除
+    """
+    __tablename__ = "generation_progress"
+
+    generation_id = Column(Integer, primary_key=True)
+    current = Column(Integer, nullable=False, default=0)
+    total = Column(Integer, nullable=False, default=0)
+    status = Column(String(20), nullable=False)
+    version = Column(Integer, nullable=False, default=1)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+    expires_at = Column(DateTime, nullable=False, index=True)
+
+class BatchRun(Base):
+    """
+    批次生成：一次提交多個單元，由背景 worker 依序生成大綱、教材與練習題
+    狀態為 running / completed / failed（所有單元結束且至少一個失敗）
+    """
+    __tablename__ = "batch_runs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    name = Column(String(200), nullable=True)
+    use_cache = Column(Boolean, nullable=False, default=True)
+    chapter_mode = Column(String(20), nullable=False, default="separate")
+    status = Column(String(20), nullable=False, default="running", index=True)
+    total = Column(Integer, nullable=False, default=0)
+    # 提交時被合併的重複單元數
+    duplicates = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class BatchUnit(Base):
+    """
+    批次中的單一單元：狀態為 pending / running / completed / failed / skipped
+    stage 記錄最後完成的階段（outline → content → questions），重新執行時從下一個階段繼續
+    """
+    __tablename__ = "batch_units"
+
+    id = Column(Integer, primary_key=True, index=True)
+    batch_id = Column(Integer, ForeignKey("batch_runs.id"), nullable=False)
+    subject = Column(String(100), nullable=False)
+    grade = Column(String(50), nullable=False)
+    unit = Column(String(200), nullable=False)
+    # 正規化後的 (科目, 年級, 單元)，用於合併重複單元
+    unit_key = Column(String(400), nullable=False)
+    status = Column(String(20), nullable=False, default="pending")
+    stage = Column(String(20), nullable=True)
+    generation_id = Column(Integer, ForeignKey("generations.id"), nullable=True)
+    error = Column(Text, nullable=True)
+    worker_id = Column(String(64), nullable=True)
+    heartbeat_at = Column(DateTime, nullable=True)
+    attempts = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (
+        UniqueConstraint("batch_id", "unit_key", name="uq_batch_units_batch_key"),
+        # worker 領取待處理單元
+        Index("ix_batch_units_status_id", "status", "id"),
+        # 提交時查詢先前批次已完成的相同單元
+        Index("ix_batch_units_unit_key_status", "unit_key", "status"),
+    )
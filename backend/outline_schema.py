@@ -0,0 +1,275 @@
+import json
+import re
+from typing import List, Optional, Tuple, Union
+
+from pydantic import BaseModel, ValidationError, field_validator, model_validator
+
+_FENCE = re.compile(r"^\s*```[a-zA-Z]*\s*|\s*```\s*$")
+# 串流中 chapters 陣列開始前的鍵名
+_CHAPTERS_KEY = re.compile(r'"chapters"\s*:\s*$')
+
+
+class OutlineChapter(BaseModel):
+    chapter_number: int
+    title: str
+    topics: List[str] = []
+    description: str = ""
+
+    @field_validator("title")
+    @classmethod
+    def _title_not_empty(cls, value: str) -> str:
+        value = value.strip()
+        if not value:
+            raise ValueError("章節標題不可為空")
+        return value
+
+    @field_validator("topics", mode="before")
+    @classmethod
+    def _topics_list(cls, value):
+        # 模型偶爾把單一主題輸出為字串
+        if isinstance(value, str):
+            return [value]
+        return value
+
+    @field_validator("description", mode="before")
+    @classmethod
+    def _description_text(cls, value):
+        return "" if value is None else value
+
+
+class Outline(BaseModel):
+    """
+    教學大綱的結構（與 _build_outline_prompt 要求的格式相同）
+    """
+    title: str
+    objectives: List[str] = []
+    chapters: List[OutlineChapter]
+
+    @model_validator(mode="before")
+    @classmethod
+    def _number_chapters(cls, data):
+        # 缺少章節編號時依順序補上
+        if isinstance(data, dict) and isinstance(data.get("chapters"), list):
+            chapters = []
+            for index, chapter in enumerate(data["chapters"], start=1):
+                if isinstance(chapter, dict) and chapter.get("chapter_number") in (None, ""):
+                    chapter = {**chapter, "chapter_number": index}
+                chapters.append(chapter)
+            data = {**data, "chapters": chapters}
+        return data
+
+    @field_validator("chapters")
+    @classmethod
+    def _chapters_valid(cls, chapters: List[OutlineChapter]) -> List[OutlineChapter]:
+        if not chapters:
+            raise ValueError("至少需要一個章節")
+        numbers = [chapter.chapter_number for chapter in chapters]
+        if len(set(numbers)) != len(numbers):
+            raise ValueError(f"章節編號重複：{numbers}")
+        return chapters
+
+
+def _json_objects(text: str):
+    """
+    找出文字中所有最外層的 {...} 區段（略過字串中的括號），返回 (起, 迄) 位置
+    """
+    depth = 0
+    start = None
+    in_string = escaped = False
+    for i, char in enumerate(text):
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = depth > 0
+        elif char == "{":
+            if depth == 0:
+                start = i
+            depth += 1
+        elif char == "}" and depth > 0:
+            depth -= 1
+            if depth == 0:
+                yield start, i + 1
+
+
+def _strip_trailing_commas(text: str) -> str:
+    """
+    移除 ] 或 } 之前多餘的逗號（字串中的逗號不變）
+    """
+    out = []
+    in_string = escaped = False
+    pending_comma = None
+    for char in text:
+        if in_string:
+            out.append(char)
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+            continue
+        if pending_comma is not None:
+            if char.isspace():
+                pending_comma.append(char)
+                continue
+            if char not in "]}":
+                out.append(",")
+            out.extend(pending_comma)
+            pending_comma = None
+        if char == ",":
+            pending_comma = []
+            continue
+        if char == '"':
+            in_string = True
+        out.append(char)
+    if pending_comma is not None:
+        out.append(",")
+        out.extend(pending_comma)
+    return "".join(out)
+
+
+def repair_json(text: str):
+    """
+    本機修復模型輸出的 JSON：去除 Markdown 程式碼區塊標記、取出最大的 JSON 物件、移除多餘的逗號
+    無法修復時返回 None
+    """
+    text = _FENCE.sub("", text or "").strip()
+    candidates = sorted(_json_objects(text), key=lambda span: span[1] - span[0], reverse=True)
+    for start, end in candidates:
+        snippet = text[start:end]
+        for attempt in (snippet, _strip_trailing_commas(snippet)):
+            try:
+                return json.loads(attempt)
+            except json.JSONDecodeError:
+                continue
+    return None
+
+
+def _format_errors(error: ValidationError) -> str:
+    return "; ".join(
+        f"{'.'.join(str(part) for part in item['loc']) or '(root)'}: {item['msg']}"
+        for item in error.errors()
+    )
+
+
+def validate_outline(raw: Union[str, dict, None]) -> Tuple[Optional[Outline], Optional[str]]:
+    """
+    驗證大綱（先直接解析，失敗時本機修復），返回 (大綱, None) 或 (None, 錯誤說明)
+    """
+    data = raw
+    if isinstance(raw, str):
+        try:
+            data = json.loads(raw)
+        except json.JSONDecodeError:
+            data = repair_json(raw)
+    if data is None:
+        return None, "輸出不是有效的 JSON"
+    try:
+        return Outline.model_validate(data), None
+    except ValidationError as e:
+        return None, _format_errors(e)
+
+
+def dump_outline(outline: Union[Outline, dict]) -> str:
+    """
+    驗證後的大綱以固定格式的緊湊 JSON 儲存（不含縮排與多餘空白），之後的階段可直接以 json.loads 讀取
+    """
+    data = outline.model_dump() if isinstance(outline, Outline) else outline
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+
+
+class OutlineStreamParser:
+    """
+    串流中的大綱 JSON 增量解析：每段文字只從上次的位置往後掃描一次（追蹤字串與括號深度），
+    chapters 陣列中的章節物件一結束就返回，不需等待整份大綱
+    chapters 之前的欄位（title、objectives）在陣列開始時解析為 header
+    完整大綱仍以 validate_outline(parser.text) 驗證
+    """
+
+    def __init__(self):
+        self.text = ""
+        self.header: dict = {}
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self._root = None
+        # chapters 陣列內的括號深度；陣列結束後不再解析章節
+        self._chapters_depth = None
+        self._chapters_closed = False
+        self._chapter_start = None
+        self._count = 0
+
+    def feed(self, delta: str) -> List[OutlineChapter]:
+        """
+        加入一段串流文字，返回這段文字中完成的章節（無法解析或驗證的章節略過）
+        """
+        self.text += delta
+        text = self.text
+        chapters = []
+        for i in range(self._pos, len(text)):
+            char = text[i]
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+            elif self._root is None:
+                # 略過最外層物件之前的文字（例如 Markdown 程式碼區塊標記）
+                if char == "{":
+                    self._root = i
+                    self._depth = 1
+            elif char == '"':
+                self._in_string = True
+            elif char in "{[":
+                if (char == "[" and self._depth == 1 and not self._chapters_closed
+                        and self._chapters_depth is None):
+                    key = _CHAPTERS_KEY.search(text, self._root, i)
+                    if key is not None:
+                        self._chapters_depth = 2
+                        self.header = self._parse_header(text[self._root:key.start()])
+                self._depth += 1
+                if (char == "{" and self._chapters_depth is not None
+                        and self._depth == self._chapters_depth + 1):
+                    self._chapter_start = i
+            elif char in "}]":
+                if (char == "}" and self._chapter_start is not None
+                        and self._depth == self._chapters_depth + 1):
+                    chapter = self._parse_chapter(text[self._chapter_start:i + 1])
+                    if chapter is not None:
+                        chapters.append(chapter)
+                    self._chapter_start = None
+                elif char == "]" and self._depth == self._chapters_depth:
+                    self._chapters_depth = None
+                    self._chapters_closed = True
+                self._depth -= 1
+        self._pos = len(text)
+        return chapters
+
+    def _parse_header(self, prefix: str) -> dict:
+        prefix = prefix.rstrip().rstrip(",")
+        try:
+            header = json.loads(prefix + "}")
+        except json.JSONDecodeError:
+            header = repair_json(prefix + "}")
+        return header if isinstance(header, dict) else {}
+
+    def _parse_chapter(self, snippet: str) -> Optional[OutlineChapter]:
+        # 與 Outline 相同：缺少章節編號時依順序補上
+        self._count += 1
+        data = repair_json(snippet)
+        if not isinstance(data, dict):
+            return None
+        if data.get("chapter_number") in (None, ""):
+            data["chapter_number"] = self._count
+        try:
+            return OutlineChapter.model_validate(data)
+        except ValidationError:
+            return None
@@ -0,0 +1,206 @@
+import abc
+import asyncio
+import time
+from datetime import datetime, timedelta
+from typing import Dict
+
+from sqlalchemy import delete, update
+from sqlalchemy.exc import IntegrityError
+
+from config import settings
+from database import AsyncSessionLocal
+from models import GenerationProgress
+
+# 進入這些狀態後不會再有更新，長輪詢可立即返回
+TERMINAL_STATUSES = ("completed", "error")
+
+
+def _not_started() -> dict:
+    return {"current": 0, "total": 0, "status": "not_started", "version": 0}
+
+
+class ProgressStore(abc.ABC):
+    """
+    教材生成進度的儲存介面
+    每次更新都會遞增 version，客戶端可帶上已看過的 version 長輪詢下一次更新
+    """
+
+    # 過期項目的清理間隔（秒），清理在寫入時順便執行
+    PURGE_INTERVAL = 60
+
+    def __init__(self, ttl_seconds: int = None):
+        self.ttl_seconds = ttl_seconds or settings.PROGRESS_TTL_SECONDS
+        self._last_purge = 0.0
+        # 等待中的長輪詢，每次更新時全部喚醒
+        self._waiters = set()
+
+    @abc.abstractmethod
+    async def set(self, generation_id: int, current: int, total: int, status: str):
+        """
+        寫入進度並遞增 version
+        """
+
+    @abc.abstractmethod
+    async def get(self, generation_id: int) -> dict:
+        """
+        目前進度；沒有記錄時返回 not_started
+        """
+
+    @abc.abstractmethod
+    async def purge_expired(self):
+        """
+        清除超過 ttl_seconds 未更新的進度
+        """
+
+    async def update_status(self, generation_id: int, status: str):
+        """
+        只更新狀態，保留目前的章節計數
+        """
+        progress = await self.get(generation_id)
+        await self.set(generation_id, progress["current"], progress["total"], status)
+
+    async def wait_for_update(self, generation_id: int, since_version: int, timeout: float) -> dict:
+        """
+        長輪詢：等待 version 大於 since_version 的進度，逾時則返回目前進度
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            progress = await self.get(generation_id)
+            if progress["version"] > since_version or progress["status"] in TERMINAL_STATUSES:
+                return progress
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return progress
+            await self._wait_for_change(remaining)
+
+    async def _wait_for_change(self, timeout: float):
+        event = asyncio.Event()
+        self._waiters.add(event)
+        try:
+            await asyncio.wait_for(event.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            self._waiters.discard(event)
+
+    async def _notify(self):
+        for event in list(self._waiters):
+            event.set()
+
+    async def _maybe_purge(self):
+        now = time.monotonic()
+        if now - self._last_purge >= self.PURGE_INTERVAL:
+            self._last_purge = now
+            await self.purge_expired()
+
+
+class MemoryProgressStore(ProgressStore):
+    """
+    單一程序內的進度儲存（僅適用單一 uvicorn worker），項目在最後一次更新後經過 TTL 即移除
+    """
+
+    def __init__(self, ttl_seconds: int = None):
+        super().__init__(ttl_seconds)
+        self._items: Dict[int, dict] = {}
+
+    async def set(self, generation_id: int, current: int, total: int, status: str):
+        previous = self._items.get(generation_id)
+        self._items[generation_id] = {
+            "current": current,
+            "total": total,
+            "status": status,
+            "version": (previous["version"] if previous else 0) + 1,
+            "expires_at": time.monotonic() + self.ttl_seconds,
+        }
+        await self._notify()
+        await self._maybe_purge()
+
+    async def get(self, generation_id: int) -> dict:
+        item = self._items.get(generation_id)
+        if item is None or item["expires_at"] < time.monotonic():
+            return _not_started()
+        return {key: value for key, value in item.items() if key != "expires_at"}
+
+    async def purge_expired(self):
+        now = time.monotonic()
+        for generation_id in [k for k, v in self._items.items() if v["expires_at"] < now]:
+            del self._items[generation_id]
+
+
+class DatabaseProgressStore(ProgressStore):
+    """
+    以資料庫資料表儲存進度，多個 uvicorn worker 共用同一份進度
+    同一程序內的更新會立即喚醒長輪詢；其他程序的更新則以 poll_interval 輪詢資料表取得
+    """
+
+    def __init__(self, ttl_seconds: int = None, poll_interval: float = None):
+        super().__init__(ttl_seconds)
+        self.poll_interval = poll_interval or settings.PROGRESS_POLL_INTERVAL
+
+    async def set(self, generation_id: int, current: int, total: int, status: str):
+        now = datetime.utcnow()
+        values = {
+            "current": current,
+            "total": total,
+            "status": status,
+            "updated_at": now,
+            "expires_at": now + timedelta(seconds=self.ttl_seconds),
+        }
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(
+                update(GenerationProgress)
+                .where(GenerationProgress.generation_id == generation_id)
+                .values(version=GenerationProgress.version + 1, **values)
+            )
+            if result.rowcount == 0:
+                db.add(GenerationProgress(generation_id=generation_id, version=1, **values))
+                try:
+                    await db.commit()
+                except IntegrityError:
+                    # 其他 worker 同時建立了同一筆記錄，改為更新
+                    await db.rollback()
+                    await db.execute(
+                        update(GenerationProgress)
+                        .where(GenerationProgress.generation_id == generation_id)
+                        .values(version=GenerationProgress.version + 1, **values)
+                    )
+                    await db.commit()
+            else:
+                await db.commit()
+        await self._notify()
+        await self._maybe_purge()
+
+    async def get(self, generation_id: int) -> dict:
+        async with AsyncSessionLocal() as db:
+            row = await db.get(GenerationProgress, generation_id)
+        if row is None or row.expires_at < datetime.utcnow():
+            return _not_started()
+        return {
+            "current": row.current,
+            "total": row.total,
+            "status": row.status,
+            "version": row.version,
+        }
+
+    async def purge_expired(self):
+        async with AsyncSessionLocal() as db:
+            await db.execute(
+                delete(GenerationProgress).where(GenerationProgress.expires_at < datetime.utcnow())
+            )
+            await db.commit()
+
+    async def _wait_for_change(self, timeout: float):
+        # 其他程序的更新不會觸發本程序的通知，最多等待 poll_interval 後重新查詢
+        await super()._wait_for_change(min(timeout, self.poll_interval))
+
+
+def create_progress_store() -> ProgressStore:
+    """
+    依 PROGRESS_BACKEND 設定建立進度儲存：memory（單一程序）或 database（多 worker 共用）
+    """
+    backend = settings.PROGRESS_BACKEND.lower()
+    if backend == "memory":
+        return MemoryProgressStore()
+    if backend == "database":
+        return DatabaseProgressStore()
+    raise ValueError(f"不支援的 PROGRESS_BACKEND: {settings.PROGRESS_BACKEND}")
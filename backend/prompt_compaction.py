@@ -0,0 +1,146 @@
+import json
+import re
+from typing import Tuple, Union
+
+from config import settings
+from llm_client import estimate_tokens
+
+_HEADING = re.compile(r"^#{1,6}\s")
+_TABLE_SEPARATOR = re.compile(r"^\|?\s*:?-{3,}")
+_LINK = re.compile(r"\[([^\]]+)\]\([^)]+\)")
+_BLANK_LINES = re.compile(r"\n{3,}")
+_SENTENCE_END = re.compile(r"[。！？.!?]")
+
+
+def build_outline_digest(outline: Union[str, dict]) -> str:
+    """
+    將大綱壓縮為只含單元標題、章節標題與主題的摘要，供各章節提示詞共用
+    每個單元只需建立一次；大綱不是有效的 JSON 時原樣返回
+    """
+    if isinstance(outline, str):
+        try:
+            outline_data = json.loads(outline)
+        except json.JSONDecodeError:
+            return outline
+    else:
+        outline_data = outline
+    if not isinstance(outline_data, dict) or not isinstance(outline_data.get("chapters"), list):
+        return outline if isinstance(outline, str) else json.dumps(outline, ensure_ascii=False)
+
+    lines = [f"單元：{outline_data.get('title', '')}"]
+    for chapter in outline_data["chapters"]:
+        topics = "、".join(chapter.get("topics", []))
+        lines.append(f"第{chapter.get('chapter_number')}章 {chapter.get('title', '')}：{topics}")
+    return "\n".join(lines)
+
+
+def _clean_markdown(text: str) -> str:
+    """
+    移除不影響出題的格式：表格分隔列、分隔線、連結網址與多餘空白
+    """
+    lines = []
+    for line in text.splitlines():
+        stripped = line.strip()
+        if stripped == "---" or _TABLE_SEPARATOR.match(stripped):
+            continue
+        lines.append(_LINK.sub(r"\1", line.rstrip()))
+    return _BLANK_LINES.sub("\n\n", "\n".join(lines)).strip()
+
+
+def _truncate(text: str, limit: int) -> str:
+    """
+    截斷至 limit 字元內，盡量停在句尾
+    """
+    if len(text) <= limit:
+        return text
+    cut = text[:limit]
+    ends = [m.end() for m in _SENTENCE_END.finditer(cut)]
+    if ends and ends[-1] > limit // 2:
+        cut = cut[:ends[-1]]
+    return cut.rstrip() + "…"
+
+
+def compact_markdown(text: str, max_chars: int = 0) -> str:
+    """
+    壓縮 Markdown 教材內容供出題使用
+    先移除格式雜訊（不遺失內容）；max_chars 大於 0 且仍超過時保留所有標題，並依各段落長度比例分配剩餘字數
+    """
+    text = _clean_markdown(text or "")
+    if max_chars <= 0 or len(text) <= max_chars:
+        return text
+
+    sections = []
+    for line in text.splitlines():
+        if _HEADING.match(line):
+            sections.append([line, []])
+        elif not sections:
+            # 第一個標題前的內容
+            sections.append(["", [line]])
+        else:
+            sections[-1][1].append(line)
+
+    headings_chars = sum(len(heading) + 1 for heading, _ in sections if heading)
+    bodies = ["\n".join(body).strip() for _, body in sections]
+    body_chars = sum(len(body) for body in bodies) or 1
+    budget = max(0, max_chars - headings_chars)
+
+    parts = []
+    used = 0
+    for (heading, _), body in zip(sections, bodies):
+        # 標題過多時仍以 max_chars 為上限，捨棄後面的段落
+        if used + len(heading) > max_chars:
+            break
+        if heading:
+            parts.append(heading)
+            used += len(heading) + 1
+        if body:
+            share = min(max(40, budget * len(body) // body_chars), max_chars - used)
+            if share > 0:
+                parts.append(_truncate(body, share))
+                used += len(parts[-1]) + 1
+    return "\n".join(parts)
+
+
+def compact_unit_content(content: str, token_budget: int = None) -> Tuple[str, bool]:
+    """
+    將整份教材（/api/generate-content 的 JSON）整理為出題用的純文字
+    保留單元標題、學習目標與各章節內容（只移除格式，不截斷），不重送各章節已生成的練習題；
+    內容不是結構化 JSON 時以 Markdown 方式整理
+    token_budget（預設 PROMPT_UNIT_CONTEXT_TOKENS）大於 0 且估算的 token 數超過時，才依比例截斷各章節
+    返回 (內容, 是否截斷)
+    """
+    if token_budget is None:
+        token_budget = settings.PROMPT_UNIT_CONTEXT_TOKENS
+    try:
+        content_json = json.loads(content)
+    except (TypeError, json.JSONDecodeError):
+        content_json = None
+    if not isinstance(content_json, dict) or not isinstance(content_json.get("chapters"), list):
+        text = compact_markdown(content)
+        tokens = estimate_tokens(text)
+        if token_budget <= 0 or tokens <= token_budget:
+            return text, False
+        return compact_markdown(text, len(text) * token_budget // tokens), True
+
+    header = [f"# {content_json.get('title', '')}"]
+    objectives = content_json.get("objectives") or []
+    if objectives:
+        header.append("學習目標：" + "；".join(objectives))
+    chapters = [
+        (f"\n## 第{chapter.get('chapter_number')}章 {chapter.get('title', '')}",
+         compact_markdown(chapter.get("content") or ""))
+        for chapter in content_json["chapters"]
+    ]
+    text = "\n".join(header + [line for chapter in chapters for line in chapter])
+    tokens = estimate_tokens(text)
+    if token_budget <= 0 or tokens <= token_budget:
+        return text, False
+
+    # 超過預算：標題與學習目標完整保留，各章節內容依相同比例截斷
+    fixed = estimate_tokens("\n".join(header + [heading for heading, _ in chapters]))
+    ratio = max(0, token_budget - fixed) / max(1, tokens - fixed)
+    lines = list(header)
+    for heading, body in chapters:
+        lines.append(heading)
+        lines.append(compact_markdown(body, max(1, int(len(body) * ratio))))
+    return "\n".join(lines), True
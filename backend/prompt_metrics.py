@@ -0,0 +1,78 @@
+import threading
+from typing import Dict
+
+from llm_client import estimate_tokens
+
+
+class PromptMetrics:
+    """
+    依提示詞模板統計 LLM 呼叫的輸入 / 輸出 token 數
+    - 輸入 token 以 API 回傳的 usage 為準（快取命中不計入 token，只計次數）
+    - 壓縮統計記錄每個模板中大綱、教材等參考內容壓縮前後的 token 數（以 estimate_tokens 估算）
+    以鎖保護，可在執行緒（例如 asyncio.to_thread）中安全記錄
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._templates: Dict[str, dict] = {}
+
+    def _entry(self, template: str) -> dict:
+        entry = self._templates.get(template)
+        if entry is None:
+            entry = self._templates[template] = {
+                "calls": 0,
+                "cache_hits": 0,
+                "prompt_chars": 0,
+                "prompt_tokens": 0,
+                "completion_tokens": 0,
+                "context_tokens_original": 0,
+                "context_tokens_compacted": 0,
+                "context_truncations": 0,
+            }
+        return entry
+
+    def record_call(self, template: str, prompt_chars: int, usage=None):
+        with self._lock:
+            entry = self._entry(template)
+            entry["calls"] += 1
+            entry["prompt_chars"] += prompt_chars
+            if usage is not None:
+                entry["prompt_tokens"] += usage.prompt_tokens or 0
+                entry["completion_tokens"] += usage.completion_tokens or 0
+
+    def record_cache_hit(self, template: str):
+        with self._lock:
+            self._entry(template)["cache_hits"] += 1
+
+    def record_compaction(self, template: str, original: str, compacted: str, truncated: bool = False):
+        """
+        truncated 表示參考內容因超過預算而截斷（會遺失內容），記錄於 context_truncations
+        """
+        original_tokens = estimate_tokens(original)
+        compacted_tokens = estimate_tokens(compacted)
+        with self._lock:
+            entry = self._entry(template)
+            entry["context_tokens_original"] += original_tokens
+            entry["context_tokens_compacted"] += compacted_tokens
+            if truncated:
+                entry["context_truncations"] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            result = {}
+            for template, entry in self._templates.items():
+                calls = entry["calls"]
+                original = entry["context_tokens_original"]
+                result[template] = {
+                    **entry,
+                    "avg_prompt_tokens": round(entry["prompt_tokens"] / calls, 1) if calls else 0,
+                    "avg_prompt_chars": round(entry["prompt_chars"] / calls, 1) if calls else 0,
+                    "context_reduction": (
+                        round(1 - entry["context_tokens_compacted"] / original, 3) if original else 0
+                    ),
+                }
+            return result
+
+    def reset(self):
+        with self._lock:
+            self._templates.clear()
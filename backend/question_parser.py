@@ -0,0 +1,102 @@
+import re
+from typing import List, Optional
+
+# ## 第1題（選擇題）；題型可省略
+_HEADING = re.compile(r"^#{2,4}\s*第\s*(\d+)\s*題\s*(?:[（(]\s*(.+?)\s*[）)])?")
+# A) 選項內容 / A. 選項內容 / A、選項內容
+_OPTION = re.compile(r"^\**([A-D])\**\s*[).）．.、:：]\s*(.+)")
+# **正確答案：** C / **答案：** 內容 / 正確答案：C
+_ANSWER = re.compile(r"^\**\s*(?:正確答案|答案)\s*\**\s*[：:]\s*\**\s*(.*)")
+# **詳細解析：** / **解析：**（冒號後可直接接內容）
+_EXPLANATION = re.compile(r"^\**\s*(?:詳細解析|解析)\s*\**\s*[：:]?\s*\**\s*(.*)")
+_ANSWER_LETTER = re.compile(r"^([A-D])(?![A-Za-z])")
+_SEPARATOR = re.compile(r"^(?:-{3,}|─{2,})$")
+
+
+def _new_question(number: str, question_type: Optional[str]) -> dict:
+    return {
+        "number": int(number),
+        "type": question_type or None,
+        "stem": [],
+        "options": [],
+        "answer": "",
+        "explanation": [],
+    }
+
+
+def _finalize(question: dict) -> dict:
+    answer = question["answer"].replace("**", "").strip()
+    letter = _ANSWER_LETTER.match(answer)
+    labels = {option["label"] for option in question["options"]}
+    answer_letter = letter.group(1) if letter else None
+    return {
+        "number": question["number"],
+        "type": question["type"],
+        "stem": "\n".join(question["stem"]).strip(),
+        "options": question["options"],
+        "answer": answer,
+        "answer_letter": answer_letter,
+        "multiple_choice": len(labels) >= 2 and answer_letter in labels,
+        "explanation": "\n".join(question["explanation"]).strip(),
+    }
+
+
+def parse_questions(markdown: Optional[str]) -> List[dict]:
+    """
+    將練習題 Markdown（提示詞規定的格式：## 第N題（題型）、A) 選項、**正確答案：**、**詳細解析：**、--- 分隔）
+    解析為結構化題目：number、type、stem、options（[{"label", "text"}]）、answer、answer_letter、
+    multiple_choice 與 explanation（詳細解析之後到分隔線前的所有內容，包含常見錯誤、技巧提示等段落）
+    不符合格式的內容（例如題目前的標題）會被略過
+    """
+    if not markdown:
+        return []
+
+    questions = []
+    current = None
+    in_explanation = False
+    for raw_line in markdown.splitlines():
+        line = raw_line.strip()
+
+        heading = _HEADING.match(line)
+        if heading:
+            if current:
+                questions.append(_finalize(current))
+            current = _new_question(heading.group(1), heading.group(2))
+            in_explanation = False
+            continue
+        if current is None:
+            continue
+
+        if _SEPARATOR.match(line):
+            questions.append(_finalize(current))
+            current = None
+            continue
+
+        if in_explanation:
+            # 解析保留原本的換行與縮排（公式區塊、表格）
+            current["explanation"].append(raw_line.rstrip())
+            continue
+
+        option = _OPTION.match(line)
+        if option and not current["answer"]:
+            current["options"].append({"label": option.group(1), "text": option.group(2).strip()})
+            continue
+
+        answer = _ANSWER.match(line)
+        if answer:
+            current["answer"] = answer.group(1)
+            continue
+
+        explanation = _EXPLANATION.match(line)
+        if explanation:
+            in_explanation = True
+            if explanation.group(1):
+                current["explanation"].append(explanation.group(1))
+            continue
+
+        if line and not line.startswith("#"):
+            current["stem"].append(line)
+
+    if current:
+        questions.append(_finalize(current))
+    return questions
@@ -0,0 +1,127 @@
+import json
+from datetime import datetime
+from typing import List, Optional
+
+from sqlalchemy import select, delete
+
+from models import Generation, Question
+from question_parser import parse_questions
+
+
+def question_rows(generation_id: int, chapter_number: Optional[int], markdown: Optional[str]) -> List[dict]:
+    """
+    解析練習題 Markdown，返回 questions 表的欄位值（供 ORM 與資料遷移共用）
+    """
+    now = datetime.utcnow()
+    return [
+        {
+            "generation_id": generation_id,
+            "chapter_number": chapter_number,
+            "position": position,
+            "number": parsed["number"],
+            "question_type": (parsed["type"] or "")[:50] or None,
+            "stem": parsed["stem"],
+            "options": json.dumps(parsed["options"], ensure_ascii=False) if parsed["options"] else None,
+            "answer": parsed["answer"] or None,
+            "answer_letter": parsed["answer_letter"],
+            "multiple_choice": parsed["multiple_choice"],
+            "explanation": parsed["explanation"] or None,
+            "created_at": now,
+        }
+        for position, parsed in enumerate(parse_questions(markdown))
+    ]
+
+
+def question_to_dict(question: Question, generation=None) -> dict:
+    """
+    題目記錄轉換為 API 格式；跨單元查詢時一併附上教材的科目、年級與單元
+    （generation 為教材，或只含 subject / grade / unit 欄位的查詢結果列）
+    """
+    item = {
+        "id": question.id,
+        "generation_id": question.generation_id,
+        "chapter_number": question.chapter_number,
+        "number": question.number,
+        "type": question.question_type,
+        "stem": question.stem,
+        "options": json.loads(question.options) if question.options else [],
+        "answer": question.answer,
+        "answer_letter": question.answer_letter,
+        "multiple_choice": question.multiple_choice,
+        "explanation": question.explanation,
+    }
+    if generation is not None:
+        item.update(subject=generation.subject, grade=generation.grade, unit=generation.unit)
+    return item
+
+
+def _scope(generation_id: int, chapter_number: Optional[int]):
+    if chapter_number is None:
+        return (Question.generation_id == generation_id, Question.chapter_number.is_(None))
+    return (Question.generation_id == generation_id, Question.chapter_number == chapter_number)
+
+
+async def replace_questions(db, generation_id: int, chapter_number: Optional[int], markdown: Optional[str]):
+    """
+    以新的練習題 Markdown 重建題目（chapter_number 為 None 表示整份教材的練習題）；呼叫端負責 commit
+    """
+    await db.execute(delete(Question).where(*_scope(generation_id, chapter_number)))
+    for values in question_rows(generation_id, chapter_number, markdown):
+        db.add(Question(**values))
+
+
+async def delete_chapter_questions(db, generation_id: int, chapter_numbers: Optional[List[int]] = None):
+    """
+    刪除指定章節的題目；chapter_numbers 為 None 時刪除所有章節的題目（保留整份教材的練習題）
+    呼叫端負責 commit
+    """
+    condition = [Question.generation_id == generation_id, Question.chapter_number.is_not(None)]
+    if chapter_numbers is not None:
+        if not chapter_numbers:
+            return
+        condition.append(Question.chapter_number.in_(chapter_numbers))
+    await db.execute(delete(Question).where(*condition))
+
+
+async def list_questions(db, generation_id: int, chapter_number: Optional[int] = None) -> List[Question]:
+    """
+    單一教材的題目，依章節（整份教材的練習題排在最後）與原始順序排列
+    """
+    query = select(Question).where(Question.generation_id == generation_id)
+    if chapter_number is not None:
+        query = query.where(Question.chapter_number == chapter_number)
+    query = query.order_by(
+        Question.chapter_number.is_(None), Question.chapter_number, Question.position
+    )
+    result = await db.execute(query)
+    return result.scalars().all()
+
+
+async def query_questions(db, subject: Optional[str] = None, grade: Optional[str] = None,
+                          question_type: Optional[str] = None, multiple_choice: Optional[bool] = None,
+                          cursor: Optional[int] = None, limit: int = 20):
+    """
+    跨單元查詢題目（例如八年級物理的所有選擇題），依 id 由新到舊以游標分頁
+    返回 (結果列的列表, 下一頁游標)；每列為題目（row.Question）與教材的 subject / grade / unit，
+    只讀取教材的這三個欄位，不載入（解壓縮）大綱與教材內容
+    """
+    query = (
+        select(Question, Generation.subject, Generation.grade, Generation.unit)
+        .join(Generation, Question.generation_id == Generation.id)
+    )
+    if subject:
+        query = query.where(Generation.subject == subject)
+    if grade:
+        query = query.where(Generation.grade == grade)
+    if question_type:
+        query = query.where(Question.question_type == question_type)
+    if multiple_choice is not None:
+        query = query.where(Question.multiple_choice == multiple_choice)
+    if cursor is not None:
+        query = query.where(Question.id < cursor)
+
+    # 多取一筆判斷是否還有下一頁
+    result = await db.execute(query.order_by(Question.id.desc()).limit(limit + 1))
+    rows = result.all()
+    next_cursor = rows[limit - 1].Question.id if len(rows) > limit else None
+    return rows[:limit], next_cursor
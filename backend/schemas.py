@@ -1,28 +1,73 @@
 from pydantic import BaseModel
 from datetime import datetime
-from typing import Optional, List, Dict
+from typing import Optional, List, Dict, Literal
+
+# 章節生成模式：separate 先生成內容再生成練習題（兩次呼叫）；
+# combined 以單次 JSON 模式呼叫同時生成，回應無法解析時自動改回 separate
+ChapterMode = Literal["separate", "combined"]
 
 class GenerateOutlineRequest(BaseModel):
     subject: str
     grade: str
     unit: str
+    # 為 True 時略過 LLM 快取，強制重新生成新的版本
+    fresh: bool = False
+    # 為 True 時若有相似度達門檻且教材已完成的既有記錄，直接沿用而不重新生成
+    reuse_similar: bool = False
+
+class GenerateUnitRequest(BaseModel):
+    subject: str
+    grade: str
+    unit: str
+    fresh: bool = False
+    chapter_mode: ChapterMode = "separate"
 
 class GenerateContentRequest(BaseModel):
     generation_id: int
-    outline: str
+    # 未提供時使用資料庫中的大綱；提供時視為覆寫
+    outline: Optional[str] = None
+    fresh: bool = False
+    chapter_mode: ChapterMode = "separate"
+
+class ContinueContentRequest(BaseModel):
+    generation_id: int
+    # 未提供時使用資料庫中的大綱
+    outline: Optional[str] = None
+    fresh: bool = False
+    chapter_mode: ChapterMode = "separate"
 
 class GenerateQuestionsRequest(BaseModel):
     generation_id: int
-    content: str
+    # 未提供時由資料庫中的章節組合教材
+    content: Optional[str] = None
+    fresh: bool = False
 
 class RegenerateChapterRequest(BaseModel):
     generation_id: int
     chapter_number: int
-    outline: str
+    # 未提供時使用資料庫中的大綱
+    outline: Optional[str] = None
+    # 重新生成章節的目的就是取得不同版本，預設不使用快取
+    fresh: bool = True
+    chapter_mode: ChapterMode = "separate"
+
+class SimilarGeneration(BaseModel):
+    generation_id: int
+    subject: str
+    grade: str
+    unit: str
+    # 單元名稱的餘弦相似度（0–1）
+    score: float
+    content_status: str
+    has_questions: bool
 
 class OutlineResponse(BaseModel):
     generation_id: int
     outline: str
+    # 為 True 時 generation_id 為沿用的既有記錄，教材與題目可直接由 /api/history/{id} 取得
+    reused: bool = False
+    # 相似的既有記錄（相似度由高到低）
+    similar: List[SimilarGeneration] = []
 
 class ContentResponse(BaseModel):
     generation_id: int
@@ -36,6 +81,89 @@ class RegenerateChapterResponse(BaseModel):
     generation_id: int
     chapter: dict
 
+class JobSubmitResponse(BaseModel):
+    job_id: int
+    generation_id: int
+    status: str
+
+class ChapterStatus(BaseModel):
+    chapter_number: int
+    title: Optional[str]
+    # pending / completed / failed
+    status: str
+    error: Optional[str] = None
+
+class JobStatusResponse(BaseModel):
+    job_id: int
+    generation_id: int
+    status: str
+    error: Optional[str]
+    total: int
+    completed: int
+    # 教材的章節狀態（與 /api/history/{id} 相同，來自 chapters 表）
+    chapters: List[ChapterStatus]
+    # 工作完成後才會提供完整教材內容
+    content: Optional[str] = None
+
+class BatchUnitInput(BaseModel):
+    subject: str
+    grade: str
+    unit: str
+
+class BatchSubmitRequest(BaseModel):
+    units: List[BatchUnitInput]
+    name: Optional[str] = None
+    # 為 True 時略過 LLM 快取，且不沿用先前批次已完成的相同單元
+    fresh: bool = False
+    chapter_mode: ChapterMode = "separate"
+
+class BatchUnitStatus(BaseModel):
+    id: int
+    subject: str
+    grade: str
+    unit: str
+    status: str
+    # 最後完成的階段：outline / content / questions
+    stage: Optional[str]
+    generation_id: Optional[int]
+    error: Optional[str]
+    attempts: int
+
+    class Config:
+        from_attributes = True
+
+class BatchStatusResponse(BaseModel):
+    batch_id: int
+    name: Optional[str]
+    status: str
+    total: int
+    # 提交時合併的重複單元數
+    duplicates: int
+    # 各狀態的單元數（pending / running / completed / failed / skipped）
+    counts: Dict[str, int]
+    units: List[BatchUnitStatus] = []
+
+class GenerationSummary(BaseModel):
+    """
+    歷史記錄列表用的摘要（不含大綱、教材與題目的完整內容）
+    """
+    id: int
+    subject: str
+    grade: str
+    unit: str
+    has_outline: bool
+    has_content: bool
+    has_questions: bool
+    created_at: datetime
+
+    class Config:
+        from_attributes = True
+
+class GenerationHistoryPage(BaseModel):
+    items: List[GenerationSummary]
+    # 下一頁的游標，沒有更多資料時為 None
+    next_cursor: Optional[str] = None
+
 class GenerationHistoryItem(BaseModel):
     id: int
     subject: str
@@ -45,9 +173,66 @@ class GenerationHistoryItem(BaseModel):
     content: Optional[str]
     questions: Optional[str]
     created_at: datetime
+    # 教材狀態：empty（尚未生成）/ partial（部分章節未完成）/ completed
+    content_status: str = "empty"
+    chapters: List[ChapterStatus] = []
 
     class Config:
         from_attributes = True
 
 
 
+
+class QuestionOption(BaseModel):
+    label: str
+    text: str
+
+class QuestionItem(BaseModel):
+    """
+    從練習題 Markdown 解析出的單一題目；chapter_number 為 None 表示整份教材的練習題
+    """
+    id: int
+    generation_id: int
+    chapter_number: Optional[int]
+    number: Optional[int]
+    type: Optional[str]
+    stem: str
+    options: List[QuestionOption] = []
+    answer: Optional[str]
+    # 選擇題的正確選項（A–D）
+    answer_letter: Optional[str]
+    multiple_choice: bool
+    explanation: Optional[str]
+    # 跨單元查詢時附上所屬教材
+    subject: Optional[str] = None
+    grade: Optional[str] = None
+    unit: Optional[str] = None
+
+class GenerationQuestions(BaseModel):
+    generation_id: int
+    questions: List[QuestionItem]
+
+class QuestionPage(BaseModel):
+    items: List[QuestionItem]
+    # 下一頁的游標（上一頁最後一題的 id），沒有更多資料時為 None
+    next_cursor: Optional[int] = None
+
+class SearchHit(BaseModel):
+    generation_id: int
+    subject: str
+    grade: str
+    unit: str
+    # 符合的內容：outline / chapter / questions（整份教材的練習題）/ content（未拆分章節的教材）
+    kind: str
+    chapter_number: Optional[int] = None
+    title: Optional[str] = None
+    # 原文片段與其中符合查詢的位置（[起, 迄) 字元位置）
+    snippet: str
+    highlights: List[List[int]] = []
+    # 相關度（越大越相關）
+    score: float
+
+class SearchPage(BaseModel):
+    items: List[SearchHit]
+    # 下一頁的 offset，沒有更多結果時為 None
+    next_offset: Optional[int] = None
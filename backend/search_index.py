@@ -0,0 +1,365 @@
+import json
+import re
+from typing import Iterable, List, Optional, Tuple
+
+from sqlalchemy import text
+
+from text_compression import decode_text
+
+# 每筆生成記錄在全文索引中佔用的 rowid 範圍：generation_id * ROWS_PER_GENERATION + slot
+# slot 0 為大綱、1 為整份教材的練習題、2 為備用方法生成的 Markdown 教材、3 之後為各章節
+ROWS_PER_GENERATION = 1000
+SLOT_OUTLINE = 0
+SLOT_QUESTIONS = 1
+SLOT_CONTENT = 2
+_CHAPTER_SLOT_BASE = 2
+MAX_CHAPTER_NUMBER = ROWS_PER_GENERATION - _CHAPTER_SLOT_BASE - 1
+
+# title 欄位（大綱與章節標題）在排序時的權重高於內文
+TITLE_WEIGHT = 5.0
+
+# 中日韓統一表意文字（含擴充 A 區與相容表意文字）
+_CJK = "\u3400-\u9fff\uf900-\ufaff"
+# 連續的中日韓文字 / 其他文字與數字組成的詞
+_SEGMENT = re.compile(rf"([{_CJK}]+)|([^\W{_CJK}]+)")
+
+_state = {"enabled": False}
+
+
+def search_enabled() -> bool:
+    """
+    全文索引只支援 SQLite FTS5；由 ensure_search_index（或 check_search_index）在啟動時決定
+    """
+    return _state["enabled"]
+
+
+def segment(value: Optional[str], query: bool = False) -> str:
+    """
+    將文字轉為 FTS5 unicode61 斷詞器可處理的格式：中文連續字串改為重疊的二字組，其他文字維持原本的詞
+    索引時每段中文額外加上最後一個字，單字查詢（以前綴比對二字組）也能找到位於結尾的字
+    例如「速率與速度」→「速率 率與 與速 速度 度」
+    """
+    if not value:
+        return ""
+    tokens = []
+    for cjk, word in _SEGMENT.findall(value):
+        if word:
+            tokens.append(word)
+        elif len(cjk) == 1:
+            tokens.append(cjk)
+        else:
+            tokens.extend(cjk[i:i + 2] for i in range(len(cjk) - 1))
+            if not query:
+                tokens.append(cjk[-1])
+    return " ".join(tokens)
+
+
+def build_match_query(query: str) -> Optional[str]:
+    """
+    將使用者輸入轉為 FTS5 查詢：以空白分隔的每個詞轉為二字組片語（片語內的二字組必須相鄰，
+    等同子字串比對），所有詞都必須出現；單一中文字以前綴比對
+    沒有可搜尋的字元時返回 None
+    """
+    terms = []
+    for term in query.split():
+        tokens = segment(term, query=True).split()
+        if not tokens:
+            continue
+        phrase = '"' + " ".join(token.replace('"', '""') for token in tokens) + '"'
+        if len(tokens) == 1 and len(tokens[0]) == 1 and re.match(f"[{_CJK}]", tokens[0]):
+            phrase += "*"
+        terms.append(phrase)
+    return " AND ".join(terms) if terms else None
+
+
+def _outline_document(unit: str, outline: Optional[str]) -> Tuple[str, str]:
+    """
+    大綱的索引內容：標題為單元名稱與大綱標題，內文為學習目標與各章節標題、描述、主題
+    """
+    try:
+        data = json.loads(outline)
+    except (TypeError, json.JSONDecodeError):
+        return unit, outline or ""
+    if not isinstance(data, dict):
+        return unit, outline or ""
+    title = " ".join(value for value in (unit, data.get("title")) if isinstance(value, str))
+    lines = [str(objective) for objective in data.get("objectives") or []]
+    for chapter in data.get("chapters") or []:
+        if not isinstance(chapter, dict):
+            continue
+        lines.append(str(chapter.get("title") or ""))
+        lines.append(str(chapter.get("description") or ""))
+        lines.extend(str(topic) for topic in chapter.get("topics") or [])
+    return title, "\n".join(line for line in lines if line)
+
+
+def _chapter_body(content: Optional[str], questions: Optional[str]) -> str:
+    return "\n\n".join(value for value in (content, questions) if value)
+
+
+def _rowid(generation_id: int, slot: int) -> int:
+    return generation_id * ROWS_PER_GENERATION + slot
+
+
+def _chapter_slot(chapter_number) -> Optional[int]:
+    if not isinstance(chapter_number, int) or not 1 <= chapter_number <= MAX_CHAPTER_NUMBER:
+        return None
+    return _CHAPTER_SLOT_BASE + chapter_number
+
+
+_DELETE = text("DELETE FROM search_index WHERE rowid = :rowid")
+_DELETE_RANGE = text("DELETE FROM search_index WHERE rowid BETWEEN :start AND :end")
+_INSERT = text("INSERT INTO search_index (rowid, title, body) VALUES (:rowid, :title, :body)")
+
+
+def _row(generation_id: int, slot: int, title: Optional[str], body: Optional[str]) -> Optional[dict]:
+    title, body = segment(title), segment(body)
+    if not title and not body:
+        return None
+    return {"rowid": _rowid(generation_id, slot), "title": title, "body": body}
+
+
+async def _replace(db, generation_id: int, slot: Optional[int], title: Optional[str], body: Optional[str]):
+    if not search_enabled() or slot is None:
+        return
+    await db.execute(_DELETE, {"rowid": _rowid(generation_id, slot)})
+    row = _row(generation_id, slot, title, body)
+    if row:
+        await db.execute(_INSERT, row)
+
+
+async def index_outline(db, generation_id: int, unit: str, outline: Optional[str]):
+    """
+    以下索引函式與資料寫入在同一個交易中執行；呼叫端負責 commit
+    """
+    await _replace(db, generation_id, SLOT_OUTLINE, *_outline_document(unit, outline))
+
+
+async def index_unit_questions(db, generation_id: int, questions: Optional[str]):
+    await _replace(db, generation_id, SLOT_QUESTIONS, None, questions)
+
+
+async def index_unit_content(db, generation_id: int, content: Optional[str]):
+    """
+    備用方法生成的 Markdown 教材（未拆分章節）；content 為 None 時移除
+    """
+    await _replace(db, generation_id, SLOT_CONTENT, None, content)
+
+
+async def index_chapter(db, generation_id: int, entry: dict):
+    await _replace(
+        db, generation_id, _chapter_slot(entry.get("chapter_number")),
+        entry.get("title"), _chapter_body(entry.get("content"), entry.get("questions"))
+    )
+
+
+async def remove_chapters(db, generation_id: int, chapter_numbers: Iterable[int]):
+    if not search_enabled():
+        return
+    for number in chapter_numbers:
+        slot = _chapter_slot(number)
+        if slot is not None:
+            await db.execute(_DELETE, {"rowid": _rowid(generation_id, slot)})
+
+
+async def remove_generation(db, generation_id: int):
+    if search_enabled():
+        await db.execute(_DELETE_RANGE, {
+            "start": _rowid(generation_id, 0),
+            "end": _rowid(generation_id, ROWS_PER_GENERATION - 1),
+        })
+
+
+def ensure_search_index(conn, batch_size: int = 500):
+    """
+    建立 FTS5 全文索引（search_index 虛擬資料表），第一次建立時由既有資料建立索引
+    在遷移的交易中執行（呼叫端負責 commit）；非 SQLite 或 SQLite 未編譯 FTS5 時停用全文搜尋
+    """
+    if conn.dialect.name != "sqlite":
+        return
+    if _index_exists(conn):
+        _state["enabled"] = True
+        return
+    try:
+        conn.execute(text(
+            "CREATE VIRTUAL TABLE search_index USING fts5("
+            "title, body, tokenize = 'unicode61 remove_diacritics 2')"
+        ))
+    except Exception as e:
+        print(f"無法建立全文索引，停用全文搜尋：{e}")
+        return
+    _backfill(conn, batch_size)
+    _state["enabled"] = True
+    print("已建立全文索引")
+
+
+def check_search_index(engine):
+    """
+    啟動時不執行遷移（MIGRATE_ON_STARTUP=false）時，依已建立的全文索引決定是否啟用全文搜尋
+    """
+    if engine.dialect.name != "sqlite":
+        return
+    with engine.connect() as conn:
+        _state["enabled"] = _index_exists(conn)
+
+
+def _index_exists(conn) -> bool:
+    return conn.execute(text(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'search_index'"
+    )).first() is not None
+
+
+def _backfill(conn, batch_size: int):
+    """
+    依 id 分批讀取既有的大綱、練習題與章節，避免一次載入全部內容（原始 SQL 讀取，壓縮的欄位需自行解壓縮）
+    """
+    def batches(sql: str):
+        last_id = 0
+        while True:
+            rows = conn.execute(text(sql), {"last_id": last_id, "limit": batch_size}).fetchall()
+            if not rows:
+                return
+            yield rows
+            last_id = rows[-1][0]
+
+    for rows in batches(
+        "SELECT id, unit, outline, questions, content FROM generations "
+        "WHERE id > :last_id ORDER BY id LIMIT :limit"
+    ):
+        params = []
+        for generation_id, unit, outline, questions, content in rows:
+            outline, questions, content = (decode_text(value) for value in (outline, questions, content))
+            params.append(_row(generation_id, SLOT_OUTLINE, *_outline_document(unit, outline)))
+            params.append(_row(generation_id, SLOT_QUESTIONS, None, questions))
+            if not _is_content_header(content):
+                params.append(_row(generation_id, SLOT_CONTENT, None, content))
+        params = [row for row in params if row]
+        if params:
+            conn.execute(_INSERT, params)
+
+    for rows in batches(
+        "SELECT id, generation_id, chapter_number, title, content, questions FROM chapters "
+        "WHERE id > :last_id ORDER BY id LIMIT :limit"
+    ):
+        params = []
+        for _, generation_id, number, title, content, questions in rows:
+            content, questions = decode_text(content), decode_text(questions)
+            slot = _chapter_slot(number)
+            if slot is not None:
+                params.append(_row(generation_id, slot, title, _chapter_body(content, questions)))
+        params = [row for row in params if row]
+        if params:
+            conn.execute(_INSERT, params)
+
+
+def _is_content_header(content: Optional[str]) -> bool:
+    """
+    結構化教材的 generation.content 只有單元標頭，內容在章節中，不另外索引
+    """
+    try:
+        return isinstance(json.loads(content), dict)
+    except (TypeError, json.JSONDecodeError):
+        return content is None
+
+
+def _snippet(source: str, terms: List[str], before: int = 40, length: int = 160) -> Tuple[str, List[List[int]]]:
+    """
+    在原始文字中找出第一個符合的詞，取其前後的片段；返回 (片段, 片段中各符合位置的 [起, 迄])
+    """
+    source = " ".join(source.split())
+    lowered = source.lower()
+    positions = [lowered.find(term) for term in terms]
+    positions = [position for position in positions if position >= 0]
+    start = max(0, min(positions) - before) if positions else 0
+    end = min(len(source), start + length)
+    snippet = source[start:end]
+
+    window = lowered[start:end]
+    highlights = []
+    for term in terms:
+        offset = window.find(term)
+        while offset >= 0:
+            highlights.append([offset, offset + len(term)])
+            offset = window.find(term, offset + len(term))
+    highlights.sort()
+
+    prefix = "…" if start > 0 else ""
+    suffix = "…" if end < len(source) else ""
+    shift = len(prefix)
+    return prefix + snippet + suffix, [[a + shift, b + shift] for a, b in highlights]
+
+
+async def search(db, query: str, subject: Optional[str] = None, grade: Optional[str] = None,
+                 limit: int = 20, offset: int = 0) -> Tuple[List[dict], Optional[int]]:
+    """
+    全文搜尋大綱、章節內容與練習題，依 BM25（標題權重較高）排序
+    返回 (結果列表, 下一頁的 offset)；片段由原始文字產生
+    """
+    match = build_match_query(query)
+    if match is None:
+        return [], None
+
+    sql = (
+        f"SELECT s.rowid AS rowid, bm25(search_index, {TITLE_WEIGHT}, 1.0) AS rank, "
+        "g.id AS generation_id, g.subject, g.grade, g.unit "
+        "FROM search_index s JOIN generations g ON g.id = s.rowid / :rows_per_generation "
+        "WHERE search_index MATCH :match"
+    )
+    params = {"match": match, "rows_per_generation": ROWS_PER_GENERATION,
+              "limit": limit + 1, "offset": offset}
+    if subject:
+        sql += " AND g.subject = :subject"
+        params["subject"] = subject
+    if grade:
+        sql += " AND g.grade = :grade"
+        params["grade"] = grade
+    sql += " ORDER BY rank LIMIT :limit OFFSET :offset"
+    rows = (await db.execute(text(sql), params)).mappings().all()
+    next_offset = offset + limit if len(rows) > limit else None
+
+    terms = [term.lower() for term in query.split()]
+    results = []
+    for row in rows[:limit]:
+        slot = row["rowid"] % ROWS_PER_GENERATION
+        title, source, kind, chapter_number = await _source(db, row["generation_id"], slot, row["unit"])
+        snippet, highlights = _snippet(source, terms)
+        results.append({
+            "generation_id": row["generation_id"],
+            "subject": row["subject"],
+            "grade": row["grade"],
+            "unit": row["unit"],
+            "kind": kind,
+            "chapter_number": chapter_number,
+            "title": title,
+            "snippet": snippet,
+            "highlights": highlights,
+            # bm25 越小越相關，轉為越大越相關
+            "score": round(-row["rank"], 6),
+        })
+    return results, next_offset
+
+
+async def _source(db, generation_id: int, slot: int, unit: str):
+    """
+    讀取搜尋結果的原始文字：返回 (標題, 內文, 類型, 章節編號)
+    """
+    if slot >= _CHAPTER_SLOT_BASE + 1:
+        number = slot - _CHAPTER_SLOT_BASE
+        row = (await db.execute(
+            text("SELECT title, content, questions FROM chapters "
+                 "WHERE generation_id = :generation_id AND chapter_number = :number"),
+            {"generation_id": generation_id, "number": number},
+        )).first()
+        if row is None:
+            return None, "", "chapter", number
+        return (row.title, _chapter_body(decode_text(row.content), decode_text(row.questions)),
+                "chapter", number)
+
+    column = {SLOT_OUTLINE: "outline", SLOT_QUESTIONS: "questions", SLOT_CONTENT: "content"}[slot]
+    value = decode_text((await db.execute(
+        text(f"SELECT {column} FROM generations WHERE id = :id"), {"id": generation_id}
+    )).scalar())
+    if slot == SLOT_OUTLINE:
+        title, body = _outline_document(unit, value)
+        return title, f"{title}\n{body}", "outline", None
+    return None, value or "", column, None
@@ -0,0 +1,237 @@
+import json
+import re
+import unicodedata
+import zlib
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import select
+from sqlalchemy.orm import load_only
+
+from config import settings
+from models import Generation, Chapter
+from chapter_store import content_status
+
+# 中文連續字串與英文單字分開切割；中文取單字與二字組，英文取單字本身與前後加空白的三字組
+_TOKEN = re.compile(r"[\u3400-\u9fff\uf900-\ufaff]+|[^\W\u3400-\u9fff\uf900-\ufaff]+")
+# 連接詞不影響單元內容（「速率與速度」與「速度和速率」相同）
+_CONNECTORS = re.compile(r"[與和及跟的]|\b(?:and|of|the|vs)\b")
+
+# refresh 往前多讀取的時間：建立時間較早但較晚 commit 的記錄也能載入
+REFRESH_LOOKBACK = timedelta(seconds=60)
+
+
+def _normalize(text: str) -> str:
+    """
+    全形轉半形、忽略大小寫，標點與符號視為空白（「速率與速度」與「速率、速度」相同）
+    """
+    text = unicodedata.normalize("NFKC", text or "").casefold()
+    chars = [c if c.isalnum() else " " for c in text]
+    return " ".join("".join(chars).split())
+
+
+def _bucket(subject: str, grade: str) -> str:
+    # 只在相同科目與年級中比對，不同年級的同名單元內容深度不同
+    return "|".join(" ".join((value or "").split()).casefold() for value in (subject, grade))
+
+
+def _ngrams(text: str) -> List[str]:
+    """
+    字元 n-gram（不跨詞）：詞序不同的相同單元得到相同的特徵
+    """
+    grams = []
+    for token in _TOKEN.findall(_CONNECTORS.sub(" ", _normalize(text))):
+        if token.isascii():
+            padded = f" {token} "
+            grams.append(token)
+            grams.extend(padded[i:i + 3] for i in range(len(padded) - 2))
+        else:
+            grams.extend(token)
+            grams.extend(token[i:i + 2] for i in range(len(token) - 1))
+    return grams
+
+
+def _outline_title(outline: Optional[str]) -> Optional[str]:
+    try:
+        data = json.loads(outline)
+    except (TypeError, json.JSONDecodeError):
+        return None
+    title = data.get("title") if isinstance(data, dict) else None
+    return title if isinstance(title, str) and title.strip() else None
+
+
+class SimilarityIndex:
+    """
+    (科目, 年級, 單元) 的本機相似度索引：字元 n-gram TF-IDF 與餘弦相似度，不需外部服務
+    n-gram 以雜湊映射到固定維度（feature hashing），每筆文件一列存放 tf（次線性）向量；
+    IDF 隨文件增減即時維護，查詢時只對同科目、年級的列以 NumPy 向量化計算
+    每筆生成記錄以單元名稱與大綱標題各建立一列，分數取兩者的最大值
+    """
+
+    def __init__(self, dim: int = None):
+        self.dim = dim or settings.SIMILARITY_DIM
+        self._tf = np.zeros((64, self.dim), dtype=np.float32)
+        self._buckets = np.full(64, -1, dtype=np.int64)
+        self._generation_ids = np.full(64, -1, dtype=np.int64)
+        self._size = 0
+        # 各維度出現在幾筆文件中（計算 IDF）
+        self._df = np.zeros(self.dim, dtype=np.float64)
+        self._documents = 0
+        self._bucket_codes: Dict[str, int] = {}
+        self._rows: Dict[int, List[int]] = {}
+        # 已載入的最新建立時間，refresh 從這裡繼續
+        self.last_created_at: Optional[datetime] = None
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def __contains__(self, generation_id: int) -> bool:
+        return generation_id in self._rows
+
+    def _vector(self, text: str) -> np.ndarray:
+        vector = np.zeros(self.dim, dtype=np.float32)
+        grams = _ngrams(text)
+        if not grams:
+            return vector
+        indexes = np.fromiter(
+            (zlib.crc32(gram.encode("utf-8")) % self.dim for gram in grams),
+            dtype=np.int64, count=len(grams)
+        )
+        np.add.at(vector, indexes, 1.0)
+        # 次線性 tf，避免重複字元主導分數
+        np.log1p(vector, out=vector)
+        return vector
+
+    def _append(self, bucket: int, generation_id: int, vector: np.ndarray) -> int:
+        if self._size == len(self._buckets):
+            capacity = len(self._buckets) * 2
+            self._tf = np.resize(self._tf, (capacity, self.dim))
+            self._buckets = np.resize(self._buckets, capacity)
+            self._generation_ids = np.resize(self._generation_ids, capacity)
+        row = self._size
+        self._tf[row] = vector
+        self._buckets[row] = bucket
+        self._generation_ids[row] = generation_id
+        self._size += 1
+        return row
+
+    def add(self, generation_id: int, subject: str, grade: str, unit: str, outline: Optional[str] = None):
+        """
+        加入（或取代）一筆生成記錄
+        """
+        self.remove(generation_id)
+        key = _bucket(subject, grade)
+        bucket = self._bucket_codes.setdefault(key, len(self._bucket_codes))
+        texts = [unit]
+        title = _outline_title(outline)
+        if title and _normalize(title) != _normalize(unit):
+            texts.append(title)
+
+        rows = []
+        for text in texts:
+            vector = self._vector(text)
+            if not vector.any():
+                continue
+            rows.append(self._append(bucket, generation_id, vector))
+            self._df += vector > 0
+            self._documents += 1
+        self._rows[generation_id] = rows
+
+    def remove(self, generation_id: int):
+        for row in self._rows.pop(generation_id, []):
+            self._df -= self._tf[row] > 0
+            self._documents -= 1
+            self._tf[row] = 0
+            self._buckets[row] = -1
+            self._generation_ids[row] = -1
+
+    def search(self, subject: str, grade: str, unit: str, limit: int = 5,
+               min_score: float = 0.0) -> List[Tuple[int, float]]:
+        """
+        返回同科目、年級中最相似的生成記錄 [(generation_id, 餘弦相似度)]，依分數由高到低
+        """
+        bucket = self._bucket_codes.get(_bucket(subject, grade))
+        query = self._vector(unit)
+        if bucket is None or not query.any():
+            return []
+        rows = np.flatnonzero(self._buckets[:self._size] == bucket)
+        if rows.size == 0:
+            return []
+
+        # 平滑 IDF：log((1 + N) / (1 + df)) + 1
+        idf = (np.log((1.0 + self._documents) / (1.0 + self._df)) + 1.0).astype(np.float32)
+        matrix = self._tf[rows] * idf
+        query = query * idf
+        norms = np.linalg.norm(matrix, axis=1) * np.linalg.norm(query)
+        scores = (matrix @ query) / np.maximum(norms, 1e-12)
+
+        best: Dict[int, float] = {}
+        for i in np.flatnonzero(scores >= min_score):
+            generation_id = int(self._generation_ids[rows[i]])
+            best[generation_id] = max(best.get(generation_id, 0.0), float(scores[i]))
+        return sorted(best.items(), key=lambda item: item[1], reverse=True)[:limit]
+
+    async def refresh(self, db):
+        """
+        載入上次之後建立的生成記錄（包含其他 worker 或批次工作建立的記錄）
+        第一次呼叫時載入全部記錄，之後只讀取最近建立的列（已載入的略過）
+        """
+        query = select(
+            Generation.id, Generation.subject, Generation.grade, Generation.unit,
+            Generation.outline, Generation.created_at
+        ).where(Generation.outline.isnot(None))
+        if self.last_created_at is not None:
+            query = query.where(Generation.created_at >= self.last_created_at - REFRESH_LOOKBACK)
+        result = await db.execute(query.order_by(Generation.created_at, Generation.id))
+        for row in result:
+            if row.id not in self._rows:
+                self.add(row.id, row.subject, row.grade, row.unit, row.outline)
+            if self.last_created_at is None or row.created_at > self.last_created_at:
+                self.last_created_at = row.created_at
+
+
+async def find_similar(index: SimilarityIndex, db, subject: str, grade: str, unit: str,
+                       limit: int = 5, min_score: float = None) -> List[dict]:
+    """
+    查詢相似的既有生成記錄，並附上各記錄目前的教材狀態
+    已被刪除（例如由其他 worker 刪除）的記錄會從索引移除
+    """
+    if min_score is None:
+        min_score = settings.SIMILARITY_SUGGEST_THRESHOLD
+    await index.refresh(db)
+    hits = index.search(subject, grade, unit, limit=limit, min_score=min_score)
+    if not hits:
+        return []
+
+    ids = [generation_id for generation_id, _ in hits]
+    result = await db.execute(
+        select(Generation, Generation.questions.isnot(None))
+        .options(load_only(Generation.id, Generation.subject, Generation.grade,
+                           Generation.unit, Generation.content))
+        .where(Generation.id.in_(ids))
+    )
+    generations = {generation.id: (generation, has_questions) for generation, has_questions in result}
+    chapters: Dict[int, list] = {}
+    result = await db.execute(
+        select(Chapter.generation_id, Chapter.status).where(Chapter.generation_id.in_(ids))
+    )
+    for row in result:
+        chapters.setdefault(row.generation_id, []).append(row)
+
+    similar = []
+    for generation_id, score in hits:
+        if generation_id not in generations:
+            index.remove(generation_id)
+            continue
+        generation, has_questions = generations[generation_id]
+        similar.append({
+            "generation_id": generation_id,
+            "subject": generation.subject,
+            "grade": generation.grade,
+            "unit": generation.unit,
+            "score": round(score, 4),
+            "content_status": content_status(generation, chapters.get(generation_id, [])),
+            "has_questions": has_questions,
+        })
+    return similar
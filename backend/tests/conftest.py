@@ -0,0 +1,8 @@
+import os
+import sys
+
+# 測試不使用磁碟上的 LLM 快取（需在匯入 config 之前設定）
+os.environ["LLM_CACHE_ENABLED"] = "false"
+
+# 與應用程式相同，以 backend 目錄為模組搜尋路徑
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
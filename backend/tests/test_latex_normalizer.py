@@ -0,0 +1,95 @@
+import random
+
+import pytest
+
+from benchmarks.latex_benchmark import legacy_fix_latex_brackets, typical_chapter, worst_cases
+from latex_normalizer import LatexStreamNormalizer, normalize_latex
+
+# (名稱, 輸入, 預期輸出)
+CORPUS = [
+    ("方括號公式", "面積為 [ \\frac{1}{2} \\times 3 ]。", "面積為 $\\frac{1}{2} \\times 3$。"),
+    ("Markdown 連結", "請見 [說明](https://example.com)。", "請見 [說明](https://example.com)。"),
+    ("陣列", "a = [1, 2, 3]", "a = [1, 2, 3]"),
+    ("巢狀方括號", "[[\\alpha]]", "[$\\alpha$]"),
+    ("行內公式", "\\( x^2 \\) 與 \\(y\\)", "$x^2$ 與 $y$"),
+    ("行內公式結尾在下一行", "\\( a \n\\) b", "$a$ b"),
+    ("行內公式跨行", "\\( a \n b \\)", "\\( a \n b \\)"),
+    ("展示公式", "\\[\n a + b \n\\]", "$$a + b$$"),
+    ("展示公式含方括號", "\\[ f[\\alpha] \\]", "$$f[\\alpha]$$"),
+    ("未閉合", "[\\alpha \\( x \\[ y", "[\\alpha \\( x \\[ y"),
+    ("空的公式", "\\(\\) \\[ \\]", "\\(\\) \\[ \\]"),
+    ("無公式", "一般的教材內容，沒有任何公式。", "一般的教材內容，沒有任何公式。"),
+    ("方括號內的展示公式", "[\\[ x \\]]", "[$$x$$]"),
+    ("方括號公式與行內公式", "[\\alpha] 與 \\( x \\)", "$\\alpha$ 與 $x$"),
+]
+
+# 巢狀或混用符號時與舊版結果不同的輸入：(名稱, 輸入, 預期輸出, 舊版輸出)
+# 舊版依序執行三次 re.sub，已轉換的公式會再被下一次替換包一層；目前的實作不轉換公式內的符號，
+# 含 \\( 的方括號保留為一般文字（單位、區間），只轉換內層的公式
+LEGACY_DIFFERENCES = [
+    ("方括號內的行內公式", "[\\( \\text{m} \\)]", "[$\\text{m}$]", "$$\\text{m}$$"),
+    ("單位與行內公式", "單位為 [\\( \\text{km/h} \\)]，速度 \\(v\\)",
+     "單位為 [$\\text{km/h}$]，速度 $v$", "單位為 $$\\text{km/h}$$，速度 $v$"),
+    ("區間", "[\\(\\alpha\\), \\(\\beta\\)]", "[$\\alpha$, $\\beta$]", "$$\\alpha$, $\\beta$$"),
+    ("行內公式內的方括號", "\\( [\\alpha] \\)", "$[\\alpha]$", "$$\\alpha$$"),
+    ("展示公式內的方括號", "\\[ [\\alpha] + [\\beta] \\]", "$$[\\alpha] + [\\beta]$$",
+     "$$$\\alpha$ + $\\beta$$$"),
+    ("展示公式含指令", "\\[ x \\alpha \\]", "$$x \\alpha$$", "\\$x \\alpha \\$"),
+]
+
+
+def _stream(text: str, rng: random.Random) -> str:
+    normalizer = LatexStreamNormalizer()
+    out = []
+    i = 0
+    while i < len(text):
+        step = rng.randint(1, 8)
+        out.append(normalizer.feed(text[i:i + step]))
+        i += step
+    out.append(normalizer.flush())
+    return "".join(out)
+
+
+@pytest.mark.parametrize("name,text,expected", CORPUS, ids=[c[0] for c in CORPUS])
+def test_corpus(name, text, expected):
+    assert normalize_latex(text) == expected
+
+
+@pytest.mark.parametrize("name,text,expected,legacy", LEGACY_DIFFERENCES,
+                         ids=[c[0] for c in LEGACY_DIFFERENCES])
+def test_legacy_differences(name, text, expected, legacy):
+    assert normalize_latex(text) == expected
+    # 記錄的舊版輸出需與舊版實作一致，確保差異說明正確
+    assert legacy_fix_latex_brackets(text) == legacy
+
+
+def test_worst_cases_unchanged():
+    # 不含指令的最壞情況輸入不應被修改
+    for name, text in worst_cases(200).items():
+        if "\\alpha" not in text and "\\a" not in text:
+            assert normalize_latex(text) == text, name
+
+
+def test_stream_matches_normalize_latex():
+    rng = random.Random(0)
+    texts = [text for _, text, _ in CORPUS] + [text for _, text, _, _ in LEGACY_DIFFERENCES]
+    texts.append(typical_chapter())
+    texts += list(worst_cases(200).values())
+    for text in texts:
+        assert _stream(text, rng) == normalize_latex(text)
+
+
+def test_stream_matches_normalize_latex_on_random_input():
+    rng = random.Random(0)
+    alphabet = ["[", "]", "\\(", "\\)", "\\[", "\\]", "\\frac", "\\alpha", " ", "\n", "x", "(", ")", "\\", "文"]
+    for _ in range(5000):
+        text = "".join(rng.choice(alphabet) for _ in range(rng.randint(0, 40)))
+        assert _stream(text, rng) == normalize_latex(text), text
+
+
+def test_stream_single_characters():
+    # 逐字輸入時，跨越多個 token 的起始與結尾符號也需正確處理
+    for _, text, expected in CORPUS:
+        normalizer = LatexStreamNormalizer()
+        out = "".join(normalizer.feed(ch) for ch in text) + normalizer.flush()
+        assert out == expected
@@ -0,0 +1,229 @@
+import asyncio
+import json
+
+import pytest
+
+from gemini_service import GeminiService
+from groq_service import AsyncGroqService
+from llm_providers import ChatResult, ChatUsage, LLMProvider, ProviderRouter
+from outline_schema import Outline, dump_outline
+
+OUTLINE = {
+    "title": "速率",
+    "objectives": ["理解速率的意義", "能計算平均速率"],
+    "chapters": [
+        {
+            "chapter_number": i,
+            "title": f"第{i}個主題",
+            "topics": [f"主題{i}-1", f"主題{i}-2"],
+            "description": f"介紹第{i}個主題",
+        }
+        for i in (1, 2, 3)
+    ],
+}
+
+CONTENT = "## 概念說明\n速率的公式為 [ v = \\frac{d}{t} ]，例如 \\( 30 \\div 2 = 15 \\)。\n"
+QUESTIONS = "## 第1題（選擇題）\n以 \\( 5\\text{ m/s} \\) 跑步 10 秒的距離為何？\n"
+
+
+class FakeProvider(LLMProvider):
+    """
+    不呼叫 API 的供應商：依設定的延遲返回固定文字，可指定失敗或在串流途中失敗
+    """
+
+    def __init__(self, name: str, latency: float = 0.0, fail: bool = False,
+                 fail_after_chunks: int = None, reply: str = "ok"):
+        self.name = name
+        self.model = f"{name}-model"
+        self.latency = latency
+        self.fail = fail
+        self.fail_after_chunks = fail_after_chunks
+        self.reply = reply
+        self.calls = 0
+
+    async def complete(self, messages: list, max_tokens: int, temperature: float = 0.7,
+                       json_mode: bool = False) -> ChatResult:
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        if self.fail:
+            raise RuntimeError(f"{self.name} 失敗")
+        return ChatResult(self.reply, ChatUsage(10, 5, 15))
+
+    async def stream(self, messages: list, max_tokens: int, temperature: float = 0.7,
+                     json_mode: bool = False):
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        if self.fail:
+            raise RuntimeError(f"{self.name} 失敗")
+        for index, chunk in enumerate(self.reply.split(" ")):
+            if self.fail_after_chunks is not None and index >= self.fail_after_chunks:
+                raise RuntimeError(f"{self.name} 串流中斷")
+            yield chunk + " ", None
+        yield "", ChatUsage(10, 5, 15)
+
+
+class ScriptedProvider(LLMProvider):
+    """
+    依提示詞返回大綱、章節內容或練習題；fenced 為 True 時 JSON 回應包在 ``` 中（模擬不同模型的輸出習慣）
+    """
+
+    def __init__(self, name: str, fenced: bool = False):
+        self.name = name
+        self.model = f"{name}-model"
+        self.fenced = fenced
+
+    def _reply(self, prompt: str, json_mode: bool) -> str:
+        if json_mode:
+            if '"content"' in prompt:
+                text = json.dumps({"content": CONTENT, "questions": QUESTIONS}, ensure_ascii=False)
+            else:
+                text = json.dumps(OUTLINE, ensure_ascii=False)
+            return f"```json\n{text}\n```" if self.fenced else text
+        return QUESTIONS if "題目設計師" in prompt else CONTENT
+
+    async def complete(self, messages: list, max_tokens: int, temperature: float = 0.7,
+                       json_mode: bool = False) -> ChatResult:
+        return ChatResult(self._reply(messages[-1]["content"], json_mode), ChatUsage(10, 5, 15))
+
+    async def stream(self, messages: list, max_tokens: int, temperature: float = 0.7,
+                     json_mode: bool = False):
+        text = self._reply(messages[-1]["content"], json_mode)
+        for start in range(0, len(text), 7):
+            yield text[start:start + 7], None
+        yield "", ChatUsage(10, 5, 15)
+
+
+def _router(*providers, **kwargs) -> ProviderRouter:
+    kwargs.setdefault("window", 20)
+    kwargs.setdefault("window_seconds", 300)
+    kwargs.setdefault("max_error_rate", 0.5)
+    kwargs.setdefault("attempt_timeout", 5)
+    return ProviderRouter(list(providers), **kwargs)
+
+
+async def _collect(router: ProviderRouter) -> str:
+    parts = []
+    async for delta, _ in router.stream([{"role": "user", "content": "hi"}], 100):
+        parts.append(delta)
+    return "".join(parts)
+
+
+def _complete(router: ProviderRouter) -> ChatResult:
+    return asyncio.run(router.complete([{"role": "user", "content": "hi"}], 100))
+
+
+# ===== ProviderRouter =====
+
+def test_router_prefers_lower_p95_provider():
+    slow = FakeProvider("slow", latency=0.03, reply="slow")
+    fast = FakeProvider("fast", latency=0.001, reply="fast")
+    router = _router(slow, fast)
+
+    async def run():
+        return [(await router.complete([{"role": "user", "content": "hi"}], 100)).text
+                for _ in range(ProviderRouter.MIN_SAMPLES * 2 + 4)]
+
+    results = asyncio.run(run())
+    # 樣本不足時依設定順序輪流取得樣本，之後固定選擇 p95 較低的供應商
+    assert results[-4:] == ["fast"] * 4
+    assert [p.name for p in router.ranked()] == ["fast", "slow"]
+    stats = router.stats()
+    assert stats["order"] == ["fast", "slow"]
+    assert stats["providers"]["fast"]["p95_ms"] < stats["providers"]["slow"]["p95_ms"]
+
+
+def test_router_skips_unhealthy_provider_even_if_faster():
+    flaky = FakeProvider("flaky", latency=0.001, fail=True)
+    steady = FakeProvider("steady", latency=0.01, reply="steady")
+    router = _router(flaky, steady)
+
+    for _ in range(ProviderRouter.MIN_SAMPLES + 2):
+        assert _complete(router).text == "steady"
+    # 錯誤率超過上限的供應商排在最後，不再優先嘗試
+    assert [p.name for p in router.ranked()] == ["steady", "flaky"]
+    calls = flaky.calls
+    _complete(router)
+    assert flaky.calls == calls
+
+
+def test_router_fails_over_on_error():
+    broken = FakeProvider("broken", fail=True)
+    backup = FakeProvider("backup", reply="backup")
+    router = _router(broken, backup)
+
+    assert _complete(router).text == "backup"
+    stats = router.stats()
+    assert stats["failovers"] == 1
+    assert stats["providers"]["broken"]["error_rate"] == 1.0
+    assert stats["providers"]["backup"]["error_rate"] == 0.0
+
+
+def test_router_fails_over_on_timeout():
+    hanging = FakeProvider("hanging", latency=1.0)
+    backup = FakeProvider("backup", reply="backup")
+    router = _router(hanging, backup, attempt_timeout=0.05)
+
+    assert _complete(router).text == "backup"
+    assert router.stats()["providers"]["hanging"]["error_rate"] == 1.0
+
+
+def test_router_raises_when_all_providers_fail():
+    router = _router(FakeProvider("a", fail=True), FakeProvider("b", fail=True))
+
+    with pytest.raises(RuntimeError, match="b 失敗"):
+        _complete(router)
+
+
+def test_stream_fails_over_before_first_chunk():
+    broken = FakeProvider("broken", fail=True)
+    backup = FakeProvider("backup", reply="hello world")
+    router = _router(broken, backup)
+
+    assert asyncio.run(_collect(router)) == "hello world "
+    assert router.stats()["failovers"] == 1
+
+
+def test_stream_does_not_fail_over_after_first_chunk():
+    # 已送出的內容無法收回，第一段之後的錯誤直接拋出，不改用其他供應商（避免內容重複）
+    partial = FakeProvider("partial", reply="hello world", fail_after_chunks=1)
+    backup = FakeProvider("backup", reply="backup")
+    router = _router(partial, backup)
+
+    with pytest.raises(RuntimeError, match="串流中斷"):
+        asyncio.run(_collect(router))
+    assert backup.calls == 0
+    assert router.stats()["failovers"] == 0
+
+
+# ===== GeminiService 與 Groq 的輸出契約 =====
+
+def _generate(service: AsyncGroqService, chapter_mode: str):
+    async def run():
+        outline = await service.generate_outline("自然", "七年級", "速率", use_cache=False)
+        content = await service.generate_content("自然", "七年級", "速率", outline.model_dump(),
+                                                 use_cache=False, chapter_mode=chapter_mode)
+        return outline, content
+    return asyncio.run(run())
+
+
+@pytest.mark.parametrize("chapter_mode", ["separate", "combined"])
+def test_gemini_service_matches_groq_contract(chapter_mode):
+    groq = AsyncGroqService(provider=ScriptedProvider("groq"))
+    gemini = GeminiService(provider=ScriptedProvider("gemini", fenced=True))
+
+    groq_outline, groq_content = _generate(groq, chapter_mode)
+    gemini_outline, gemini_content = _generate(gemini, chapter_mode)
+
+    assert isinstance(gemini_outline, Outline)
+    assert dump_outline(gemini_outline) == dump_outline(groq_outline)
+    assert [c.chapter_number for c in gemini_outline.chapters] == [1, 2, 3]
+
+    data = json.loads(gemini_content)
+    assert data == json.loads(groq_content)
+    assert set(data) == {"title", "objectives", "chapters"}
+    for chapter in data["chapters"]:
+        assert set(chapter) == {"chapter_number", "title", "topics", "description",
+                                "content", "questions"}
+        # LaTeX 格式由服務統一修正，與供應商無關
+        assert "$v = \\frac{d}{t}$" in chapter["content"]
+        assert "$5\\text{ m/s}$" in chapter["questions"]
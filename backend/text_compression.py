@@ -0,0 +1,220 @@
+import struct
+import zlib
+from collections import Counter
+from typing import Dict, Iterable, Optional, Union
+
+from sqlalchemy import Text
+from sqlalchemy.types import TypeDecorator
+
+from config import settings
+
+try:
+    import zstandard
+except ImportError:  # 選用套件：只有 TEXT_COMPRESSION=zstd 時才需要安裝
+    zstandard = None
+
+# 壓縮後的格式：編碼（z = zlib、s = zstd）+ 字典編號（字典內容的 crc32，0 表示不使用字典）+ 壓縮資料
+_HEADER = struct.Struct(">cI")
+_ZLIB = b"z"
+_ZSTD = b"s"
+
+# 內建的預設字典：教材、練習題與大綱中反覆出現的片段（zlib 的預設字典越靠後的片段越常用）
+# 短文字（單一章節約 2–4 KB）單獨壓縮時沒有可參照的前文，預設字典可提高壓縮率
+BUILTIN_DICTIONARY = "\n".join([
+    '{"title":"', '","objectives":["', '"],"chapters":[{"chapter_number":',
+    ',"title":"', '","topics":["', '","description":"', '"]},{"chapter_number":',
+    "本章節介紹", "學習目標", "能理解", "能運用", "能說明", "基本概念", "生活中的應用",
+    "| 項目 | 說明 |\n|------|------|\n", "| 單位 | 符號 |\n",
+    "## 概念說明\n", "### 重點整理\n", "### 生活實例\n", "### 例題\n", "### 解題步驟\n",
+    "### 小結\n", "**例題：**", "**解：**", "**注意：**", "**重點：**",
+    "根據公式", "因此", "所以", "例如", "也就是說", "計算步驟", "單位換算",
+    "$\\frac{", "}{", "\\times ", "\\div ", "\\text{ ", "\\text{ m}", "\\text{ km}", "\\text{ s}",
+    "\\text{ h}", "\\text{ km/h}", "\\text{ m/s}", "\\sqrt{", "^2", "$$\n", "$$",
+    "## 第1題（概念題）\n", "## 第2題（應用題）\n", "## 第3題（計算題）\n",
+    "## 第4題（選擇題）\n", "## 第5題（選擇題）\n",
+    "\nA) ", "\nB) ", "\nC) ", "\nD) ",
+    "\n\n**正確答案：** A\n\n**詳細解析：**\n",
+    "\n\n**正確答案：** B\n\n**詳細解析：**\n",
+    "\n\n**正確答案：** C\n\n**詳細解析：**\n",
+    "\n\n**正確答案：** D\n\n**詳細解析：**\n",
+    "\n\n---\n\n## 第", "題（選擇題）\n", "題（計算題）\n", "題（應用題）\n",
+]).encode("utf-8")
+
+
+def _dictionary_id(dictionary: Optional[bytes]) -> int:
+    return zlib.crc32(dictionary) if dictionary else 0
+
+
+class TextCodec:
+    """
+    文字壓縮與解壓縮：method 為 none / zlib / zstd，dictionary 為寫入時使用的預設字典
+    讀取時依資料中的字典編號選擇字典，因此更換字典或壓縮方法後舊資料仍可讀取
+    （但使用過的字典檔必須保留）；短於 min_bytes 的文字不壓縮
+    """
+
+    def __init__(self, method: str = "zlib", level: int = 6, min_bytes: int = 256,
+                 dictionary: Optional[bytes] = BUILTIN_DICTIONARY,
+                 extra_dictionaries: Iterable[bytes] = ()):
+        if method not in ("none", "zlib", "zstd"):
+            raise ValueError(f"不支援的壓縮方法：{method}")
+        if method == "zstd" and zstandard is None:
+            raise RuntimeError("TEXT_COMPRESSION=zstd 需要安裝 zstandard 套件")
+        self.method = method
+        self.level = level
+        self.min_bytes = min_bytes
+        self.dictionary = dictionary or None
+        self.dictionary_id = _dictionary_id(self.dictionary)
+        self._dictionaries: Dict[int, bytes] = {_dictionary_id(BUILTIN_DICTIONARY): BUILTIN_DICTIONARY}
+        for extra in (self.dictionary, *extra_dictionaries):
+            if extra:
+                self._dictionaries[_dictionary_id(extra)] = extra
+        self._zstd_compressor = None
+        self._zstd_decompressors = {}
+
+    @classmethod
+    def from_settings(cls) -> "TextCodec":
+        dictionary = BUILTIN_DICTIONARY
+        if settings.TEXT_COMPRESSION_DICT:
+            with open(settings.TEXT_COMPRESSION_DICT, "rb") as f:
+                dictionary = f.read()
+        return cls(settings.TEXT_COMPRESSION, settings.TEXT_COMPRESSION_LEVEL,
+                   settings.TEXT_COMPRESSION_MIN_BYTES, dictionary)
+
+    def _zstd_dict(self, dictionary: Optional[bytes]):
+        return zstandard.ZstdCompressionDict(dictionary) if dictionary else None
+
+    def encode(self, text: str) -> Union[str, bytes]:
+        """
+        壓縮文字；未啟用壓縮、文字太短或壓縮後沒有變小時返回原文字
+        """
+        data = text.encode("utf-8")
+        if self.method == "none" or len(data) < self.min_bytes:
+            return text
+        if self.method == "zlib":
+            if self.dictionary:
+                compressor = zlib.compressobj(self.level, zdict=self.dictionary)
+            else:
+                compressor = zlib.compressobj(self.level)
+            payload = compressor.compress(data) + compressor.flush()
+            header = _HEADER.pack(_ZLIB, self.dictionary_id)
+        else:
+            if self._zstd_compressor is None:
+                self._zstd_compressor = zstandard.ZstdCompressor(
+                    level=self.level, dict_data=self._zstd_dict(self.dictionary)
+                )
+            payload = self._zstd_compressor.compress(data)
+            header = _HEADER.pack(_ZSTD, self.dictionary_id)
+        if len(header) + len(payload) >= len(data):
+            return text
+        return header + payload
+
+    def decode(self, value: Union[str, bytes, None]) -> Optional[str]:
+        """
+        還原文字：未壓縮的文字（str）原樣返回
+        """
+        if value is None or isinstance(value, str):
+            return value
+        value = bytes(value)
+        method, dictionary_id = _HEADER.unpack_from(value)
+        payload = value[_HEADER.size:]
+        dictionary = None
+        if dictionary_id:
+            dictionary = self._dictionaries.get(dictionary_id)
+            if dictionary is None:
+                raise ValueError(f"找不到壓縮字典 {dictionary_id:08x}，請設定 TEXT_COMPRESSION_DICT")
+        if method == _ZLIB:
+            decompressor = zlib.decompressobj(zdict=dictionary) if dictionary else zlib.decompressobj()
+            data = decompressor.decompress(payload) + decompressor.flush()
+        elif method == _ZSTD:
+            if zstandard is None:
+                raise RuntimeError("資料以 zstd 壓縮，需要安裝 zstandard 套件")
+            decompressor = self._zstd_decompressors.get(dictionary_id)
+            if decompressor is None:
+                decompressor = zstandard.ZstdDecompressor(dict_data=self._zstd_dict(dictionary))
+                self._zstd_decompressors[dictionary_id] = decompressor
+            data = decompressor.decompress(payload)
+        else:
+            raise ValueError(f"無法辨識的壓縮格式：{method!r}")
+        return data.decode("utf-8")
+
+
+_codec: Optional[TextCodec] = None
+
+
+def get_codec() -> TextCodec:
+    global _codec
+    if _codec is None:
+        _codec = TextCodec.from_settings()
+    return _codec
+
+
+def set_codec(codec: TextCodec):
+    """
+    更換寫入使用的壓縮設定（例如遷移工具比較不同格式時）
+    """
+    global _codec
+    _codec = codec
+
+
+def decode_text(value: Union[str, bytes, None]) -> Optional[str]:
+    """
+    以原始 SQL 讀取壓縮欄位時使用（ORM 與 select(欄位) 會自動解壓縮）
+    """
+    return get_codec().decode(value)
+
+
+class CompressedText(TypeDecorator):
+    """
+    透明壓縮的 Text 欄位：寫入時壓縮為二進位資料，讀取時解壓縮，應用程式一律使用 str
+    SQLite 的欄位不限型別，既有的 TEXT 欄位可直接存放 BLOB，不需變更資料表；
+    尚未壓縮的舊資料原樣讀取，可用 compress_cli.py 逐批轉換
+    只有實際選取的欄位才會解壓縮（列表查詢只選取中繼資料或 IS NOT NULL，不會解壓縮內容）
+    其他資料庫的 TEXT 欄位無法存放二進位資料，維持不壓縮
+    """
+    impl = Text
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None or dialect.name != "sqlite":
+            return value
+        return get_codec().encode(value)
+
+    def process_result_value(self, value, dialect):
+        return decode_text(value)
+
+
+def train_dictionary(samples: Iterable[str], size: int = 16384) -> bytes:
+    """
+    由既有資料建立預設字典
+    有安裝 zstandard 時使用 zstd 的字典訓練；否則選取在多份樣本中重複出現的行，
+    依「出現次數 × 長度」由低到高排列（zlib 的預設字典越靠後越常被參照）
+    """
+    samples = [sample.encode("utf-8") for sample in samples if sample]
+    if not samples:
+        return BUILTIN_DICTIONARY
+    if zstandard is not None and len(samples) >= 8:
+        try:
+            return zstandard.train_dictionary(size, samples).as_bytes()
+        except zstandard.ZstdError:
+            # 樣本太少或太相似時無法訓練，改用下方的方法
+            pass
+
+    counts: Counter = Counter()
+    for sample in samples:
+        # 同一份樣本中重複的行只計一次，避免單一長文主導字典
+        counts.update({line.strip() for line in sample.split(b"\n") if len(line.strip()) >= 4})
+    common = [(line, count) for line, count in counts.items() if count >= 2]
+    common.sort(key=lambda item: item[1] * len(item[0]), reverse=True)
+
+    selected = []
+    total = 0
+    for line, _ in common:
+        if total + len(line) + 1 > size:
+            continue
+        selected.append(line)
+        total += len(line) + 1
+    trained = b"\n".join(reversed(selected))
+    # 剩餘空間放入內建字典（排在前面，較少被參照）
+    room = size - len(trained) - 1
+    prefix = BUILTIN_DICTIONARY[-room:] if room > 0 else b""
+    return prefix + b"\n" + trained
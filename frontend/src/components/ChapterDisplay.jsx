@@ -20,10 +20,10 @@ const ChapterDisplay = ({
   const [regenLoading, setRegenLoading] = React.useState(false);
 
   const handleRegenerate = async () => {
-    if (!generationId || !outline) return;
+    if (!generationId) return;
     setRegenLoading(true);
     try {
-      const res = await import('../services/api').then(m => m.regenerateChapter(generationId, chapter.chapter_number, outline));
+      const res = await import('../services/api').then(m => m.regenerateChapter(generationId, chapter.chapter_number));
       if (res?.chapter && onChapterUpdate) {
         onChapterUpdate(res.chapter);
       }
@@ -3,6 +3,8 @@ import { getHistory, getHistoryItem, deleteHistoryItem } from '../services/api';
 
 const History = ({ onSelectItem }) => {
   const [history, setHistory] = useState([]);
+  const [nextCursor, setNextCursor] = useState(null);
+  const [loadingMore, setLoadingMore] = useState(false);
   const [loading, setLoading] = useState(true);
   const [error, setError] = useState(null);
   const [searchTerm, setSearchTerm] = useState('');
@@ -15,7 +17,8 @@ const History = ({ onSelectItem }) => {
     try {
       setLoading(true);
       const data = await getHistory();
-      setHistory(data);
+      setHistory(data.items);
+      setNextCursor(data.next_cursor);
       setError(null);
     } catch (err) {
       setError('載入歷史記錄失敗');
@@ -25,6 +28,20 @@ const History = ({ onSelectItem }) => {
     }
   };
 
+  const loadMore = async () => {
+    if (!nextCursor) return;
+    try {
+      setLoadingMore(true);
+      const data = await getHistory({ cursor: nextCursor });
+      setHistory((prev) => [...prev, ...data.items]);
+      setNextCursor(data.next_cursor);
+    } catch (err) {
+      console.error('載入更多歷史記錄失敗:', err);
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
   const handleSelectItem = async (id) => {
     try {
       const item = await getHistoryItem(id);
@@ -125,13 +142,13 @@ const History = ({ onSelectItem }) => {
                   </p>
                 </div>
                 <div className="flex gap-2">
-                  {item.outline && (
+                  {item.has_outline && (
                     <span className="w-2 h-2 bg-blue-500 rounded-full" title="已有大綱"></span>
                   )}
-                  {item.content && (
+                  {item.has_content && (
                     <span className="w-2 h-2 bg-green-500 rounded-full" title="已有教材"></span>
                   )}
-                  {item.questions && (
+                  {item.has_questions && (
                     <span className="w-2 h-2 bg-purple-500 rounded-full" title="已有題目"></span>
                   )}
                   <button
@@ -147,6 +164,17 @@ const History = ({ onSelectItem }) => {
               </div>
             </div>
           ))}
+          {nextCursor && (
+            <div className="text-center">
+              <button
+                onClick={loadMore}
+                disabled={loadingMore}
+                className="text-primary-600 hover:text-primary-800 font-medium"
+              >
+                {loadingMore ? '載入中...' : '載入更多'}
+              </button>
+            </div>
+          )}
         </div>
       )}
     </div>
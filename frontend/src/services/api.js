@@ -36,11 +36,60 @@ export const generateContent = async (generationId, outline) => {
   }
 };
 
-export const generateQuestions = async (generationId, content) => {
+// 串流生成教材：以 Server-Sent Events 接收各章節即時生成的 token
+// onEvent(event, data) 會依序收到 start / chapter_start / token / chapter_end / done / error 事件
+export const generateContentStream = async (generationId, outline, onEvent) => {
+  const response = await fetch(`${API_BASE_URL}/api/generate-content/stream`, {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json' },
+    body: JSON.stringify({ generation_id: generationId, outline }),
+  });
+  if (!response.ok) {
+    throw new Error(`串流生成教材失敗: ${response.status}`);
+  }
+
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder('utf-8');
+  let buffer = '';
+  let result = null;
+
+  while (true) {
+    const { done, value } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+
+    // 事件之間以空行分隔
+    let boundary;
+    while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+      const rawEvent = buffer.slice(0, boundary);
+      buffer = buffer.slice(boundary + 2);
+
+      let event = 'message';
+      let data = '';
+      rawEvent.split('\n').forEach((line) => {
+        if (line.startsWith('event:')) event = line.slice(6).trim();
+        else if (line.startsWith('data:')) data += line.slice(5).trim();
+      });
+      const payload = data ? JSON.parse(data) : {};
+
+      if (event === 'error') {
+        throw new Error(payload.detail || '串流生成教材失敗');
+      }
+      if (event === 'done') {
+        result = payload;
+      }
+      if (onEvent) onEvent(event, payload);
+    }
+  }
+
+  return result;
+};
+
+// 教材由後端依 generation_id 從資料庫讀取，不需送回整份內容
+export const generateQuestions = async (generationId) => {
   try {
     const response = await api.post('/api/generate-questions', {
       generation_id: generationId,
-      content,
     });
     return response.data;
   } catch (error) {
@@ -59,9 +108,12 @@ export const getGenerationProgress = async (generationId) => {
   }
 };
 
-export const getHistory = async () => {
+// 分頁取得歷史記錄摘要，返回 { items, next_cursor }
+export const getHistory = async ({ cursor, limit = 20, subject, grade } = {}) => {
   try {
-    const response = await api.get('/api/history');
+    const response = await api.get('/api/history', {
+      params: { cursor, limit, subject, grade },
+    });
     return response.data;
   } catch (error) {
     console.error('取得歷史記錄失敗:', error);
@@ -89,12 +141,12 @@ export const deleteHistoryItem = async (id) => {
   }
 };
 
-export const regenerateChapter = async (generationId, chapterNumber, outline) => {
+// 大綱由後端依 generation_id 從資料庫讀取
+export const regenerateChapter = async (generationId, chapterNumber) => {
   try {
     const response = await api.post('/api/regenerate-chapter', {
       generation_id: generationId,
       chapter_number: chapterNumber,
-      outline,
     });
     return response.data;
   } catch (error) {